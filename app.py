@@ -10,6 +10,8 @@ import signal
 from integrations.telegram import main as telegram_main, bot
 from services.scheduler import DailyReminderScheduler
 from services.gpt_service import close_openai_client
+from storage.connection import close_connections
+from storage.async_db import close_async_connections, flush_message_journal
 from config import SchedulerConfig, LoggingConfig
 
 # Настройка логирования
@@ -44,8 +46,17 @@ async def stop_application():
         logger.info("Планировщик остановлен")
     
     # Закрываем OpenAI клиент
-    close_openai_client()
+    await close_openai_client()
     logger.info("OpenAI клиент закрыт")
+    
+    # Записываем очередь отложенной записи сообщений
+    flushed = await flush_message_journal()
+    logger.info(f"Записано сообщений из очереди: {flushed}")
+    
+    # Закрываем соединения с базой данных
+    await close_async_connections()
+    close_connections()
+    logger.info("Соединения с базой данных закрыты")
 
 if __name__ == "__main__":
     logger.info("Запуск Telegram бота 'Эмо-друг'...")
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для переноса старых сообщений в сжатый архив.
+
+Запуск: python archive_messages.py [дней]
+По умолчанию используется срок хранения из DatabaseConfig.MESSAGE_RETENTION_DAYS.
+Та же операция ежедневно выполняется планировщиком бота.
+"""
+
+import sys
+import os
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import DatabaseConfig
+from storage.db import initialize_database
+from storage.archive import archive_old_messages, get_archive_stats
+
+def main():
+    days = DatabaseConfig.MESSAGE_RETENTION_DAYS
+    if len(sys.argv) > 1:
+        try:
+            days = int(sys.argv[1])
+        except ValueError:
+            print("❌ Неверный формат количества дней")
+            return
+
+    initialize_database()
+
+    print(f"🗄️ Перенос в архив сообщений старше {days} дней...")
+    print("=" * 60)
+
+    result = archive_old_messages(days)
+    print(f"   📅 Граница: {result['cutoff']}")
+    print(f"   📝 Перенесено сообщений: {result['archived_messages']}")
+    print(f"   📦 Обновлено блоков: {result['archived_blocks']}")
+
+    stats = get_archive_stats()
+    print(f"\n📊 Архив: {stats['messages']} сообщений в {stats['blocks']} блоках, {stats['compressed_bytes'] / 1024:.1f} КБ")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для резервного копирования базы данных.
+
+Копия снимается через online backup API и не мешает работающему боту.
+Запуск: python backup_database.py [--list | --verify путь]
+Та же операция ежедневно выполняется планировщиком бота.
+"""
+
+import sys
+import os
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import DatabaseConfig
+from storage.backup import backup_database, list_backups, verify_backup
+
+def print_backups():
+    backups = list_backups()
+    if not backups:
+        print(f"📭 В каталоге {DatabaseConfig.BACKUP_DIR} нет резервных копий")
+        return
+    print(f"📦 Резервные копии в {DatabaseConfig.BACKUP_DIR}:")
+    for path in backups:
+        print(f"   {os.path.basename(path)}  {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+
+def main():
+    if "--list" in sys.argv:
+        print_backups()
+        return
+
+    if "--verify" in sys.argv:
+        index = sys.argv.index("--verify")
+        if index + 1 >= len(sys.argv):
+            print("❌ Укажите путь к резервной копии")
+            return
+        path = sys.argv[index + 1]
+        if verify_backup(path):
+            print(f"✅ Копия {path} прошла проверку integrity_check")
+        else:
+            print(f"❌ Копия {path} повреждена")
+        return
+
+    print(f"💾 Резервное копирование {DatabaseConfig.DB_PATH}...")
+    print("=" * 60)
+
+    result = backup_database()
+    print(f"   📁 Копия: {result['path']}")
+    print(f"   📏 Размер: {result['size_bytes'] / 1024 / 1024:.1f} МБ")
+    print(f"   ⏱️ Время: {result['seconds']:.1f} с, перезапусков копирования: {result['restarts']}")
+    if result['single_step']:
+        print("   ⚠️ База часто менялась, копия снята за один шаг")
+    print("   ✅ Проверка integrity_check пройдена")
+    for path in result['removed']:
+        print(f"   🗑️ Удалена старая копия: {os.path.basename(path)}")
+
+    print()
+    print_backups()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение локального классификатора эмоций с разметкой GPT.
+
+Разметка (EmotionConfig.LABELS_PATH, см. train_emotion_classifier.py)
+делится на обучающую и проверочную части (каждое пятое сообщение по
+хэшу текста - проверочное). Модель обучается на первой части и
+проверяется на второй; для сравнения проверяются правила по ключевым
+словам без модели. Выводятся:
+- совпадение с GPT по всем сообщениям и по эмоциям;
+- для порогов уверенности - доля сообщений, решенных локально, и
+  совпадение с GPT (остальные сообщения по-прежнему уходят в GPT);
+- время локальной классификации и время ответа GPT при разметке.
+
+Запуск: python benchmark_emotion_classifier.py [разметка.jsonl]
+"""
+
+import os
+import sys
+import json
+import time
+import zlib
+from collections import Counter
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import EmotionConfig
+from services.emotion_classifier import EmotionClassifier, classify_emotion, set_emotion_classifier, read_labels, EMOTIONS
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99)
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def is_test(text: str) -> bool:
+    """Каждое пятое сообщение (по хэшу текста) - в проверочной части"""
+    return zlib.crc32(text.encode('utf-8')) % 5 == 0
+
+def evaluate(test: list, classifier) -> dict:
+    """Классифицирует проверочные сообщения через classify_emotion с заданной моделью"""
+    set_emotion_classifier(classifier)
+    predictions = []
+    timings_us = []
+    for entry in test:
+        started = time.perf_counter()
+        label, confidence = classify_emotion(entry['text'])
+        timings_us.append((time.perf_counter() - started) * 1_000_000)
+        predictions.append((label, confidence, entry['label']))
+    set_emotion_classifier(None)
+
+    thresholds = []
+    for threshold in THRESHOLDS:
+        local = [(label, expected) for label, confidence, expected in predictions if confidence >= threshold]
+        correct = sum(1 for label, expected in local if label == expected)
+        thresholds.append({
+            'threshold': threshold,
+            'coverage': len(local) / len(predictions),
+            'local_accuracy': correct / len(local) if local else 0.0,
+            # Несовпадения возможны только среди решенных локально
+            'hybrid_accuracy': 1 - (len(local) - correct) / len(predictions)
+        })
+
+    per_label = {}
+    for emotion in EMOTIONS:
+        relevant = [(label, expected) for label, _, expected in predictions if expected == emotion]
+        if relevant:
+            per_label[emotion] = {
+                'count': len(relevant),
+                'recall': sum(1 for label, expected in relevant if label == expected) / len(relevant)
+            }
+
+    return {
+        'accuracy': sum(1 for label, _, expected in predictions if label == expected) / len(predictions),
+        'p50_us': percentile(timings_us, 0.5),
+        'p99_us': percentile(timings_us, 0.99),
+        'max_us': max(timings_us),
+        'thresholds': thresholds,
+        'per_label': per_label
+    }
+
+def print_result(title: str, result: dict, gpt_ms: float):
+    print(f"   {title}")
+    print(f"      🎯 Совпадение с GPT: {result['accuracy']:.1%}")
+    print(
+        f"      ⏱️ Время: p50 {result['p50_us']:.0f} / p99 {result['p99_us']:.0f} / "
+        f"max {result['max_us']:.0f} мкс"
+    )
+    print("      Порог | локально | точность локально | итоговая точность | среднее время")
+    for item in result['thresholds']:
+        mean_ms = item['coverage'] * result['p50_us'] / 1000 + (1 - item['coverage']) * gpt_ms
+        mark = " ◀" if item['threshold'] == EmotionConfig.CONFIDENCE_THRESHOLD else ""
+        print(
+            f"      {item['threshold']:.2f}  | {item['coverage']:7.1%}  | {item['local_accuracy']:16.1%}  | "
+            f"{item['hybrid_accuracy']:16.1%}  | {mean_ms:7.0f} мс{mark}"
+        )
+    print("      По эмоциям (полнота): " + ", ".join(
+        f"{emotion} {item['recall']:.0%} ({item['count']})" for emotion, item in result['per_label'].items()
+    ))
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else EmotionConfig.LABELS_PATH
+    labels = read_labels(path)
+    if not labels:
+        print(f"❌ Нет разметки {path}. Сначала запустите train_emotion_classifier.py")
+        return
+
+    train = [entry for entry in labels if not is_test(entry['text'])]
+    test = [entry for entry in labels if is_test(entry['text'])]
+    if not train or not test:
+        print("❌ Слишком мало размеченных сообщений")
+        return
+
+    gpt_timings = [entry['gpt_ms'] for entry in labels if entry.get('gpt_ms')]
+    gpt_ms = sum(gpt_timings) / len(gpt_timings) if gpt_timings else 0.0
+
+    print(f"📊 Классификатор эмоций: обучение {len(train)}, проверка {len(test)} сообщений")
+    print("=" * 60)
+    print("   Эмоции по GPT: " + ", ".join(f"{label} {count}" for label, count in Counter(entry['label'] for entry in labels).most_common()))
+    print(f"   🤖 GPT: среднее {gpt_ms:.0f} мс, p95 {percentile(gpt_timings, 0.95):.0f} мс на сообщение")
+    print()
+
+    classifier = EmotionClassifier.train((entry['text'], entry['label']) for entry in train)
+    model = evaluate(test, classifier)
+    rules = evaluate(test, False)
+
+    print_result("📏 Правила по ключевым словам", rules, gpt_ms)
+    print()
+    print_result("🧠 Наивный Байес", model, gpt_ms)
+
+    print()
+    print(json.dumps({
+        'train': len(train),
+        'test': len(test),
+        'gpt_mean_ms': round(gpt_ms, 1),
+        'rules': rules,
+        'model': model
+    }, ensure_ascii=False))
+
+if __name__ == "__main__":
+    main()
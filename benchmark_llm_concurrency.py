@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Нагрузочный тест параллельных разговоров с моделью.
+
+Запросы к OpenAI подменяются транспортом httpx, который отвечает с задержкой
+LATENCY секунд, как настоящая модель. Сначала запускается один разговор
+(chat_with_gpt: определение эмоции + ответ), затем N разговоров одновременно.
+С общим асинхронным клиентом N разговоров занимают примерно столько же
+времени, сколько один, пока N не превышает лимит планировщика запросов
+(OpenAIConfig.CONCURRENCY_*); дальше разговоры ждут в очереди своей полосы
+приоритета. Разговоры делятся на полосы (каждый десятый - кризисный,
+каждый третий - премиум), для каждой выводится время ожидания в очереди.
+Для сравнения показан прежний синхронный клиент, с которым разговоры
+выполняются по очереди.
+
+Запуск: python benchmark_llm_concurrency.py [разговоров] [задержка_мс]
+По умолчанию 50 разговоров, задержка 500 мс. Сеть и ключ API не нужны.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import httpx
+from openai import OpenAI
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import OpenAIConfig
+from services.gpt_service import (
+    create_openai_client, set_openai_client, close_openai_client, chat_with_gpt,
+    llm_scheduler, select_lane, LANES
+)
+
+# Ответ модели в формате chat.completion
+COMPLETION = {
+    "id": "chatcmpl-benchmark",
+    "object": "chat.completion",
+    "created": 0,
+    "model": OpenAIConfig.MODEL,
+    "choices": [{
+        "index": 0,
+        "message": {"role": "assistant", "content": "нейтральное"},
+        "finish_reason": "stop"
+    }],
+    "usage": {"prompt_tokens": 10, "completion_tokens": 1, "total_tokens": 11}
+}
+
+class MockModel:
+    """Ответы модели с задержкой; считает запросы и максимум одновременных"""
+
+    def __init__(self, latency: float):
+        self.latency = latency
+        self.requests = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _enter(self):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    async def handle_async(self, request: httpx.Request) -> httpx.Response:
+        self._enter()
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return httpx.Response(200, json=COMPLETION)
+
+    def handle_sync(self, request: httpx.Request) -> httpx.Response:
+        self._enter()
+        try:
+            time.sleep(self.latency)
+        finally:
+            self.in_flight -= 1
+        return httpx.Response(200, json=COMPLETION)
+
+def conversation_lane(i: int) -> str:
+    """Полоса приоритета i-го разговора"""
+    return select_lane(premium=i % 3 == 1, crisis=i % 10 == 9)
+
+async def run_conversations(count: int) -> float:
+    """Запускает count разговоров одновременно; возвращает время в секундах"""
+    started = time.perf_counter()
+    responses = await asyncio.gather(*(
+        chat_with_gpt(f"Сообщение {i}: мне сегодня как-то не по себе", user_id=i, lane=conversation_lane(i))
+        for i in range(count)
+    ))
+    elapsed = time.perf_counter() - started
+    failed = sum(1 for response in responses if response.startswith("Извини,"))
+    if failed:
+        print(f"   ⚠️ Ошибок: {failed}")
+    return elapsed
+
+async def run_blocking_conversations(count: int, model: MockModel) -> float:
+    """Прежний вариант: синхронный клиент внутри обработчиков блокирует цикл событий"""
+    client = OpenAI(api_key="benchmark", http_client=httpx.Client(transport=httpx.MockTransport(model.handle_sync)))
+
+    async def conversation(i: int):
+        for _ in range(2):
+            client.chat.completions.create(
+                model=OpenAIConfig.MODEL,
+                messages=[{"role": "user", "content": f"Сообщение {i}"}]
+            )
+
+    started = time.perf_counter()
+    await asyncio.gather(*(conversation(i) for i in range(count)))
+    elapsed = time.perf_counter() - started
+    client.close()
+    return elapsed
+
+def print_result(title: str, seconds: float, model: MockModel):
+    print(f"   {title}")
+    print(f"      ⏱️ Время: {seconds:.2f} с, запросов: {model.requests}, одновременно до {model.max_in_flight}")
+
+def print_lanes(stats: dict):
+    print(f"      🚦 Лимит планировщика: {stats['limit']:.1f}")
+    for lane in LANES:
+        item = stats['lanes'][lane]
+        if item['submitted']:
+            print(
+                f"      • {lane}: {item['submitted']} запросов, ожидание в очереди "
+                f"p50 {item['p50_wait_ms']:.0f} / p95 {item['p95_wait_ms']:.0f} / max {item['max_wait_ms']:.0f} мс"
+            )
+
+async def main():
+    try:
+        count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+        latency = (int(sys.argv[2]) if len(sys.argv) > 2 else 500) / 1000
+    except ValueError:
+        print("❌ Неверный формат параметров")
+        return
+
+    print(f"🏁 Параллельные разговоры: {count}, задержка модели {latency * 1000:.0f} мс")
+    print("=" * 60)
+
+    model = MockModel(latency)
+    set_openai_client(create_openai_client(api_key="benchmark", transport=httpx.MockTransport(model.handle_async)))
+    try:
+        single = await run_conversations(1)
+        print_result("👤 Один разговор", single, model)
+
+        model.requests = model.max_in_flight = 0
+        llm_scheduler.reset_stats()
+        parallel = await run_conversations(count)
+        print_result(f"👥 {count} разговоров одновременно (AsyncOpenAI)", parallel, model)
+        lanes = llm_scheduler.snapshot()
+        print_lanes(lanes)
+    finally:
+        await close_openai_client()
+
+    blocking_count = min(count, 5)
+    blocking_model = MockModel(latency)
+    blocking = await run_blocking_conversations(blocking_count, blocking_model)
+    print_result(f"🐢 {blocking_count} разговоров с синхронным клиентом", blocking, blocking_model)
+
+    print()
+    print(f"📊 {count} разговоров / один: {parallel / single:.2f}x (синхронно было бы ~{count}x)")
+    print(json.dumps({
+        'conversations': count,
+        'latency_ms': latency * 1000,
+        'single_seconds': round(single, 3),
+        'parallel_seconds': round(parallel, 3),
+        'ratio': round(parallel / single, 2),
+        'limit': round(lanes['limit'], 1),
+        'p95_wait_ms': {lane: round(lanes['lanes'][lane]['p95_wait_ms']) for lane in LANES}
+    }, ensure_ascii=False))
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк автопродления подписок: цикл по пользователям против одного UPDATE.
+
+Запуск: python benchmark_renewals.py [премиум_пользователей] [из_них_продлеваются_сегодня]
+По умолчанию 100000 премиум пользователей, у всех подписка истекает сегодня.
+Работает на временной базе, рабочая база не затрагивается.
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import time
+from datetime import date, timedelta
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage.connection import configure_connection
+from storage.migrations import run_migrations
+from storage.db import renew_due_subscriptions, renewal_days
+
+def create_database(path: str, users: int, due: int) -> sqlite3.Connection:
+    """Создает базу с премиум пользователями; due из них продлеваются сегодня"""
+    connection = configure_connection(sqlite3.connect(path))
+    run_migrations(connection)
+
+    today = date.today()
+    later = (today + timedelta(days=10)).isoformat()
+    subscription_types = (1, 7, 30)
+    connection.executemany(
+        """
+        INSERT INTO users (username, telegram_id, premium_status, subscription_end_date, auto_renewal, subscription_type)
+        VALUES (?, ?, TRUE, ?, TRUE, ?)
+        """,
+        (
+            (f"user{i}", 100000000 + i, today.isoformat() if i < due else later, subscription_types[i % 3])
+            for i in range(users)
+        )
+    )
+    connection.commit()
+    return connection
+
+def renew_one_by_one(connection: sqlite3.Connection) -> int:
+    """Прежний способ: выборка пользователей и SELECT + UPDATE + коммит на каждого"""
+    today = date.today()
+    users = connection.execute(
+        """
+        SELECT telegram_id FROM users
+        WHERE auto_renewal = TRUE AND premium_status = TRUE
+        AND subscription_end_date IS NOT NULL AND subscription_end_date = ?
+        """,
+        (today.isoformat(),)
+    ).fetchall()
+
+    for (telegram_id,) in users:
+        subscription_type = connection.execute(
+            "SELECT subscription_type FROM users WHERE telegram_id = ?",
+            (telegram_id,)
+        ).fetchone()[0]
+        new_end_date = today + timedelta(days=renewal_days(subscription_type))
+        connection.execute(
+            "UPDATE users SET subscription_end_date = ?, premium_status = TRUE WHERE telegram_id = ?",
+            (new_end_date.isoformat(), telegram_id)
+        )
+        connection.commit()
+    return len(users)
+
+def snapshot(connection: sqlite3.Connection) -> list:
+    """Даты окончания подписок для сравнения результатов"""
+    return connection.execute("SELECT telegram_id, subscription_end_date FROM users ORDER BY telegram_id").fetchall()
+
+def main():
+    try:
+        users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+        due = int(sys.argv[2]) if len(sys.argv) > 2 else users
+    except ValueError:
+        print("❌ Неверный формат количества пользователей")
+        return
+
+    workdir = tempfile.mkdtemp(prefix="renewal_bench_")
+    try:
+        print(f"🏁 Автопродление: {users} премиум пользователей, продлеваются сегодня: {due}")
+        print("=" * 60)
+
+        connection = create_database(os.path.join(workdir, "loop.sqlite"), users, due)
+        started = time.perf_counter()
+        renewed = renew_one_by_one(connection)
+        loop_seconds = time.perf_counter() - started
+        loop_result = snapshot(connection)
+        connection.close()
+        print(f"   🐢 По одному пользователю: {renewed} продлений за {loop_seconds:.2f} с")
+
+        connection = create_database(os.path.join(workdir, "bulk.sqlite"), users, due)
+        started = time.perf_counter()
+        renewed = renew_due_subscriptions(connection)
+        bulk_seconds = time.perf_counter() - started
+        bulk_result = snapshot(connection)
+        connection.close()
+        print(f"   🚀 Одним UPDATE: {len(renewed)} продлений за {bulk_seconds:.2f} с")
+
+        if loop_result == bulk_result:
+            print("   ✅ Даты окончания подписок совпадают")
+        else:
+            print("   ❌ Результаты различаются!")
+        if bulk_seconds > 0:
+            print(f"\n📊 Ускорение: {loop_seconds / bulk_seconds:.1f}x")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк отчетных запросов под нагрузкой записи.
+
+Поток-"бот" пишет сообщения с коммитом каждые несколько миллисекунд,
+а в это время отчеты (как в служебных скриптах) читают базу через обычное
+соединение и через соединение только для чтения (open_readonly_connection).
+Для каждого режима выводится время отчетов, задержка коммитов бота и
+максимальный размер WAL (растет, если читатели мешают контрольным точкам).
+
+Запуск: python benchmark_reports.py [пользователей] [сообщений] [повторов]
+По умолчанию 5000 пользователей, 300000 сообщений, 3 повтора отчетов.
+Работает на временной базе, рабочая база не затрагивается.
+"""
+
+import os
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import DatabaseConfig
+from storage.connection import configure_connection, open_readonly_connection
+from storage.migrations import run_migrations
+from storage.iterators import iter_messages, count_users
+from storage.rollups import get_role_totals, get_daily_stats, get_top_users
+
+# Пауза между коммитами бота (секунды)
+WRITE_INTERVAL = 0.002
+
+def create_database(path: str, users: int, messages: int):
+    """Создает базу с пользователями и сообщениями за последние 90 дней"""
+    connection = configure_connection(sqlite3.connect(path))
+    run_migrations(connection)
+
+    start = datetime.now() - timedelta(days=90)
+    step = 90 * 24 * 3600 / max(messages, 1)
+    connection.executemany(
+        "INSERT INTO users (username, telegram_id, created_at) VALUES (?, ?, ?)",
+        (
+            (f"user{i}", 100000000 + i, (start + timedelta(seconds=i)).strftime('%Y-%m-%d %H:%M:%S'))
+            for i in range(users)
+        )
+    )
+    connection.executemany(
+        "INSERT INTO messages (user_id, message, role, created_at) VALUES (?, ?, ?, ?)",
+        (
+            (
+                i % users + 1,
+                f"Сообщение {i}: мне сегодня немного тревожно, хочется поговорить",
+                "user" if i % 2 == 0 else "assistant",
+                (start + timedelta(seconds=i * step)).strftime('%Y-%m-%d %H:%M:%S')
+            )
+            for i in range(messages)
+        )
+    )
+    connection.commit()
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.close()
+
+def run_reports(connection: sqlite3.Connection) -> int:
+    """Типичные запросы служебных скриптов; возвращает число прочитанных строк"""
+    rows = 0
+    rows += count_users(connection=connection)
+    rows += len(get_role_totals(connection=connection))
+    rows += len(get_daily_stats(connection=connection))
+    rows += len(get_top_users(5, connection=connection))
+    # Полный проход по сообщениям, как при выгрузке истории
+    rows += sum(1 for _ in iter_messages(connection=connection))
+    # Агрегат по таблице сообщений без сводных таблиц
+    rows += len(connection.execute(
+        "SELECT user_id, COUNT(*), MAX(created_at) FROM messages GROUP BY user_id"
+    ).fetchall())
+    return rows
+
+class BotWriter(threading.Thread):
+    """Имитация записи бота: одно сообщение и коммит каждые WRITE_INTERVAL секунд"""
+
+    def __init__(self, path: str, users: int):
+        super().__init__(daemon=True)
+        self.path = path
+        self.users = users
+        self.stop_event = threading.Event()
+        self.latencies = []
+        self.max_wal_bytes = 0
+
+    def run(self):
+        connection = configure_connection(sqlite3.connect(self.path, timeout=DatabaseConfig.BUSY_TIMEOUT_MS / 1000))
+        wal_path = self.path + "-wal"
+        i = 0
+        while not self.stop_event.is_set():
+            started = time.perf_counter()
+            connection.execute(
+                "INSERT INTO messages (user_id, message, role) VALUES (?, ?, 'user')",
+                (i % self.users + 1, f"Новое сообщение {i}")
+            )
+            connection.commit()
+            self.latencies.append((time.perf_counter() - started) * 1000)
+            if os.path.exists(wal_path):
+                self.max_wal_bytes = max(self.max_wal_bytes, os.path.getsize(wal_path))
+            i += 1
+            time.sleep(WRITE_INTERVAL)
+        connection.close()
+
+    def stop(self):
+        self.stop_event.set()
+        self.join()
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def measure(path: str, users: int, rounds: int, open_connection) -> dict:
+    """Запускает отчеты rounds раз на фоне записи бота"""
+    writer = BotWriter(path, users)
+    writer.start()
+    time.sleep(0.5)
+
+    report_seconds = []
+    if open_connection is None:
+        # Только нагрузка записи, без отчетов
+        time.sleep(2)
+    else:
+        for _ in range(rounds):
+            started = time.perf_counter()
+            connection = open_connection(path)
+            run_reports(connection)
+            connection.close()
+            report_seconds.append(time.perf_counter() - started)
+
+    writer.stop()
+    connection = sqlite3.connect(path)
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.close()
+    return {
+        'report_seconds': report_seconds,
+        'commits': len(writer.latencies),
+        'p50_ms': percentile(writer.latencies, 0.5),
+        'p99_ms': percentile(writer.latencies, 0.99),
+        'max_ms': max(writer.latencies, default=0.0),
+        'max_wal_mb': writer.max_wal_bytes / 1024 / 1024
+    }
+
+def open_read_write(path: str) -> sqlite3.Connection:
+    """Как раньше в скриптах: обычное соединение с настройками по умолчанию"""
+    return sqlite3.connect(path, timeout=10.0)
+
+def print_result(title: str, result: dict):
+    print(f"   {title}")
+    if result['report_seconds']:
+        print(
+            f"      📊 Отчеты: среднее {sum(result['report_seconds']) / len(result['report_seconds']):.2f} с, "
+            f"лучшее {min(result['report_seconds']):.2f} с"
+        )
+    print(
+        f"      ✍️ Коммиты бота: {result['commits']}, p50 {result['p50_ms']:.2f} / "
+        f"p99 {result['p99_ms']:.2f} / max {result['max_ms']:.2f} мс"
+    )
+    print(f"      📈 Максимальный размер WAL: {result['max_wal_mb']:.1f} МБ")
+
+def main():
+    try:
+        users = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+        messages = int(sys.argv[2]) if len(sys.argv) > 2 else 300000
+        rounds = int(sys.argv[3]) if len(sys.argv) > 3 else 3
+    except ValueError:
+        print("❌ Неверный формат параметров")
+        return
+
+    workdir = tempfile.mkdtemp(prefix="reports_bench_")
+    try:
+        path = os.path.join(workdir, "database.sqlite")
+        print(f"🏁 Отчеты под нагрузкой: {users} пользователей, {messages} сообщений, повторов: {rounds}")
+        print("=" * 60)
+        create_database(path, users, messages)
+        print(f"   📏 Размер базы: {os.path.getsize(path) / 1024 / 1024:.1f} МБ")
+        print()
+
+        print_result("🤖 Только запись бота", measure(path, users, rounds, None))
+        print_result("🐢 Отчеты через обычное соединение", measure(path, users, rounds, open_read_write))
+        print_result("🚀 Отчеты через соединение только для чтения", measure(path, users, rounds, open_readonly_connection))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
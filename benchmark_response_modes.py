@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Сравнение режимов ответа chat_with_gpt: two_call и structured.
+
+two_call - отдельный запрос определяет эмоцию, второй генерирует ответ;
+structured - один запрос возвращает JSON с эмоцией, интентом и ответом.
+Локальный классификатор эмоций отключается (порог уверенности выше 1),
+чтобы каждый ход шел через модель. Сообщения отправляются по одному,
+режимы чередуются; для каждого режима выводятся время хода (среднее,
+p50, p95), число запросов и токены на ход.
+
+Запуск: python benchmark_response_modes.py [сообщений] [--mock]
+Сообщения берутся из разметки EmotionConfig.LABELS_PATH, если она есть,
+иначе из встроенного набора. Нужен OPENAI_API_KEY; с --mock (или без
+ключа) модель имитируется: задержка растет с числом токенов ответа.
+"""
+
+import os
+import sys
+import json
+import time
+import asyncio
+import httpx
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import OpenAIConfig, EmotionConfig
+from services.emotion_classifier import read_labels
+from services.classification_cache import emotion_cache
+from services.gpt_service import (
+    chat_with_gpt, create_openai_client, set_openai_client, close_openai_client, token_usage,
+    RESPONSE_MODE_TWO_CALL, RESPONSE_MODE_STRUCTURED
+)
+
+SAMPLE_MESSAGES = [
+    "Меня сегодня опять отчитали на работе при всех, до сих пор трясет",
+    "Не могу уснуть уже третью ночь, все мысли по кругу",
+    "Подскажи, как лучше подготовиться к собеседованию?",
+    "Поссорилась с мамой из-за ерунды и теперь чувствую себя виноватой",
+    "Привет! Как у тебя дела?",
+    "Кажется, я просто выгорела. Ничего не хочется",
+    "Ты вообще понимаешь, что пишешь, или просто набор слов?",
+    "Сегодня наконец сдала экзамен, который так боялась",
+    "Скучаю по бывшему, хотя понимаю, что так лучше",
+    "Какие есть простые способы успокоиться перед выступлением?",
+    "Друг перестал отвечать на сообщения, не понимаю почему",
+    "Устал от бесконечных дедлайнов, выходные тоже уходят на работу"
+]
+
+# Имитация модели: задержка до первого токена и на каждый токен ответа (мс)
+MOCK_FIRST_TOKEN_MS = 300
+MOCK_MS_PER_TOKEN = 15
+MOCK_REPLY = (
+    "Похоже, сегодня был действительно тяжелый день. Такие ситуации выбивают из колеи, "
+    "и это нормально - чувствовать себя растерянно. Давай попробуем разобраться, что задело сильнее всего. "
+    "Я рядом и готов выслушать."
+)
+
+def mock_tokens(text: str) -> int:
+    """Грубая оценка числа токенов для имитации"""
+    return max(1, len(text) // 3)
+
+async def mock_model(request: httpx.Request) -> httpx.Response:
+    body = json.loads(request.content)
+    if body.get("response_format"):
+        content = json.dumps({"emotion": "sadness", "intent": "support", "reply": MOCK_REPLY}, ensure_ascii=False)
+    elif body["messages"][0]["content"].startswith("Проанализируй"):
+        content = "sadness"
+    else:
+        content = MOCK_REPLY
+    completion_tokens = mock_tokens(content)
+    await asyncio.sleep((MOCK_FIRST_TOKEN_MS + MOCK_MS_PER_TOKEN * completion_tokens) / 1000)
+    prompt_tokens = mock_tokens(json.dumps(body["messages"], ensure_ascii=False))
+    return httpx.Response(200, json={
+        "id": "chatcmpl-benchmark",
+        "object": "chat.completion",
+        "created": 0,
+        "model": OpenAIConfig.MODEL,
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+    })
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+async def run_turn(message: str, mode: str) -> dict:
+    """Один ход в заданном режиме: время, запросы и токены"""
+    # Эмоция, закэшированная другим режимом, не должна сокращать запросы
+    emotion_cache.clear()
+    before = dict(token_usage)
+    started = time.perf_counter()
+    reply = await chat_with_gpt(message, mode=mode)
+    elapsed = time.perf_counter() - started
+    return {
+        'seconds': elapsed,
+        'failed': reply.startswith("Извини,"),
+        'requests': token_usage['requests'] - before.get('requests', 0),
+        'prompt_tokens': token_usage['prompt_tokens'] - before.get('prompt_tokens', 0),
+        'completion_tokens': token_usage['completion_tokens'] - before.get('completion_tokens', 0)
+    }
+
+def summarize(turns: list) -> dict:
+    seconds = [turn['seconds'] for turn in turns]
+    count = len(turns)
+    return {
+        'turns': count,
+        'failed': sum(1 for turn in turns if turn['failed']),
+        'mean_ms': sum(seconds) / count * 1000,
+        'p50_ms': percentile(seconds, 0.5) * 1000,
+        'p95_ms': percentile(seconds, 0.95) * 1000,
+        'requests_per_turn': sum(turn['requests'] for turn in turns) / count,
+        'prompt_tokens_per_turn': sum(turn['prompt_tokens'] for turn in turns) / count,
+        'completion_tokens_per_turn': sum(turn['completion_tokens'] for turn in turns) / count
+    }
+
+def print_result(title: str, result: dict):
+    print(f"   {title}")
+    print(f"      ⏱️ Ход: среднее {result['mean_ms']:.0f} / p50 {result['p50_ms']:.0f} / p95 {result['p95_ms']:.0f} мс")
+    print(
+        f"      🔢 На ход: запросов {result['requests_per_turn']:.2f}, токенов "
+        f"{result['prompt_tokens_per_turn']:.0f} в запросах / {result['completion_tokens_per_turn']:.0f} в ответах"
+    )
+    if result['failed']:
+        print(f"      ⚠️ Ошибок: {result['failed']}")
+
+async def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith("--")]
+    mock = "--mock" in sys.argv or not os.getenv("OPENAI_API_KEY")
+    try:
+        count = int(args[0]) if args else len(SAMPLE_MESSAGES)
+    except ValueError:
+        print("❌ Неверный формат параметров")
+        return
+
+    messages = [entry['text'] for entry in read_labels()][:count] or SAMPLE_MESSAGES[:count]
+
+    # Каждый ход идет через модель, без локального классификатора
+    EmotionConfig.CONFIDENCE_THRESHOLD = 1.01
+    if mock:
+        set_openai_client(create_openai_client(api_key="benchmark", transport=httpx.MockTransport(mock_model)))
+
+    print(f"🏁 Режимы ответа: {len(messages)} сообщений, модель {'(имитация)' if mock else OpenAIConfig.MODEL}")
+    print("=" * 60)
+
+    results = {RESPONSE_MODE_TWO_CALL: [], RESPONSE_MODE_STRUCTURED: []}
+    try:
+        for i, message in enumerate(messages):
+            # Режимы чередуются, чтобы колебания задержки API не попадали в один режим
+            modes = list(results) if i % 2 == 0 else list(reversed(list(results)))
+            for mode in modes:
+                results[mode].append(await run_turn(message, mode))
+    finally:
+        await close_openai_client()
+
+    two_call = summarize(results[RESPONSE_MODE_TWO_CALL])
+    structured = summarize(results[RESPONSE_MODE_STRUCTURED])
+    print_result("✌️ two_call: эмоция и ответ отдельными запросами", two_call)
+    print_result("📦 structured: один запрос с JSON", structured)
+
+    print()
+    print(
+        f"📊 structured / two_call: время {structured['mean_ms'] / two_call['mean_ms']:.2f}x, "
+        f"токены {(structured['prompt_tokens_per_turn'] + structured['completion_tokens_per_turn']) / max(1, two_call['prompt_tokens_per_turn'] + two_call['completion_tokens_per_turn']):.2f}x"
+    )
+    print(json.dumps({'mock': mock, 'two_call': two_call, 'structured': structured}, ensure_ascii=False))
+
+if __name__ == "__main__":
+    asyncio.run(main())
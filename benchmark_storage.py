@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Бенчмарк слоя хранения на большой базе.
+
+Замеряет время каждой публичной функции storage (чтение, запись, отчеты)
+и каждого отчета служебных скриптов на рабочей копии указанной базы
+(исходный файл не меняется). Результаты сохраняются в JSON вместе с
+версией кода и параметрами базы, чтобы сравнивать версии между собой.
+
+Запуск: python benchmark_storage.py база [результат.json] [--compare прежний.json]
+Базу для измерений создает generate_test_database.py.
+"""
+
+import os
+import io
+import sys
+import json
+import random
+import shutil
+import sqlite3
+import logging
+import platform
+import subprocess
+import tempfile
+import time
+import importlib
+from contextlib import redirect_stdout
+from datetime import date, datetime, timedelta
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import DatabaseConfig
+from storage.connection import connection_manager, close_connections
+from storage.query_stats import query_stats
+from storage import db, rollups, search, archive, payments, preferences, iterators, history_purge
+
+# Пользователей в выборке и повторов для точечных операций и для отчетов
+SAMPLE_USERS = 200
+CALLS = 200
+REPORT_CALLS = 3
+
+# Во сколько раз должна вырасти медиана, чтобы считать это регрессией
+REGRESSION_RATIO = 1.2
+
+def point(function):
+    """Точечная операция: вызывается CALLS раз для разных пользователей"""
+    return function, CALLS
+
+def report(function):
+    """Отчет по всей базе: вызывается REPORT_CALLS раз"""
+    return function, REPORT_CALLS
+
+def once(function):
+    """Тяжелая операция над всей базой: один вызов"""
+    return function, 1
+
+def storage_benchmarks() -> list:
+    """Публичные функции storage: (группа, имя, (функция от пользователя, вызовов))"""
+    today = date.today().isoformat()
+    week_ago = (date.today() - timedelta(days=7)).isoformat()
+    return [
+        # Чтение
+        ("read", "db.get_user_by_telegram_id", point(lambda user: db.get_user_by_telegram_id(user['telegram_id']))),
+        ("read", "db.is_new_user", point(lambda user: db.is_new_user(user['telegram_id']))),
+        ("read", "db.get_conversation_history", point(lambda user: db.get_conversation_history(user['id']))),
+        ("read", "db.get_user_stats", point(lambda user: db.get_user_stats(user['id']))),
+        ("read", "db.check_daily_message_limit", point(lambda user: db.check_daily_message_limit(user['telegram_id']))),
+        ("read", "db.get_daily_message_count", point(lambda user: db.get_daily_message_count(user['telegram_id']))),
+        ("read", "db.get_user_premium_status", point(lambda user: db.get_user_premium_status(user['telegram_id']))),
+        ("read", "db.get_user_preferences", point(lambda user: db.get_user_preferences(user['telegram_id']))),
+        ("read", "rollups.get_user_totals", point(lambda user: rollups.get_user_totals(user['id']))),
+        ("read", "payments.get_user_payments", point(lambda user: payments.get_user_payments(user['telegram_id']))),
+        ("read", "preferences.get_user_setting", point(lambda user: preferences.get_user_setting(user['telegram_id'], "timezone"))),
+        ("read", "iterators.iter_messages(user)", point(lambda user: sum(1 for _ in iterators.iter_messages(user=user['id'])))),
+        ("read", "archive.get_messages_with_archive(user)", point(lambda user: archive.get_messages_with_archive(user_id=user['id']))),
+        ("read", "search.search_messages(user)", point(lambda user: search.search_messages("тревожно", user=user['id']))),
+        # Отчеты по всей базе
+        ("report", "db.get_all_users", report(lambda user: db.get_all_users())),
+        ("report", "db.get_all_premium_users", report(lambda user: db.get_all_premium_users())),
+        ("report", "db.get_users_for_renewal_reminder", report(lambda user: db.get_users_for_renewal_reminder())),
+        ("report", "db.get_users_for_auto_renewal", report(lambda user: db.get_users_for_auto_renewal())),
+        ("report", "rollups.get_role_totals", report(lambda user: rollups.get_role_totals())),
+        ("report", "rollups.get_daily_stats", report(lambda user: rollups.get_daily_stats())),
+        ("report", "rollups.get_hourly_stats", report(lambda user: rollups.get_hourly_stats(today))),
+        ("report", "rollups.get_active_users", report(lambda user: rollups.get_active_users(today))),
+        ("report", "rollups.get_daily_active_users", report(lambda user: rollups.get_daily_active_users(week_ago))),
+        ("report", "rollups.get_new_users", report(lambda user: rollups.get_new_users(today))),
+        ("report", "rollups.get_top_users", report(lambda user: rollups.get_top_users())),
+        ("report", "payments.get_revenue_stats", report(lambda user: payments.get_revenue_stats())),
+        ("report", "payments.get_plan_stats", report(lambda user: payments.get_plan_stats())),
+        ("report", "payments.get_daily_revenue", report(lambda user: payments.get_daily_revenue())),
+        ("report", "payments.count_premium_users", report(lambda user: payments.count_premium_users())),
+        ("report", "iterators.count_users", report(lambda user: iterators.count_users())),
+        ("report", "iterators.iter_users", report(lambda user: sum(1 for _ in iterators.iter_users()))),
+        ("report", "iterators.iter_messages(week)", report(lambda user: sum(1 for _ in iterators.iter_messages(since=week_ago)))),
+        ("report", "search.search_messages", report(lambda user: search.search_messages("тревожно"))),
+        ("report", "archive.get_archive_stats", report(lambda user: archive.get_archive_stats())),
+        # Запись
+        ("write", "db.add_user(existing)", point(lambda user: db.add_user(f"user{user['id']}", user['telegram_id']))),
+        ("write", "db.add_message", point(lambda user: db.add_message(user['id'], "Бенчмарк: новое сообщение", "user"))),
+        ("write", "db.increment_daily_message_count", point(lambda user: db.increment_daily_message_count(user['telegram_id']))),
+        ("write", "db.consume_message_credit", point(lambda user: db.consume_message_credit(user['telegram_id']))),
+        ("write", "db.update_user_preferences", point(lambda user: db.update_user_preferences(user['telegram_id'], use_emojis=True))),
+        ("write", "db.set_auto_renewal", point(lambda user: db.set_auto_renewal(user['telegram_id'], True))),
+        ("write", "db.activate_premium_subscription", point(lambda user: db.activate_premium_subscription(user['telegram_id'], 1))),
+        ("write", "db.process_auto_renewal", point(lambda user: db.process_auto_renewal(user['telegram_id']))),
+        ("write", "preferences.set_user_setting", point(lambda user: preferences.set_user_setting(user['telegram_id'], "timezone", "Europe/Moscow"))),
+        ("write", "preferences.delete_user_setting", point(lambda user: preferences.delete_user_setting(user['telegram_id'], "timezone"))),
+        ("write", "db.expire_premium_subscriptions", once(lambda user: db.expire_premium_subscriptions())),
+        ("write", "db.renew_due_subscriptions", once(lambda user: db.renew_due_subscriptions())),
+        ("write", "db.clear_conversation_history", point(lambda user: db.clear_conversation_history(user['id']))),
+        ("write", "history_purge.purge_cleared_history", once(lambda user: history_purge.purge_cleared_history(max_users=SAMPLE_USERS))),
+        ("write", "archive.archive_old_messages", once(lambda user: archive.archive_old_messages())),
+    ]
+
+# Отчеты служебных скриптов: (модуль, функция, аргументы от пользователя)
+ADMIN_REPORTS = [
+    ("check_users", "get_recent_users", lambda user: ()),
+    ("check_users", "get_active_users", lambda user: ()),
+    ("check_users", "get_all_users_stats", lambda user: ()),
+    ("check_today_users", "check_today_users", lambda user: ()),
+    ("check_recent_messages", "check_recent_messages", lambda user: ()),
+    ("check_bot_messages_today", "check_bot_messages_today", lambda user: ()),
+    ("check_scheduler_status", "check_scheduler_status", lambda user: ()),
+    ("show_chat_history", "show_all_chat_history", lambda user: ()),
+    ("show_chat_history", "show_detailed_chat", lambda user: (user['telegram_id'],)),
+    ("export_chat_history", "export_chat_history", lambda user: ()),
+]
+
+def percentile(values: list, fraction: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+def summarize(timings: list) -> dict:
+    """Сводка по замерам одной функции (миллисекунды)"""
+    return {
+        'calls': len(timings),
+        'min_ms': round(min(timings), 4),
+        'p50_ms': round(percentile(timings, 0.5), 4),
+        'p95_ms': round(percentile(timings, 0.95), 4),
+        'max_ms': round(max(timings), 4),
+        'mean_ms': round(sum(timings) / len(timings), 4),
+        'total_ms': round(sum(timings), 4)
+    }
+
+def print_summary(name: str, summary: dict):
+    print(f"   ⏱️ {name}: p50 {summary['p50_ms']:.3f} / p95 {summary['p95_ms']:.3f} мс ({summary['calls']} выз.)")
+
+def run_benchmark(function, calls: int, users: list) -> dict:
+    timings = []
+    for index in range(calls):
+        user = users[index % len(users)]
+        started = time.perf_counter()
+        function(user)
+        timings.append((time.perf_counter() - started) * 1000)
+    return summarize(timings)
+
+def sample_users(connection: sqlite3.Connection, rng: random.Random) -> list:
+    """
+    Выборка пользователей: половина случайных, половина по случайным
+    сообщениям (то есть с весом по активности).
+    """
+    max_user = connection.execute("SELECT MAX(id) FROM users").fetchone()[0] or 0
+    max_message = connection.execute("SELECT MAX(id) FROM messages").fetchone()[0] or 0
+    ids = [rng.randint(1, max_user) for _ in range(SAMPLE_USERS // 2)] if max_user else []
+    for _ in range(SAMPLE_USERS - len(ids)):
+        if not max_message:
+            break
+        row = connection.execute("SELECT user_id FROM messages WHERE id >= ? LIMIT 1", (rng.randint(1, max_message),)).fetchone()
+        if row:
+            ids.append(row[0])
+
+    users = []
+    for user_id in ids:
+        row = connection.execute("SELECT id, telegram_id FROM users WHERE id = ?", (user_id,)).fetchone()
+        if row:
+            users.append({'id': row[0], 'telegram_id': row[1]})
+    return users
+
+def database_info(path: str, connection: sqlite3.Connection) -> dict:
+    return {
+        'path': os.path.abspath(path),
+        'size_bytes': os.path.getsize(path),
+        'users': connection.execute("SELECT COUNT(*) FROM users").fetchone()[0],
+        'messages': connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0],
+        'schema_version': connection.execute("PRAGMA user_version").fetchone()[0]
+    }
+
+def code_version() -> dict:
+    """Коммит и состояние рабочей копии git (если доступно)"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip()
+        dirty = bool(subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"], cwd=root, capture_output=True, text=True, check=True
+        ).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': dirty}
+
+def run_admin_reports(users: list, workdir: str) -> dict:
+    """Отчеты служебных скриптов; их вывод отбрасывается"""
+    results = {}
+    heavy_user = users[-1] if users else {'id': 0, 'telegram_id': 0}
+    cwd = os.getcwd()
+    # Выгрузки пишут файлы в текущий каталог
+    os.chdir(workdir)
+    try:
+        for module_name, function_name, arguments in ADMIN_REPORTS:
+            name = f"{module_name}.{function_name}"
+            try:
+                function = getattr(importlib.import_module(module_name), function_name)
+            except ImportError as e:
+                results[name] = {'group': 'admin', 'skipped': str(e)}
+                print(f"   ⏭️ {name}: пропущен ({e})")
+                continue
+            with redirect_stdout(io.StringIO()):
+                summary = run_benchmark(lambda user: function(*arguments(user)), REPORT_CALLS, [heavy_user])
+            results[name] = {'group': 'admin', **summary}
+            print_summary(name, summary)
+    finally:
+        os.chdir(cwd)
+    return results
+
+def compare(results: dict, previous_path: str):
+    """Сравнение медиан с прежним запуском"""
+    with open(previous_path, encoding="utf-8") as file:
+        previous = json.load(file)
+
+    print()
+    print(f"📊 Сравнение с {previous_path} (коммит {previous.get('code', {}).get('commit')}):")
+    regressions = 0
+    for name, current in results.items():
+        before = previous.get('results', {}).get(name)
+        if not before or 'p50_ms' not in before or 'p50_ms' not in current:
+            continue
+        ratio = current['p50_ms'] / before['p50_ms'] if before['p50_ms'] else 1.0
+        if ratio >= REGRESSION_RATIO:
+            regressions += 1
+            mark = "⚠️"
+        elif ratio <= 1 / REGRESSION_RATIO:
+            mark = "🚀"
+        else:
+            continue
+        print(f"   {mark} {name}: {before['p50_ms']:.3f} → {current['p50_ms']:.3f} мс ({ratio:.2f}x)")
+    if regressions:
+        print(f"   ❌ Регрессий: {regressions}")
+    else:
+        print("   ✅ Регрессий нет")
+
+def main():
+    args = [arg for arg in sys.argv[1:] if arg != "--compare"]
+    previous_path = None
+    if "--compare" in sys.argv:
+        index = sys.argv.index("--compare")
+        if index + 1 >= len(sys.argv):
+            print("❌ Укажите файл прежних результатов после --compare")
+            return
+        previous_path = sys.argv[index + 1]
+        args.remove(previous_path)
+    if not args:
+        print("❌ Укажите путь к базе (ее создает generate_test_database.py)")
+        return
+    source_path = args[0]
+    output_path = args[1] if len(args) > 1 else f"storage_benchmark_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+
+    # Медленные запросы на большой базе ожидаемы, их журнал здесь не нужен
+    logging.getLogger("storage.query_stats").setLevel(logging.ERROR)
+
+    workdir = tempfile.mkdtemp(prefix="storage_bench_")
+    try:
+        # Запись идет в копию, исходная база не меняется
+        path = os.path.join(workdir, "database.sqlite")
+        print(f"📦 Копирование {source_path}...")
+        source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+        target = sqlite3.connect(path)
+        source.backup(target)
+        target.execute("PRAGMA journal_mode=WAL")
+        source.close()
+
+        rng = random.Random(0)
+        users = sample_users(target, rng)
+        info = database_info(path, target)
+        target.close()
+
+        DatabaseConfig.DB_PATH = path
+        connection_manager.db_path = path
+        db.initialize_database()
+
+        print(f"🏁 Бенчмарк storage: {info['users']} пользователей, {info['messages']} сообщений, "
+              f"{info['size_bytes'] / 1024 / 1024:.0f} МБ")
+        print("=" * 60)
+
+        benchmarks = storage_benchmarks()
+        results = {}
+        for group, name, (function, calls) in benchmarks:
+            if group != "write":
+                results[name] = {'group': group, **run_benchmark(function, calls, users)}
+                print_summary(name, results[name])
+
+        # Отчеты служебных скриптов - до операций записи, которые меняют данные
+        print()
+        results.update(run_admin_reports(users, workdir))
+        print()
+
+        for group, name, (function, calls) in benchmarks:
+            if group == "write":
+                results[name] = {'group': group, **run_benchmark(function, calls, users)}
+                print_summary(name, results[name])
+
+        output = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'code': code_version(),
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'database': info,
+            'settings': {'sample_users': len(users), 'calls': CALLS, 'report_calls': REPORT_CALLS},
+            'results': results,
+            'queries': query_stats.snapshot(limit=100)
+        }
+        with open(output_path, "w", encoding="utf-8") as file:
+            json.dump(output, file, ensure_ascii=False, indent=2)
+        print()
+        print(f"💾 Результаты сохранены в {output_path}")
+
+        if previous_path:
+            compare(results, previous_path)
+    finally:
+        close_connections()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
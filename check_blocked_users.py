@@ -7,7 +7,8 @@
 import asyncio
 import logging
 from integrations.telegram import bot
-from storage.db import get_all_users
+from storage.connection import open_readonly_connection
+from storage.iterators import iter_users, count_users
 from aiogram.exceptions import TelegramForbiddenError, TelegramBadRequest
 
 # Настройка логирования
@@ -19,26 +20,22 @@ async def check_blocked_users():
     print("=== ПРОВЕРКА ЗАБЛОКИРОВАННЫХ ПОЛЬЗОВАТЕЛЕЙ ===")
     print()
     
-    users = get_all_users()
-    print(f"Всего пользователей в базе: {len(users)}")
+    # Отчет читает базу через отдельное соединение только для чтения
+    connection = open_readonly_connection()
+    print(f"Всего пользователей в базе: {count_users(connection=connection)}")
     print()
     
     blocked_users = []
-    active_users = []
+    active_count = 0
     
     print("Проверяем доступность пользователей...")
     
-    for i, user in enumerate(users, 1):
+    # Пользователи читаются из базы пачками
+    for i, user in enumerate(iter_users(connection=connection), 1):
         try:
             # Пытаемся получить информацию о чате
-            chat_info = await bot.get_chat(user['telegram_id'])
-            active_users.append({
-                'telegram_id': user['telegram_id'],
-                'username': user['username'],
-                'first_name': getattr(chat_info, 'first_name', 'Не указано'),
-                'last_name': getattr(chat_info, 'last_name', ''),
-                'created_at': user['created_at']
-            })
+            await bot.get_chat(user['telegram_id'])
+            active_count += 1
             print(f"  {i:2d}. ✅ {user['username'] or 'Без ника'} (ID: {user['telegram_id']})")
             
         except TelegramForbiddenError:
@@ -66,9 +63,11 @@ async def check_blocked_users():
         # Небольшая задержка между запросами
         await asyncio.sleep(0.1)
     
+    connection.close()
+    
     print()
     print("=== РЕЗУЛЬТАТЫ ===")
-    print(f"✅ Активных пользователей: {len(active_users)}")
+    print(f"✅ Активных пользователей: {active_count}")
     print(f"❌ Заблокированных/недоступных: {len(blocked_users)}")
     print()
     
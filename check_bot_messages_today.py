@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
-from datetime import datetime, date
-from config import DatabaseConfig
+from datetime import datetime, date, timedelta
+from storage.connection import open_readonly_connection
+from storage.rollups import get_hourly_stats, get_active_users, get_role_totals
 
 def check_bot_messages_today():
     """Проверяет сообщения, которые бот отправил сегодня"""
     
     # Подключение к базе данных
-    conn = sqlite3.connect(DatabaseConfig.DB_PATH)
+    conn = open_readonly_connection()
     cursor = conn.cursor()
     
     # Получаем сегодняшнюю дату
@@ -19,14 +19,16 @@ def check_bot_messages_today():
     print("=" * 60)
     
     # Запрос для получения всех сообщений бота за сегодня
+    # (диапазон по created_at использует индекс по роли и времени)
     query = """
     SELECT user_id, message, created_at
     FROM messages 
-    WHERE DATE(created_at) = ? AND role = 'assistant'
+    WHERE role = 'assistant' AND created_at >= ? AND created_at < ?
     ORDER BY created_at ASC
     """
     
-    cursor.execute(query, (today,))
+    tomorrow = (date.today() + timedelta(days=1)).strftime('%Y-%m-%d')
+    cursor.execute(query, (today, tomorrow))
     bot_messages_today = cursor.fetchall()
     
     if bot_messages_today:
@@ -55,29 +57,17 @@ def check_bot_messages_today():
         
         # Статистика по времени отправки
         print(f"\n🕐 Статистика по часам:")
-        cursor.execute("""
-        SELECT strftime('%H', created_at) as hour, COUNT(*) as count
-        FROM messages 
-        WHERE DATE(created_at) = ? AND role = 'assistant'
-        GROUP BY hour
-        ORDER BY hour
-        """, (today,))
-        
-        hourly_stats = cursor.fetchall()
+        hourly_stats = get_hourly_stats(today, role='assistant', connection=conn)
         for hour, count in hourly_stats:
             print(f"   {hour}:00 - {count} сообщений от бота")
         
         # Самые активные диалоги
         print(f"\n📈 Самые активные диалоги сегодня:")
-        cursor.execute("""
-        SELECT user_id, COUNT(*) as bot_messages
-        FROM messages 
-        WHERE DATE(created_at) = ? AND role = 'assistant'
-        GROUP BY user_id
-        ORDER BY bot_messages DESC
-        """, (today,))
-        
-        active_dialogs = cursor.fetchall()
+        active_dialogs = sorted(
+            ((user['user_id'], user['assistant_messages']) for user in get_active_users(today, connection=conn) if user['assistant_messages']),
+            key=lambda dialog: dialog[1],
+            reverse=True
+        )
         for user_id, msg_count in active_dialogs:
             print(f"   👤 Пользователь {user_id}: {msg_count} ответов от бота")
             
@@ -85,17 +75,10 @@ def check_bot_messages_today():
         print("😴 Бот сегодня пока никому не отвечал")
     
     # Проверяем общую статистику диалогов за сегодня
-    cursor.execute("""
-    SELECT 
-        COUNT(CASE WHEN role = 'user' THEN 1 END) as user_messages,
-        COUNT(CASE WHEN role = 'assistant' THEN 1 END) as bot_messages,
-        COUNT(DISTINCT user_id) as unique_users
-    FROM messages 
-    WHERE DATE(created_at) = ?
-    """, (today,))
-    
-    stats = cursor.fetchone()
-    user_msgs, bot_msgs, unique_users = stats
+    role_totals = get_role_totals(day=today, connection=conn)
+    user_msgs = role_totals.get('user', 0)
+    bot_msgs = role_totals.get('assistant', 0)
+    unique_users = len(get_active_users(today, connection=conn))
     
     print(f"\n📊 Общая статистика диалогов за сегодня:")
     print(f"   👥 Уникальных пользователей: {unique_users}")
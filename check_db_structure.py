@@ -1,8 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
 import os
+from storage.connection import open_readonly_connection
 
 def check_db_structure():
     """Проверяет структуру базы данных"""
@@ -16,7 +16,7 @@ def check_db_structure():
     print(f"📊 Проверка структуры базы данных: {db_path}")
     print("=" * 60)
     
-    conn = sqlite3.connect(db_path)
+    conn = open_readonly_connection(db_path)
     cursor = conn.cursor()
     
     # Получаем список всех таблиц
@@ -1,9 +1,8 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
 from datetime import datetime, timedelta
-from config import DatabaseConfig
+from storage.connection import open_readonly_connection
 
 def check_recent_messages():
     """Проверяет последние сообщения в базе данных"""
@@ -11,7 +10,7 @@ def check_recent_messages():
     print("🔍 Проверка последних сообщений")
     print("=" * 60)
     
-    conn = sqlite3.connect(DatabaseConfig.DB_PATH)
+    conn = open_readonly_connection()
     cursor = conn.cursor()
     
     try:
@@ -1,15 +1,15 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
 from datetime import datetime, date, timedelta
-from config import DatabaseConfig, SchedulerConfig
+from config import SchedulerConfig
+from storage.connection import open_readonly_connection
 
 def check_scheduler_status():
     """Проверяет статус планировщика и отправленные уведомления"""
     
     # Подключение к базе данных
-    conn = sqlite3.connect(DatabaseConfig.DB_PATH)
+    conn = open_readonly_connection()
     cursor = conn.cursor()
     
     print("🤖 Статус планировщика уведомлений")
@@ -1,17 +1,16 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
 
-import sqlite3
 from datetime import datetime, date
 from collections import defaultdict
+from storage.connection import open_readonly_connection
+from storage.rollups import get_active_users, get_role_totals, get_hourly_stats, get_new_users
 
 def check_today_users():
     """Проверяет активность пользователей за сегодня"""
     
     # Подключение к базе данных
-    from config import DatabaseConfig
-    conn = sqlite3.connect(DatabaseConfig.DB_PATH)
-    cursor = conn.cursor()
+    conn = open_readonly_connection()
     
     # Получаем сегодняшнюю дату
     today = date.today().strftime('%Y-%m-%d')
@@ -19,19 +18,11 @@ def check_today_users():
     print(f"📅 Активность пользователей за {today}")
     print("=" * 60)
     
-    # Запрос для получения пользователей, которые писали сегодня
-    query = """
-    SELECT user_id, COUNT(*) as message_count,
-           MIN(created_at) as first_message_today,
-           MAX(created_at) as last_message_today
-    FROM messages 
-    WHERE DATE(created_at) = ? AND role = 'user'
-    GROUP BY user_id
-    ORDER BY message_count DESC
-    """
-    
-    cursor.execute(query, (today,))
-    active_users_today = cursor.fetchall()
+    # Пользователи, которые писали сегодня (из сводной таблицы активности)
+    active_users_today = [
+        (user['user_id'], user['user_messages'], user['first_message'], user['last_message'])
+        for user in get_active_users(today, connection=conn)
+    ]
     
     if active_users_today:
         print(f"👥 Активных пользователей сегодня: {len(active_users_today)}")
@@ -51,26 +42,14 @@ def check_today_users():
         print(f"   💬 Всего сообщений от пользователей: {total_messages_today}")
         
         # Получаем количество сообщений бота за сегодня
-        cursor.execute("""
-        SELECT COUNT(*) FROM messages 
-        WHERE role = 'assistant' AND DATE(created_at) = ?
-        """, (today,))
-        bot_messages_today = cursor.fetchone()[0]
+        bot_messages_today = get_role_totals(day=today, connection=conn).get('assistant', 0)
         
         print(f"   🤖 Сообщений от бота: {bot_messages_today}")
         print(f"   📈 Общая активность: {total_messages_today + bot_messages_today} сообщений")
         
         # Статистика по часам
         print(f"\n🕐 Активность по часам:")
-        cursor.execute("""
-        SELECT strftime('%H', created_at) as hour, COUNT(*) as count
-        FROM messages 
-        WHERE DATE(created_at) = ?
-        GROUP BY hour
-        ORDER BY hour
-        """, (today,))
-        
-        hourly_stats = cursor.fetchall()
+        hourly_stats = get_hourly_stats(today, connection=conn)
         for hour, count in hourly_stats:
             print(f"   {hour}:00 - {count} сообщений")
             
@@ -78,15 +57,7 @@ def check_today_users():
         print("😴 Сегодня пока никто не писал боту")
     
     # Проверяем новых пользователей за сегодня
-    cursor.execute("""
-    SELECT user_id, MIN(created_at) as first_message
-    FROM messages 
-    WHERE DATE(created_at) = ? AND role = 'user'
-    GROUP BY user_id
-    HAVING MIN(DATE(created_at)) = ?
-    """, (today, today))
-    
-    new_users_today = cursor.fetchall()
+    new_users_today = get_new_users(today, connection=conn)
     
     if new_users_today:
         print(f"\n🆕 Новые пользователи сегодня: {len(new_users_today)}")
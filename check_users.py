@@ -3,13 +3,12 @@
 Скрипт для проверки активности пользователей бота
 """
 
-import sqlite3
 from datetime import datetime, timedelta
-from config import DatabaseConfig
+from storage.connection import open_readonly_connection
 
 def get_recent_users(days=7):
     """Получить пользователей, зарегистрированных за последние N дней"""
-    connection = sqlite3.connect(DatabaseConfig.DB_PATH)
+    connection = open_readonly_connection()
     cursor = connection.cursor()
     
     # Дата N дней назад
@@ -30,7 +29,7 @@ def get_recent_users(days=7):
 
 def get_active_users(days=7):
     """Получить пользователей, которые писали за последние N дней"""
-    connection = sqlite3.connect(DatabaseConfig.DB_PATH)
+    connection = open_readonly_connection()
     cursor = connection.cursor()
     
     # Дата N дней назад
@@ -51,7 +50,7 @@ def get_active_users(days=7):
 
 def get_all_users_stats():
     """Получить общую статистику по всем пользователям"""
-    connection = sqlite3.connect(DatabaseConfig.DB_PATH)
+    connection = open_readonly_connection()
     cursor = connection.cursor()
     
     # Общее количество пользователей
@@ -13,6 +13,9 @@ TELEGRAM_API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
 # OpenAI настройки
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
+# Telegram ID администраторов через запятую (доступ к служебным командам)
+ADMIN_IDS = {int(admin_id) for admin_id in os.getenv("ADMIN_IDS", "").split(",") if admin_id.strip()}
+
 # Настройки планировщика уведомлений
 class SchedulerConfig:
     # Время отправки ежедневных напоминаний (по умолчанию 15:30)
@@ -31,6 +34,21 @@ class SchedulerConfig:
     # Время автоматического продления подписки
     AUTO_RENEWAL_HOUR = 12
     AUTO_RENEWAL_MINUTE = 0
+    
+    # Время переноса старых сообщений в архив
+    RETENTION_HOUR = 4
+    RETENTION_MINUTE = 0
+    
+    # Время снятия премиум статуса с истекших подписок
+    PREMIUM_EXPIRY_HOUR = 0
+    PREMIUM_EXPIRY_MINUTE = 5
+    
+    # Время ежедневного резервного копирования базы
+    BACKUP_HOUR = 3
+    BACKUP_MINUTE = 30
+    
+    # Интервал фонового удаления истории, очищенной через /clear (минуты)
+    HISTORY_PURGE_INTERVAL_MINUTES = 5
 
 # Настройки OpenAI
 class OpenAIConfig:
@@ -38,6 +56,55 @@ class OpenAIConfig:
     MAX_TOKENS = 1000
     TEMPERATURE = 0.7
     TIMEOUT = 30.0
+    # Режим ответа chat_with_gpt: "two_call" - эмоция и ответ отдельными
+    # запросами; "structured" - один запрос возвращает JSON {emotion, intent, reply}
+    RESPONSE_MODE = os.getenv("LLM_RESPONSE_MODE", "two_call")
+    # Лимит токенов в режиме structured: эмоция до ответа неизвестна, поэтому
+    # берется верхняя граница get_response_config
+    STRUCTURED_MAX_TOKENS = 2500
+    # Пул HTTP соединений общего клиента: всего, keep-alive и время жизни
+    # простаивающего соединения (секунды); таймаут установки соединения
+    MAX_CONNECTIONS = 100
+    MAX_KEEPALIVE_CONNECTIONS = 20
+    KEEPALIVE_EXPIRY = 30.0
+    CONNECT_TIMEOUT = 5.0
+    # Планировщик запросов к модели (services/gpt_service.py): лимит
+    # одновременных запросов меняется между MIN и MAX (AIMD) - растет, пока
+    # ответы быстрее LATENCY_TARGET секунд, и уменьшается при медленных
+    # ответах и ответах 429 (не чаще раза в BACKOFF_COOLDOWN секунд)
+    CONCURRENCY_INITIAL = 16
+    CONCURRENCY_MIN = 2
+    CONCURRENCY_MAX = 64
+    LATENCY_TARGET = 10.0
+    LATENCY_BACKOFF = 0.9
+    RATE_LIMIT_BACKOFF = 0.5
+    BACKOFF_COOLDOWN = 2.0
+    # Одновременных запросов одного пользователя
+    MAX_REQUESTS_PER_USER = 2
+    # Последних измерений ожидания в очереди на полосу (для перцентилей)
+    QUEUE_WAIT_SAMPLES = 1000
+
+# Локальный классификатор эмоций (services/emotion_classifier.py)
+class EmotionConfig:
+    # Обученная модель (train_emotion_classifier.py); без нее - правила по ключевым словам
+    MODEL_PATH = os.getenv("EMOTION_MODEL_PATH", "storage/emotion_classifier.json")
+    # Разметка сообщений моделью GPT для обучения и сравнения (JSON Lines)
+    LABELS_PATH = os.getenv("EMOTION_LABELS_PATH", "storage/emotion_labels.jsonl")
+    # Ниже этой уверенности эмоцию определяет GPT
+    CONFIDENCE_THRESHOLD = 0.8
+    # Уверенность правила по ключевым словам, если модель не обучена
+    KEYWORD_CONFIDENCE = 0.9
+    # Длина основы слова (первые символы) и сглаживание Лапласа
+    STEM_LENGTH = 5
+    SMOOTHING = 0.5
+    # Ответ GPT - одно слово
+    GPT_MAX_TOKENS = 5
+    # Кэш результатов detect_emotion_keywords и determine_intent по
+    # нормализованному тексту (services/classification_cache.py): записей,
+    # время жизни записи (секунды) и максимальная длина кэшируемого текста
+    CACHE_MAX_ENTRIES = 10000
+    CACHE_TTL_SECONDS = 3600
+    CACHE_MAX_TEXT_LENGTH = 200
 
 # Настройки лимитов
 class LimitsConfig:
@@ -62,6 +129,59 @@ class PremiumConfig:
 # Настройки базы данных
 class DatabaseConfig:
     DB_PATH = os.getenv("DB_PATH", "storage/database.sqlite")
+    # Ожидание снятия блокировки записи (миллисекунды)
+    BUSY_TIMEOUT_MS = 10000
+    # Размер кэша страниц на одно соединение (килобайты)
+    CACHE_SIZE_KB = 16000
+    # Количество подготовленных запросов в кэше соединения
+    STATEMENT_CACHE_SIZE = 256
+    # Отложенная запись сообщений: интервал группового коммита (миллисекунды)
+    MESSAGE_FLUSH_INTERVAL_MS = 5
+    # и количество строк, при котором очередь записывается сразу
+    MESSAGE_FLUSH_BATCH_SIZE = 100
+    # Пауза перед повтором записи, пока база занята, растет до этого предела (миллисекунды)
+    MESSAGE_FLUSH_MAX_BACKOFF_MS = 5000
+    # Сколько close() ждет освобождения занятой базы при остановке (секунды)
+    MESSAGE_JOURNAL_CLOSE_TIMEOUT_SECONDS = 30
+    # Максимум строк в очереди: при переполнении отбрасываются самые старые
+    MESSAGE_JOURNAL_MAX_PENDING = 10000
+    # Кэш истории разговора: сообщений на пользователя и общий лимит памяти (байты)
+    HISTORY_CACHE_MESSAGES = 50
+    HISTORY_CACHE_MAX_BYTES = 32 * 1024 * 1024
+    # Сообщения старше этого срока (дни) переносятся в сжатый архив
+    MESSAGE_RETENTION_DAYS = int(os.getenv("MESSAGE_RETENTION_DAYS", "90"))
+    # Уровень сжатия zlib для архива (1-9)
+    ARCHIVE_COMPRESSION_LEVEL = 6
+    # Кэш премиум статуса: максимум записей и время жизни записи (секунды)
+    PREMIUM_CACHE_MAX_ENTRIES = 100000
+    PREMIUM_CACHE_TTL_SECONDS = 300
+    # Кэш пользовательских предпочтений: максимум записей и время жизни записи (секунды)
+    PREFERENCES_CACHE_MAX_ENTRIES = 100000
+    PREFERENCES_CACHE_TTL_SECONDS = 300
+    # Замер времени выполнения запросов (статистика для /dbstats)
+    QUERY_STATS_ENABLED = os.getenv("QUERY_STATS_ENABLED", "1") != "0"
+    # Запросы дольше этого порога (мс) пишутся в журнал медленных запросов
+    SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "100"))
+    # Сколько последних медленных запросов хранить
+    SLOW_QUERY_LOG_SIZE = 100
+    # Сколько разных текстов запросов без константы *_QUERY учитывать отдельно
+    QUERY_STATS_MAX_UNNAMED = 200
+    # Резервные копии: каталог и количество хранимых копий
+    BACKUP_DIR = os.getenv("BACKUP_DIR", "storage/backups")
+    BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+    # Копирование порциями: страниц за шаг и пауза между шагами (мс)
+    BACKUP_PAGES_PER_STEP = 256
+    BACKUP_STEP_SLEEP_MS = 5
+    # После стольких перезапусков копирования из-за записи копия снимается за один шаг
+    BACKUP_MAX_RESTARTS = 3
+    # Фоновое удаление истории после /clear: сообщений в одной транзакции
+    # и пользователей из очереди за один запуск
+    HISTORY_PURGE_BATCH_SIZE = 500
+    HISTORY_PURGE_MAX_USERS = 100
+    # Соединения только для чтения (отчеты и служебные скрипты):
+    # размер отображаемой в память части файла (мегабайты) и кэш страниц (килобайты)
+    READONLY_MMAP_SIZE_MB = 256
+    READONLY_CACHE_SIZE_KB = 64000
 
 # Настройки логирования
 class LoggingConfig:
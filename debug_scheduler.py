@@ -9,7 +9,8 @@ import logging
 from datetime import datetime, time
 from integrations.telegram import bot
 from services.scheduler import DailyReminderScheduler
-from storage.db import get_all_users
+from itertools import islice
+from storage.iterators import iter_users, count_users
 from config import SchedulerConfig
 
 # Настройка логирования
@@ -30,12 +31,13 @@ async def test_scheduler():
     
     # Проверяем пользователей
     print("2. ПОЛЬЗОВАТЕЛИ В БАЗЕ:")
-    users = get_all_users()
-    print(f"   Всего пользователей: {len(users)}")
-    for i, user in enumerate(users[:5]):  # Показываем первых 5
+    users_count = count_users()
+    first_users = list(islice(iter_users(batch=5), 5))  # Показываем первых 5
+    print(f"   Всего пользователей: {users_count}")
+    for i, user in enumerate(first_users):
         print(f"   {i+1}. ID: {user['telegram_id']}, Username: {user['username']}")
-    if len(users) > 5:
-        print(f"   ... и еще {len(users) - 5} пользователей")
+    if users_count > 5:
+        print(f"   ... и еще {users_count - 5} пользователей")
     print()
     
     # Создаем планировщик
@@ -45,8 +47,8 @@ async def test_scheduler():
     
     # Проверяем отправку тестового уведомления
     print("4. ТЕСТ ОТПРАВКИ УВЕДОМЛЕНИЯ:")
-    if users:
-        test_user = users[0]  # Берем первого пользователя
+    if first_users:
+        test_user = first_users[0]  # Берем первого пользователя
         print(f"   Отправляем тестовое уведомление пользователю {test_user['telegram_id']}")
         try:
             success = await scheduler.send_test_reminder(test_user['telegram_id'])
@@ -3,11 +3,12 @@
 Скрипт для выгрузки истории чатов за последние несколько дней
 """
 
-import sqlite3
 from datetime import datetime, timedelta
 import pandas as pd
 import os
-from config import DatabaseConfig
+from storage.connection import open_readonly_connection
+from storage.archive import get_messages_with_archive
+from storage.rollups import get_daily_stats
 
 def export_chat_history(days=7):
     """
@@ -15,7 +16,7 @@ def export_chat_history(days=7):
     """
     try:
         # Подключение к базе данных
-        conn = sqlite3.connect(DatabaseConfig.DB_PATH)
+        conn = open_readonly_connection()
         cursor = conn.cursor()
         
         # Вычисляем дату начала периода
@@ -25,23 +26,23 @@ def export_chat_history(days=7):
         print(f"📊 Выгружаю историю чатов за последние {days} дней (с {start_date_str})")
         print("=" * 60)
         
-        # Запрос для получения всех сообщений за период
-        query = """
-        SELECT 
-            u.username,
-            u.telegram_id,
-            m.role,
-            m.message,
-            m.created_at,
-            DATE(m.created_at) as message_date
-        FROM messages m
-        JOIN users u ON m.user_id = u.id
-        WHERE DATE(m.created_at) >= ?
-        ORDER BY m.created_at DESC
-        """
-        
-        cursor.execute(query, (start_date_str,))
-        messages = cursor.fetchall()
+        # Пользователи для подстановки Telegram ID и имени
+        cursor.execute("SELECT id, username, telegram_id FROM users")
+        users = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
+        
+        # Все сообщения за период (включая архив), от новых к старым
+        messages = [
+            (
+                users[msg['user_id']][0],
+                users[msg['user_id']][1],
+                msg['role'],
+                msg['message'],
+                msg['created_at'],
+                msg['created_at'][:10]
+            )
+            for msg in reversed(get_messages_with_archive(since=start_date_str, connection=conn))
+            if msg['user_id'] in users
+        ]
         
         if not messages:
             print("❌ Нет сообщений за указанный период")
@@ -54,11 +55,10 @@ def export_chat_history(days=7):
         
         # Статистика по дням
         print("📈 Статистика по дням:")
-        daily_stats = df.groupby(['message_date', 'role']).size().unstack(fill_value=0)
-        for date in daily_stats.index:
-            user_msgs = daily_stats.loc[date, 'user'] if 'user' in daily_stats.columns else 0
-            bot_msgs = daily_stats.loc[date, 'assistant'] if 'assistant' in daily_stats.columns else 0
-            print(f"   📅 {date}: 👤 {user_msgs} пользователей, 🤖 {bot_msgs} ответов бота")
+        daily_rollup = get_daily_stats(since=start_date_str, connection=conn)
+        for day in reversed(daily_rollup):
+            print(f"   📅 {day['day']}: 👤 {day['user']} пользователей, 🤖 {day['assistant']} ответов бота")
+        daily_stats = pd.DataFrame(daily_rollup, columns=['day', 'user', 'assistant', 'total']).set_index('day').sort_index()
         
         print()
         
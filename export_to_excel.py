@@ -6,7 +6,6 @@
 
 import os
 import sys
-import sqlite3
 from datetime import datetime
 import pandas as pd
 from openpyxl import Workbook
@@ -16,7 +15,9 @@ from openpyxl.utils.dataframe import dataframe_to_rows
 # Добавляем путь к корневой папке проекта
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-from config import DatabaseConfig
+from storage.connection import open_readonly_connection
+from storage.archive import get_messages_with_archive
+from storage.rollups import get_role_totals, get_daily_stats, get_top_users
 
 def export_messages_to_excel():
     """Экспортировать все сообщения в Excel файл"""
@@ -26,27 +27,28 @@ def export_messages_to_excel():
     
     try:
         # Подключение к базе данных
-        conn = sqlite3.connect(DatabaseConfig.DB_PATH, timeout=10.0)
+        conn = open_readonly_connection()
         cursor = conn.cursor()
         
-        # SQL запрос для получения всех сообщений с информацией о пользователях
-        query = """
-        SELECT 
-            u.telegram_id,
-            u.username,
-            m.role,
-            m.message,
-            m.created_at,
-            DATE(m.created_at) as message_date,
-            TIME(m.created_at) as message_time
-        FROM messages m
-        JOIN users u ON m.user_id = u.id
-        ORDER BY m.created_at ASC
-        """
+        # Пользователи для подстановки Telegram ID и имени
+        cursor.execute("SELECT id, telegram_id, username FROM users")
+        users = {row[0]: (row[1], row[2]) for row in cursor.fetchall()}
         
+        # Все сообщения, включая перенесенные в архив, в порядке времени
         print("🔍 Получение данных из базы...")
-        cursor.execute(query)
-        messages = cursor.fetchall()
+        messages = [
+            (
+                users[msg['user_id']][0],
+                users[msg['user_id']][1],
+                msg['role'],
+                msg['message'],
+                msg['created_at'],
+                msg['created_at'][:10],
+                msg['created_at'][11:19]
+            )
+            for msg in get_messages_with_archive(connection=conn)
+            if msg['user_id'] in users
+        ]
         
         if not messages:
             print("❌ Сообщения не найдены в базе данных")
@@ -85,10 +87,10 @@ def export_messages_to_excel():
             user_stats.columns = ['Всего_сообщений', 'Средняя_длина', 'Первое_сообщение', 'Последнее_сообщение']
             user_stats.reset_index().to_excel(writer, sheet_name='Статистика пользователей', index=False)
             
-            # Статистика по дням
-            daily_stats = df.groupby(['Date', 'Role_RU']).size().unstack(fill_value=0)
-            daily_stats['Всего'] = daily_stats.sum(axis=1)
-            daily_stats.to_excel(writer, sheet_name='Статистика по дням')
+            # Статистика по дням (из сводной таблицы)
+            daily_stats = pd.DataFrame(get_daily_stats(connection=conn), columns=['day', 'user', 'assistant', 'total'])
+            daily_stats.columns = ['Date', 'Пользователь', 'Бот', 'Всего']
+            daily_stats.sort_values('Date').to_excel(writer, sheet_name='Статистика по дням', index=False)
             
             # Форматирование основного листа
             workbook = writer.book
@@ -158,32 +160,21 @@ def create_summary_report():
     """Создать краткий отчет по экспорту"""
     
     try:
-        conn = sqlite3.connect(DatabaseConfig.DB_PATH, timeout=10.0)
+        conn = open_readonly_connection()
         cursor = conn.cursor()
         
-        # Общая статистика
-        cursor.execute("SELECT COUNT(*) FROM messages")
-        total_messages = cursor.fetchone()[0]
+        # Общая статистика (из сводных таблиц)
+        role_totals = get_role_totals(connection=conn)
+        total_messages = sum(role_totals.values())
         
         cursor.execute("SELECT COUNT(*) FROM users")
         total_users = cursor.fetchone()[0]
         
-        cursor.execute("SELECT COUNT(*) FROM messages WHERE role = 'user'")
-        user_messages = cursor.fetchone()[0]
-        
-        cursor.execute("SELECT COUNT(*) FROM messages WHERE role = 'assistant'")
-        bot_messages = cursor.fetchone()[0]
+        user_messages = role_totals.get('user', 0)
+        bot_messages = role_totals.get('assistant', 0)
         
         # Топ активных пользователей
-        cursor.execute("""
-        SELECT u.username, u.telegram_id, COUNT(m.id) as msg_count
-        FROM users u
-        JOIN messages m ON u.id = m.user_id
-        GROUP BY u.id
-        ORDER BY msg_count DESC
-        LIMIT 5
-        """)
-        top_users = cursor.fetchall()
+        top_users = get_top_users(5, connection=conn)
         
         print("\n" + "="*60)
         print("📋 КРАТКИЙ ОТЧЕТ ПО ЭКСПОРТУ")
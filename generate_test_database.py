@@ -0,0 +1,336 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Генератор синтетической базы данных для нагрузочных измерений.
+
+Создает базу с актуальной схемой и правдоподобными данными: рост аудитории
+со временем, активность пользователей с "тяжелым хвостом" (немногие пишут
+очень много), диалоги из чередующихся реплик пользователя и ассистента,
+суточный ритм с пиком вечером, длины сообщений по логнормальному закону
+(ответы ассистента длиннее), премиум подписки с платежами, настройки и
+записи дневника. Генерация детерминирована (фиксированное зерно).
+
+Запуск: python generate_test_database.py путь [пользователей] [сообщений] [дней]
+По умолчанию 100000 пользователей, 10000000 сообщений за 180 дней.
+"""
+
+import os
+import sys
+import math
+import random
+import sqlite3
+import time
+from bisect import bisect_right
+from datetime import date, datetime, timedelta
+from itertools import accumulate
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import PremiumConfig
+from storage.connection import configure_connection
+from storage.migrations import run_migrations
+from storage.rollups import rebuild_rollups
+from storage.search import rebuild_search_index
+
+SEED = 20240501
+
+# Доля сообщений по часам суток (ночью тихо, пик поздним вечером)
+HOURLY_WEIGHTS = (
+    3, 2, 1, 1, 1, 1, 2, 3, 4, 5, 5, 5,
+    6, 6, 6, 6, 7, 8, 9, 10, 11, 12, 11, 7
+)
+
+# Длины сообщений: медиана и разброс логнормального распределения, границы
+USER_LENGTH = (70, 0.8, 2, 2000)
+ASSISTANT_LENGTH = (450, 0.5, 20, 4000)
+
+# Доли пользователей с премиумом, настройками и дневником
+PREMIUM_SHARE = 0.05
+SETTINGS_SHARE = 0.1
+JOURNAL_SHARE = 0.05
+
+WORDS = (
+    "мне сегодня очень немного тревожно грустно спокойно радостно устал устала "
+    "работа учеба семья друзья мама папа партнер начальник сон утро вечер ночь "
+    "почему как что делать чувствую думаю хочу могу боюсь злюсь переживаю "
+    "понимаю поддержка дыхание упражнение давай попробуем важно заметить "
+    "эмоции мысли тело напряжение отдых прогулка благодарность дневник план "
+    "хорошо плохо трудно легко снова опять всегда никогда иногда кажется "
+    "спасибо помоги расскажи посоветуй твои чувства нормальны ты справишься"
+).split()
+
+def build_corpus(rng: random.Random, size: int = 1 << 20) -> str:
+    """Длинный текст из случайных слов; сообщения вырезаются из него кусками"""
+    words = []
+    length = 0
+    while length < size:
+        word = rng.choice(WORDS)
+        words.append(word)
+        length += len(word) + 1
+    return " ".join(words)
+
+class TextSource:
+    """Тексты сообщений заданной длины из общего корпуса"""
+
+    def __init__(self, rng: random.Random):
+        self.rng = rng
+        self.corpus = build_corpus(rng)
+        self.limit = len(self.corpus) - max(USER_LENGTH[3], ASSISTANT_LENGTH[3])
+
+    def length(self, params) -> int:
+        median, sigma, low, high = params
+        return min(high, max(low, int(self.rng.lognormvariate(math.log(median), sigma))))
+
+    def text(self, params) -> str:
+        offset = self.rng.randrange(self.limit)
+        return self.corpus[offset:offset + self.length(params)].strip() or "ок"
+
+def day_weights(days: int) -> list:
+    """Относительный объем сообщений по дням: рост аудитории и всплеск в выходные"""
+    start = date.today() - timedelta(days=days - 1)
+    weights = []
+    for index in range(days):
+        day = start + timedelta(days=index)
+        weight = 0.3 + 0.7 * (index + 1) / days
+        if day.weekday() >= 5:
+            weight *= 1.2
+        weights.append(weight)
+    return weights
+
+def create_users(connection: sqlite3.Connection, rng: random.Random, users: int, days: int):
+    """
+    Создает пользователей в порядке регистрации.
+
+    Returns:
+        (день регистрации каждого пользователя, накопленные веса активности)
+    """
+    start = datetime.combine(date.today() - timedelta(days=days - 1), datetime.min.time())
+    # Регистрации растут вместе с аудиторией: плотность пропорциональна дню
+    registration_days = sorted(int(days * math.sqrt(rng.random())) for _ in range(users))
+    today = date.today()
+    styles = ("friendly", "friendly", "friendly", "formal", "casual")
+    lengths = ("medium", "medium", "short", "long")
+    plans = (PremiumConfig.DAILY_DAYS, PremiumConfig.WEEKLY_DAYS, PremiumConfig.MONTHLY_DAYS)
+
+    rows = []
+    for index, day in enumerate(registration_days):
+        created_at = start + timedelta(days=day, seconds=rng.randrange(86400))
+        premium = rng.random() < PREMIUM_SHARE
+        if premium:
+            plan = rng.choice(plans)
+            subscription_end = (today + timedelta(days=rng.randint(-3, plan))).isoformat()
+            auto_renewal = rng.random() < 0.6
+        else:
+            plan = plans[2]
+            subscription_end = None
+            auto_renewal = False
+        rows.append((
+            f"user{index}", 100000000 + index, created_at.strftime('%Y-%m-%d %H:%M:%S'),
+            premium, subscription_end, auto_renewal, plan,
+            rng.random() < 0.85, rng.choice(styles), rng.choice(lengths)
+        ))
+
+    connection.executemany(
+        """
+        INSERT INTO users (
+            username, telegram_id, created_at, premium_status, subscription_end_date,
+            auto_renewal, subscription_type, use_emojis, communication_style, preferred_response_length
+        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows
+    )
+
+    # Активность: распределение Парето, большинство пишет мало
+    activity = [rng.paretovariate(1.16) for _ in range(users)]
+    return registration_days, list(accumulate(activity))
+
+def create_messages(connection: sqlite3.Connection, rng: random.Random, messages: int, days: int, registration_days: list, cum_activity: list):
+    """Создает диалоги по дням в хронологическом порядке"""
+    texts = TextSource(rng)
+    start = datetime.combine(date.today() - timedelta(days=days - 1), datetime.min.time())
+    weights = day_weights(days)
+    total_weight = sum(weights)
+    hours = range(24)
+
+    # Сегодняшние сообщения не позже текущего момента
+    now = datetime.now()
+    seconds_today = now.hour * 3600 + now.minute * 60 + now.second
+
+    written = 0
+    for index in range(days):
+        target = round(messages * sum(weights[:index + 1]) / total_weight) - written
+        eligible = bisect_right(registration_days, index)
+        if target <= 0 or not eligible:
+            continue
+        day_start = start + timedelta(days=index)
+        last_second = seconds_today if index == days - 1 else 86399
+
+        # Пишут только уже зарегистрированные пользователи, с вероятностью по активности
+        eligible_weight = cum_activity[eligible - 1]
+
+        rows = []
+        while len(rows) < target:
+            user_id = bisect_right(cum_activity, rng.random() * eligible_weight, 0, eligible - 1) + 1
+            second = min(last_second, rng.choices(hours, weights=HOURLY_WEIGHTS)[0] * 3600 + rng.randrange(3600))
+            turns = 1 + min(19, int(rng.expovariate(1 / 2.5)))
+            for _ in range(turns):
+                rows.append((second, user_id, "user", texts.text(USER_LENGTH)))
+                second = min(last_second, second + rng.randint(3, 20))
+                rows.append((second, user_id, "assistant", texts.text(ASSISTANT_LENGTH)))
+                second = min(last_second, second + rng.randint(20, 300))
+        rows = rows[:target]
+        rows.sort(key=lambda row: row[0])
+
+        connection.executemany(
+            "INSERT INTO messages (created_at, user_id, role, message) VALUES (?, ?, ?, ?)",
+            (
+                ((day_start + timedelta(seconds=second)).strftime('%Y-%m-%d %H:%M:%S'), user_id, role, text)
+                for second, user_id, role, text in rows
+            )
+        )
+        written += len(rows)
+    return written
+
+def create_extras(connection: sqlite3.Connection, rng: random.Random, users: int):
+    """Платежи премиум пользователей, настройки, записи дневника и сегодняшние счетчики"""
+    prices = {
+        PremiumConfig.DAILY_DAYS: PremiumConfig.DAILY_PRICE,
+        PremiumConfig.WEEKLY_DAYS: PremiumConfig.WEEKLY_PRICE,
+        PremiumConfig.MONTHLY_DAYS: PremiumConfig.MONTHLY_PRICE
+    }
+    premium = connection.execute(
+        "SELECT telegram_id, subscription_type, subscription_end_date, created_at FROM users WHERE premium_status = TRUE"
+    ).fetchall()
+    payments = []
+    for telegram_id, plan, subscription_end, created_at in premium:
+        for number in range(rng.randint(1, 5)):
+            paid_at = datetime.fromisoformat(subscription_end) - timedelta(days=plan * (number + 1))
+            paid_at = max(paid_at, datetime.fromisoformat(created_at))
+            payments.append((
+                telegram_id, f"charge-{telegram_id}-{number}", f"provider-{telegram_id}-{number}",
+                prices.get(plan, PremiumConfig.MONTHLY_PRICE), plan, subscription_end,
+                paid_at.strftime('%Y-%m-%d %H:%M:%S')
+            ))
+    connection.executemany(
+        """
+        INSERT INTO payments (telegram_id, charge_id, provider_charge_id, amount, plan_days, subscription_end_date, created_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+        """,
+        payments
+    )
+
+    connection.executemany(
+        "INSERT INTO settings (user_id, key, value) VALUES (?, ?, ?)",
+        (
+            (user_id, key, value)
+            for user_id in rng.sample(range(1, users + 1), int(users * SETTINGS_SHARE))
+            for key, value in (("timezone", '"Europe/Moscow"'), ("reminders", "true"))
+        )
+    )
+
+    connection.executemany(
+        "INSERT INTO journal_entries (user_id, mood, facts, gratitude, plan, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        (
+            (
+                user_id, rng.randint(1, 10), "Обычный день", "Спасибо близким", "Погулять",
+                (datetime.now() - timedelta(days=rng.randrange(60))).strftime('%Y-%m-%d %H:%M:%S')
+            )
+            for user_id in rng.sample(range(1, users + 1), int(users * JOURNAL_SHARE))
+            for _ in range(rng.randint(1, 10))
+        )
+    )
+
+    # Дневные счетчики тех, кто писал сегодня
+    today = date.today().isoformat()
+    connection.execute(
+        """
+        UPDATE users SET
+            daily_message_count = counts.messages,
+            last_message_date = :today
+        FROM (
+            SELECT user_id, COUNT(*) AS messages FROM messages
+            WHERE role = 'user' AND created_at >= :today
+            GROUP BY user_id
+        ) AS counts
+        WHERE users.id = counts.user_id
+        """,
+        {'today': today}
+    )
+    return len(payments)
+
+def generate_database(path: str, users: int = 100000, messages: int = 10000000, days: int = 180, seed: int = SEED) -> dict:
+    """
+    Создает синтетическую базу по пути path (существующий файл перезаписывается).
+
+    Returns:
+        Словарь с количеством созданных строк, размером файла и временем генерации
+    """
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(path + suffix):
+            os.remove(path + suffix)
+
+    started = time.perf_counter()
+    rng = random.Random(seed)
+    connection = configure_connection(sqlite3.connect(path))
+    run_migrations(connection)
+
+    # Массовая загрузка без триггеров индекса и сводок: они перестраиваются в конце
+    triggers = connection.execute(
+        "SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'messages'"
+    ).fetchall()
+    for name, _ in triggers:
+        connection.execute(f"DROP TRIGGER {name}")
+    connection.execute("PRAGMA synchronous=OFF")
+
+    registration_days, cum_activity = create_users(connection, rng, users, days)
+    written = create_messages(connection, rng, messages, days, registration_days, cum_activity)
+    payments = create_extras(connection, rng, users)
+
+    for _, sql in triggers:
+        connection.execute(sql)
+    connection.commit()
+
+    rebuild_search_index(connection)
+    rebuild_rollups(connection)
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("ANALYZE")
+    connection.commit()
+    connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    connection.close()
+
+    return {
+        'path': path,
+        'users': users,
+        'messages': written,
+        'payments': payments,
+        'days': days,
+        'size_bytes': os.path.getsize(path),
+        'seconds': time.perf_counter() - started
+    }
+
+def main():
+    if len(sys.argv) < 2:
+        print("❌ Укажите путь к создаваемой базе")
+        print("Запуск: python generate_test_database.py путь [пользователей] [сообщений] [дней]")
+        return
+    path = sys.argv[1]
+    try:
+        users = int(sys.argv[2]) if len(sys.argv) > 2 else 100000
+        messages = int(sys.argv[3]) if len(sys.argv) > 3 else 10000000
+        days = int(sys.argv[4]) if len(sys.argv) > 4 else 180
+    except ValueError:
+        print("❌ Неверный формат параметров")
+        return
+
+    print(f"🏗️ Генерация базы {path}: {users} пользователей, {messages} сообщений за {days} дней...")
+    print("=" * 60)
+    result = generate_database(path, users, messages, days)
+    print(f"   👥 Пользователей: {result['users']}")
+    print(f"   💬 Сообщений: {result['messages']}")
+    print(f"   💳 Платежей: {result['payments']}")
+    print(f"   📏 Размер: {result['size_bytes'] / 1024 / 1024:.1f} МБ")
+    print(f"   ⏱️ Время: {result['seconds']:.1f} с")
+
+if __name__ == "__main__":
+    main()
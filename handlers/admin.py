@@ -0,0 +1,126 @@
+"""
+Служебные команды администраторов бота.
+
+Обработчики регистрируются прямо в диспетчере (integrations/telegram.py),
+до общего обработчика текстовых сообщений.
+"""
+
+import asyncio
+from aiogram.types import Message
+from aiogram.filters import CommandObject
+from config import ADMIN_IDS
+from storage.query_stats import query_stats
+from services.gpt_service import llm_scheduler, token_usage, LANES
+from services.classification_cache import emotion_cache, intent_cache
+
+# Ограничение длины сообщения Telegram
+MAX_MESSAGE_LENGTH = 4000
+
+def format_query_stats(limit: int = 10) -> str:
+    """Текст со статистикой самых затратных запросов"""
+    stats = query_stats.snapshot(limit=limit)
+    if not stats:
+        return "📊 Статистика запросов пока пуста"
+
+    lines = [f"📊 Запросы к базе (топ {len(stats)} по суммарному времени):", ""]
+    for item in stats:
+        lines.append(
+            f"• {item['name']}: {item['count']} шт., всего {item['total_ms']:.0f} мс, "
+            f"p50 {item['p50_ms']:g} / p95 {item['p95_ms']:g} / max {item['max_ms']:.1f} мс"
+        )
+    lines.append("")
+    lines.append(f"🐢 Медленных запросов (≥ {query_stats.slow_query_ms:g} мс) в журнале: {len(query_stats.slow_queries())}")
+    return "\n".join(lines)
+
+def format_slow_queries(entries: list, limit: int = 5) -> str:
+    """Текст с последними медленными запросами и их планами"""
+    if not entries:
+        return "🐢 Медленных запросов нет"
+
+    lines = [f"🐢 Последние медленные запросы (порог {query_stats.slow_query_ms:g} мс):", ""]
+    for entry in entries[-limit:]:
+        lines.append(f"• {entry['at']} {entry['name']}: {entry['elapsed_ms']:.1f} мс")
+        lines.append(f"  {entry['sql'][:300]}")
+        for detail in entry['plan'] or []:
+            lines.append(f"    ↳ {detail}")
+    return "\n".join(lines)
+
+async def dbstats_command(message: Message, command: CommandObject):
+    """
+    /dbstats - статистика времени запросов к базе
+    /dbstats slow - последние медленные запросы
+    /dbstats explain - медленные запросы с планами выполнения
+    /dbstats reset - сброс статистики
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    action = (command.args or "").strip().lower()
+    if action == "slow":
+        text = format_slow_queries(query_stats.slow_queries())
+    elif action == "explain":
+        # План строится через синхронное соединение в отдельном потоке
+        entries = await asyncio.to_thread(query_stats.explain_slow_queries)
+        text = format_slow_queries(entries)
+    elif action == "reset":
+        query_stats.reset()
+        text = "🔄 Статистика запросов сброшена"
+    else:
+        text = format_query_stats()
+
+    await message.answer(text[:MAX_MESSAGE_LENGTH])
+
+# Названия полос приоритета запросов к модели
+LANE_TITLES = {
+    'crisis': "🆘 Кризис",
+    'premium': "👑 Премиум",
+    'free': "💬 Бесплатные"
+}
+
+def format_llm_stats() -> str:
+    """Текст со статистикой планировщика запросов к модели"""
+    stats = llm_scheduler.snapshot()
+    lines = [
+        "🤖 Запросы к модели:",
+        f"Лимит одновременных: {stats['limit']:.1f}, выполняется: {stats['active']}",
+        f"Ответов 429: {stats['rate_limited']}, медленных: {stats['slow_responses']}, снижений лимита: {stats['backoffs']}",
+        f"Запросов: {token_usage['requests']}, токенов: {token_usage['prompt_tokens']} в запросах / {token_usage['completion_tokens']} в ответах",
+        ""
+    ]
+    for lane in LANES:
+        item = stats['lanes'][lane]
+        lines.append(
+            f"• {LANE_TITLES.get(lane, lane)}: {item['completed']} выполнено, {item['failed']} ошибок, "
+            f"в очереди {item['queued']}; ожидание p50 {item['p50_wait_ms']:.0f} / "
+            f"p95 {item['p95_wait_ms']:.0f} / max {item['max_wait_ms']:.0f} мс"
+        )
+    lines.append("")
+    for title, cache in (("Кэш эмоций", emotion_cache), ("Кэш интентов", intent_cache)):
+        cache_stats = cache.stats()
+        lines.append(
+            f"🗂️ {title}: {cache_stats['entries']} записей, попаданий {cache_stats['hit_rate']:.0%} "
+            f"({cache_stats['hits']}/{cache_stats['hits'] + cache_stats['misses']}), "
+            f"истекло {cache_stats['expired']}, вытеснено {cache_stats['evictions']}, длинных {cache_stats['skipped']}"
+        )
+    return "\n".join(lines)
+
+async def llmstats_command(message: Message, command: CommandObject):
+    """
+    /llmstats - лимит и очереди запросов к модели по полосам приоритета
+    /llmstats reset - сброс статистики
+    """
+    if message.from_user.id not in ADMIN_IDS:
+        await message.answer("⛔ Команда доступна только администраторам")
+        return
+
+    if (command.args or "").strip().lower() == "reset":
+        llm_scheduler.reset_stats()
+        token_usage.clear()
+        emotion_cache.reset_stats()
+        intent_cache.reset_stats()
+        text = "🔄 Статистика запросов к модели сброшена"
+    else:
+        text = format_llm_stats()
+
+    await message.answer(text[:MAX_MESSAGE_LENGTH])
@@ -5,7 +5,7 @@
 from aiogram import Router, F
 from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
 from aiogram.filters import Command
-from storage.db import get_user_preferences, update_user_preferences
+from storage.async_db import get_user_preferences, update_user_preferences
 
 router = Router()
 
@@ -13,7 +13,7 @@ router = Router()
 async def show_settings(message: Message):
     """Показывает текущие настройки пользователя"""
     user_id = message.from_user.id
-    preferences = get_user_preferences(user_id)
+    preferences = await get_user_preferences(user_id)
     
     # Формируем текст с текущими настройками
     emoji_status = "✅ Включены" if preferences['use_emojis'] else "❌ Отключены"
@@ -54,10 +54,10 @@ async def show_settings(message: Message):
 async def toggle_emojis(callback: CallbackQuery):
     """Переключает использование эмодзи"""
     user_id = callback.from_user.id
-    preferences = get_user_preferences(user_id)
+    preferences = await get_user_preferences(user_id)
     
     new_emoji_setting = not preferences['use_emojis']
-    update_user_preferences(user_id, use_emojis=new_emoji_setting)
+    await update_user_preferences(user_id, use_emojis=new_emoji_setting)
     
     status = "включены" if new_emoji_setting else "отключены"
     await callback.answer(f"Эмодзи {status}!")
@@ -90,7 +90,7 @@ async def set_style(callback: CallbackQuery):
     user_id = callback.from_user.id
     style = callback.data.replace("style_", "")
     
-    update_user_preferences(user_id, communication_style=style)
+    await update_user_preferences(user_id, communication_style=style)
     
     style_names = {
         'friendly': 'дружелюбный',
@@ -126,7 +126,7 @@ async def set_length(callback: CallbackQuery):
     user_id = callback.from_user.id
     length = callback.data.replace("length_", "")
     
-    update_user_preferences(user_id, preferred_response_length=length)
+    await update_user_preferences(user_id, preferred_response_length=length)
     
     length_names = {
         'short': 'краткие',
@@ -142,7 +142,7 @@ async def reset_settings(callback: CallbackQuery):
     """Сбрасывает настройки к значениям по умолчанию"""
     user_id = callback.from_user.id
     
-    update_user_preferences(
+    await update_user_preferences(
         user_id,
         use_emojis=True,
         communication_style='friendly',
@@ -159,7 +159,7 @@ async def back_to_settings(callback: CallbackQuery):
 
 async def show_settings_after_change(message: Message, user_id: int):
     """Обновляет сообщение с настройками после изменения"""
-    preferences = get_user_preferences(user_id)
+    preferences = await get_user_preferences(user_id)
     
     # Формируем текст с текущими настройками
     emoji_status = "✅ Включены" if preferences['use_emojis'] else "❌ Отключены"
@@ -9,21 +9,24 @@ from aiogram.filters import Command
 from dotenv import load_dotenv
 import sys
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from config import LimitsConfig, PremiumConfig, SchedulerConfig, OpenAIConfig
+from config import LimitsConfig, PremiumConfig, SchedulerConfig
 from services.intents import determine_intent
 from services.microsteps import MICROSTEPS
-from storage.db import (
-    initialize_database, add_user, get_user_by_telegram_id, 
-    is_new_user, add_message, get_conversation_history, 
-    clear_conversation_history, get_user_stats,
-    check_daily_message_limit, increment_daily_message_count, get_daily_message_count,
-    get_user_premium_status, activate_premium_subscription
+from storage.db import initialize_database
+from storage.async_db import (
+    add_user, get_user_by_telegram_id, 
+    is_new_user, clear_conversation_history, get_user_stats,
+    get_daily_message_count,
+    get_user_premium_status,
+    consume_user_context, save_user_turn
 )
+from storage.user_context import UserContext
 from services.gpt_service import (
-    chat_with_gpt, detect_emotion_keywords, get_openai_client
+    chat_with_gpt, detect_emotion_keywords, create_chat_completion, select_lane
 )
-from payment_manager import create_star_invoice, process_successful_payment, get_user_payment_info, PaymentManager, send_premium_offer, send_premium_reminder, get_premium_stats
+from payment_manager import create_star_invoice, process_successful_payment, PAYMENT_APPLIED, PAYMENT_ALREADY_APPLIED, plan_days_for_amount, get_user_payment_info, PaymentManager, send_premium_offer, send_premium_reminder, get_premium_stats
 from handlers.preferences import router as preferences_router
+from handlers.admin import dbstats_command, llmstats_command
 
 # Загрузка переменных окружения
 load_dotenv()
@@ -39,6 +42,10 @@ dp = Dispatcher()
 # Регистрация роутеров
 dp.include_router(preferences_router)
 
+# Служебные команды администраторов
+dp.message.register(dbstats_command, Command('dbstats'))
+dp.message.register(llmstats_command, Command('llmstats'))
+
 # Инициализация базы данных
 initialize_database()
 
@@ -139,33 +146,26 @@ async def safe_delete(message: Message) -> bool:
         print(f"Ошибка при удалении сообщения: {e}")
         return False
 
-async def check_and_increment_daily_limit(user_id: int, message: Message) -> bool:
-    """Проверяет и увеличивает дневной лимит сообщений"""
-    # Сначала проверяем премиум статус
-    premium_info = get_user_premium_status(user_id)
-    if premium_info and premium_info['premium_status']:
-        # Премиум пользователи имеют безлимитный доступ, не увеличиваем счетчик
+async def check_daily_limit(context: UserContext, message: Message) -> bool:
+    """Проверяет результат списания сообщения из дневного лимита"""
+    # Премиум пользователи имеют безлимитный доступ
+    if context.can_send_message():
         return True
     
-    if not check_daily_message_limit(user_id):
-        # Простое сообщение о лимите
-        limit_message = "Похоже, ты достиг(ла) дневного лимита сообщений (20/20). Можем продолжить завтра или оформить премиум — как тебе удобнее?"
-        
-        # Создаем кнопки для покупки премиума
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="💎 Купить премиум", callback_data="buy_premium_monthly")],
-            [InlineKeyboardButton(text="📊 Проверить баланс", callback_data="check_balance")]
-        ])
-        
-        # Добавляем эмодзи
-        full_message = f"💪 {limit_message}"
-        
-        await message.answer(full_message, reply_markup=keyboard)
-        return False
+    # Простое сообщение о лимите
+    limit_message = "Похоже, ты достиг(ла) дневного лимита сообщений (20/20). Можем продолжить завтра или оформить премиум — как тебе удобнее?"
     
-    # Увеличиваем счетчик только для обычных пользователей
-    increment_daily_message_count(user_id)
-    return True
+    # Создаем кнопки для покупки премиума
+    keyboard = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="💎 Купить премиум", callback_data="buy_premium_monthly")],
+        [InlineKeyboardButton(text="📊 Проверить баланс", callback_data="check_balance")]
+    ])
+    
+    # Добавляем эмодзи
+    full_message = f"💪 {limit_message}"
+    
+    await message.answer(full_message, reply_markup=keyboard)
+    return False
 
 async def send_premium_invoice(user_id: int, days: int, price: int, title: str, description: str) -> bool:
     """Отправляет инвойс для покупки премиум подписки"""
@@ -191,27 +191,27 @@ async def send_premium_invoice(user_id: int, days: int, price: int, title: str,
         print(f"Ошибка создания инвойса: {e}")
         return False
 
-async def reply_with_text_and_log(message: Message, user_id: int, text: str):
-    """Отправляет ответ и логирует в историю разговора"""
+async def reply_with_text_and_log(message: Message, context: UserContext, text: str):
+    """Отправляет ответ и добавляет его в историю разговора (запись в конце обработки)"""
     await message.reply(text)
-    add_to_conversation_history(user_id, "assistant", text)
+    context.add_pending_message("assistant", text)
 
-async def reply_with_gpt(message: Message, user_id: int, user_message: str, fallback_text: str):
+async def reply_with_gpt(message: Message, context: UserContext, user_message: str, fallback_text: str):
     """Обрабатывает GPT ответ с typing action и логированием"""
     await send_typing_action(message.chat.id)
     
-    gpt_response = await get_gpt_response(user_id, user_message)
+    gpt_response = await get_gpt_response(context, user_message)
     if not gpt_response:
         gpt_response = fallback_text
     
     await message.reply(gpt_response)
-    add_to_conversation_history(user_id, "assistant", gpt_response)
+    context.add_pending_message("assistant", gpt_response)
 
-def ensure_user_initialized(user_id: int, username: str = None, first_name: str = None):
+async def ensure_user_initialized(user_id: int, username: str = None, first_name: str = None):
     """Инициализация пользователя если он не существует"""
-    if is_new_user(user_id):
+    if await is_new_user(user_id):
         # Добавляем нового пользователя в базу данных
-        result = add_user(username or first_name or f"user_{user_id}", user_id)
+        result = await add_user(username or first_name or f"user_{user_id}", user_id)
         if result > 0:
             return True  # Новый пользователь успешно добавлен
         else:
@@ -221,13 +221,6 @@ def ensure_user_initialized(user_id: int, username: str = None, first_name: str
 
 # Функция save_user_data больше не нужна, данные сохраняются в БД автоматически
 
-def add_to_conversation_history(user_id: int, role: str, content: str):
-    """Добавление сообщения в историю разговора"""
-    # Получаем внутренний ID пользователя из БД
-    user = get_user_by_telegram_id(user_id)
-    if user:
-        add_message(user['id'], content, role)
-
 @dp.message(Command('start'))
 async def start_command(message: Message):
     """Обработчик команды /start"""
@@ -236,7 +229,7 @@ async def start_command(message: Message):
     first_name = message.from_user.first_name
     
     # Проверяем, новый ли это пользователь
-    is_new = ensure_user_initialized(user_id, username, first_name)
+    is_new = await ensure_user_initialized(user_id, username, first_name)
     
     # Формируем приветственное сообщение
     welcome_text = render_welcome(is_new, first_name)
@@ -275,12 +268,12 @@ async def stats_command(message: Message):
     user_id = message.from_user.id
     
     # Получаем данные пользователя из БД
-    user = get_user_by_telegram_id(user_id)
+    user = await get_user_by_telegram_id(user_id)
     
     if user:
-        stats = get_user_stats(user['id'])
-        daily_count = get_daily_message_count(user_id)
-        premium_info = get_user_premium_status(user_id)
+        stats = await get_user_stats(user['id'])
+        daily_count = await get_daily_message_count(user_id)
+        premium_info = await get_user_premium_status(user_id)
         
         # Формируем текст статистики
         stats_text = f"📊 *Ваша статистика:*\n\n" \
@@ -309,10 +302,10 @@ async def clear_command(message: Message):
     user_id = message.from_user.id
     
     # Получаем данные пользователя из БД
-    user = get_user_by_telegram_id(user_id)
+    user = await get_user_by_telegram_id(user_id)
     
     if user:
-        clear_conversation_history(user['id'])
+        await clear_conversation_history(user['id'])
         await message.answer("🗑️ История чата очищена!")
     else:
         await message.answer("❌ Нет данных для очистки. Начни общение командой /start!")
@@ -340,7 +333,7 @@ async def premium_command(message: Message):
     user_id = message.from_user.id
     
     # Получаем статус премиум пользователя
-    premium_info = get_user_premium_status(user_id)
+    premium_info = await get_user_premium_status(user_id)
     
     if premium_info and premium_info['premium_status']:
         # Пользователь уже имеет премиум
@@ -372,7 +365,7 @@ async def balance_command(message: Message):
     """Обработчик команды /balance - проверка баланса звезд"""
     user_id = message.from_user.id
     
-    payment_info = get_user_payment_info(user_id)
+    payment_info = await get_user_payment_info(user_id)
     
     if payment_info:
         premium_line = format_premium_line(payment_info)
@@ -419,7 +412,7 @@ async def handle_check_balance(callback_query: CallbackQuery):
     """Обработчик проверки баланса через кнопку"""
     user_id = callback_query.from_user.id
     
-    payment_info = get_user_payment_info(user_id)
+    payment_info = await get_user_payment_info(user_id)
     
     if payment_info:
         balance_text = (
@@ -444,7 +437,7 @@ async def handle_toggle_auto_renewal(callback_query: CallbackQuery):
     user_id = callback_query.from_user.id
     
     # Получаем текущий статус автопродления
-    user_info = get_user_payment_info(user_id)
+    user_info = await get_user_payment_info(user_id)
     if not user_info:
         await callback_query.answer("❌ Информация о пользователе недоступна")
         return
@@ -493,23 +486,22 @@ async def successful_payment_handler(message: Message):
     payment = message.successful_payment
     
     # Определяем количество дней по сумме платежа
-    total_amount = payment.total_amount
-    days = LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS  # По умолчанию
-    if total_amount == PremiumConfig.DAILY_PRICE:
-        days = PremiumConfig.DAILY_DAYS
-    elif total_amount == PremiumConfig.WEEKLY_PRICE:
-        days = PremiumConfig.WEEKLY_DAYS
-    elif total_amount == PremiumConfig.MONTHLY_PRICE:
-        days = PremiumConfig.MONTHLY_DAYS
-    
-    # Обрабатываем успешный платеж
-    success = process_successful_payment(user_id, payment.telegram_payment_charge_id, total_amount)
+    days = plan_days_for_amount(payment.total_amount)
+    
+    # Записываем платеж и активируем подписку (повторная доставка платежа ничего не меняет)
+    result = await process_successful_payment(
+        user_id,
+        payment.telegram_payment_charge_id,
+        payment.total_amount,
+        provider_charge_id=payment.provider_payment_charge_id,
+        currency=payment.currency
+    )
     
-    if success:
-        # Активируем подписку с правильным типом
-        # activate_premium_subscription теперь сохраняет тип подписки для автопродления
-        activate_premium_subscription(user_id, days)
-        
+    # Повторная доставка уже обработанного платежа: пользователь уже получил ответ
+    if result == PAYMENT_ALREADY_APPLIED:
+        return
+    
+    if result == PAYMENT_APPLIED:
         # Формируем правильное сообщение в зависимости от количества дней
         if days == PremiumConfig.DAILY_DAYS:
             period_text = f"{PremiumConfig.DAILY_DAYS} день"
@@ -530,12 +522,15 @@ async def successful_payment_handler(message: Message):
             "Обратитесь в поддержку для решения проблемы."
         )
 
-async def get_gpt_response(user_id: int, user_message: str) -> str:
+def message_lane(context: UserContext, user_message: str, intent: str = None) -> str:
+    """Полоса приоритета запроса к модели: кризис, премиум или бесплатный пользователь"""
+    intent = intent or determine_intent(user_message)
+    return select_lane(premium=context.premium_status, crisis=intent == "sos")
+
+async def get_gpt_response(context: UserContext, user_message: str) -> str:
     """Получение ответа от GPT с историей разговора"""
-    user = get_user_by_telegram_id(user_id)
-    conversation_history = get_conversation_history(user['id']) if user else []
-    gpt_history = [{'role': msg['role'], 'content': msg['content']} for msg in conversation_history]
-    return await chat_with_gpt(user_message, conversation_history=gpt_history)
+    gpt_history = [{'role': msg['role'], 'content': msg['content']} for msg in context.history]
+    return await chat_with_gpt(user_message, user_id=context.id, conversation_history=gpt_history, lane=message_lane(context, user_message))
 
 async def send_typing_action(chat_id: int):
     """Отправляет действие 'печатает' в чат"""
@@ -544,12 +539,13 @@ async def send_typing_action(chat_id: int):
     except Exception as e:
         print(f"Ошибка при отправке typing action: {e}")
 
-async def handle_talk_intent(message: Message, user_id: int, user_message: str):
+async def handle_talk_intent(message: Message, context: UserContext, user_message: str):
     """Обрабатывает интент 'talk' - эмоциональная поддержка"""
     await send_typing_action(message.chat.id)
     
     # Определяем эмоциональное состояние
-    emotion_type = detect_emotion_keywords(user_message)
+    lane = message_lane(context, user_message)
+    emotion_type = await detect_emotion_keywords(user_message, lane=lane, user_id=context.id)
     
     if emotion_type == "sos":
         # Критическая ситуация - специальная обработка
@@ -562,14 +558,12 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
 
 Ты сейчас в безопасности?"""
         
-        await reply_with_text_and_log(message, user_id, response)
+        await reply_with_text_and_log(message, context, response)
         return
     
     elif emotion_type == "neutral":
         # Для нейтральных сообщений используем GPT для релевантного ответа
         try:
-            client = get_openai_client()
-            
             prompt = f"""Ты дружелюбный помощник. Пользователь написал нейтральное сообщение: "{user_message}"
 
 Дай короткий (1-2 предложения), дружелюбный и релевантный ответ на русском языке. 
@@ -577,15 +571,10 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
 
 Ответ:"""
 
-            response = client.chat.completions.create(
-                model=OpenAIConfig.MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=OpenAIConfig.MAX_TOKENS,
-                temperature=OpenAIConfig.TEMPERATURE
-            )
+            response = await create_chat_completion([{"role": "user", "content": prompt}], lane=lane, user_id=context.id)
             
-            gpt_response = response.choices[0].message.content.strip()
-            await reply_with_text_and_log(message, user_id, gpt_response)
+            gpt_response = response.strip()
+            await reply_with_text_and_log(message, context, gpt_response)
             return
             
         except Exception as e:
@@ -598,7 +587,7 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
                 "Ясно! 😌 А что еще происходит?"
             ]
             response = random.choice(neutral_responses)
-            await reply_with_text_and_log(message, user_id, response)
+            await reply_with_text_and_log(message, context, response)
             return
     
     # Для эмоциональных сообщений
@@ -614,8 +603,6 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
     elif emotion_type == "generic":
         # Для generic сообщений используем более нейтральный подход
         try:
-            client = get_openai_client()
-            
             prompt = f"""Пользователь написал: "{user_message}"
 
 Дай короткий (1-2 предложения), дружелюбный и релевантный ответ на русском языке. 
@@ -624,15 +611,10 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
 
 Ответ:"""
 
-            response = client.chat.completions.create(
-                model=OpenAIConfig.MODEL,
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=OpenAIConfig.MAX_TOKENS,
-                temperature=OpenAIConfig.TEMPERATURE
-            )
+            response = await create_chat_completion([{"role": "user", "content": prompt}], lane=lane, user_id=context.id)
             
-            gpt_response = response.choices[0].message.content.strip()
-            await reply_with_text_and_log(message, user_id, gpt_response)
+            gpt_response = response.strip()
+            await reply_with_text_and_log(message, context, gpt_response)
             return
             
         except Exception as e:
@@ -645,7 +627,7 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
                 "Ясно! 😌 А что еще происходит?"
             ]
             response = random.choice(generic_responses)
-            await reply_with_text_and_log(message, user_id, response)
+            await reply_with_text_and_log(message, context, response)
             return
     else:
         # Только для явно эмоциональных состояний (anger, sadness, tired)
@@ -673,9 +655,9 @@ async def handle_talk_intent(message: Message, user_id: int, user_message: str):
 
 {closer} 💛"""
     
-    await reply_with_text_and_log(message, user_id, response)
+    await reply_with_text_and_log(message, context, response)
 
-async def handle_other_intent(message: Message, user_id: int, user_message: str):
+async def handle_other_intent(message: Message, context: UserContext, user_message: str):
     """Обрабатывает другие интенты (coach, facts, journal)"""
     intent = determine_intent(user_message)
     
@@ -710,11 +692,11 @@ async def handle_other_intent(message: Message, user_id: int, user_message: str)
         
     else:
         # Fallback
-        response = await get_gpt_response(user_id, user_message)
+        response = await get_gpt_response(context, user_message)
     
-    await reply_with_text_and_log(message, user_id, response)
+    await reply_with_text_and_log(message, context, response)
 
-async def handle_unified_message(message: Message, user_id: int, user_message: str):
+async def handle_unified_message(message: Message, context: UserContext, user_message: str):
     """Единый упрощенный обработчик всех сообщений через GPT с эмоциональным контекстом"""
     await send_typing_action(message.chat.id)
     
@@ -723,20 +705,16 @@ async def handle_unified_message(message: Message, user_id: int, user_message: s
     is_inappropriate, topic_type, safe_response = ContentFilter.check_content(user_message)
     
     if is_inappropriate:
-        print(f"Заблокирован неподходящий контент: {topic_type} от пользователя {user_id}")
-        await reply_with_text_and_log(message, user_id, safe_response)
+        print(f"Заблокирован неподходящий контент: {topic_type} от пользователя {context.telegram_id}")
+        await reply_with_text_and_log(message, context, safe_response)
         return
     
-    # Получаем пользовательские предпочтения
-    from storage.db import get_user_preferences
-    user_preferences = get_user_preferences(message.from_user.id)
-    
-    # Получаем историю разговора для контекста
-    from config import LimitsConfig
+    # Пользовательские предпочтения и история разговора уже загружены в контексте
     from services.emotional_context import format_context_for_gpt
     
+    user_preferences = context.preferences
     context_limit = LimitsConfig.CONTEXT_MESSAGE_LIMIT
-    history = get_conversation_history(user_id, limit=context_limit)
+    history = context.history
     
     # Анализируем эмоциональный контекст
     context_analysis, intent, response_tone, context_addition = format_context_for_gpt(history, user_message)
@@ -752,8 +730,11 @@ async def handle_unified_message(message: Message, user_id: int, user_message: s
     
     try:
         # Получаем ответ от GPT с полным контекстом, эмоциональным анализом и пользовательскими предпочтениями
-        response = await get_gpt_response_with_context(context_messages, intent, response_tone, context_addition, user_preferences)
-        await reply_with_text_and_log(message, user_id, response)
+        response = await get_gpt_response_with_context(
+            context_messages, intent, response_tone, context_addition, user_preferences,
+            lane=message_lane(context, user_message, intent), user_id=context.id
+        )
+        await reply_with_text_and_log(message, context, response)
     except Exception as e:
         print(f"Ошибка при получении ответа от GPT: {e}")
         # Fallback ответы с учетом эмоционального состояния и предпочтений пользователя
@@ -781,12 +762,10 @@ async def handle_unified_message(message: Message, user_id: int, user_message: s
                 f"Я здесь, чтобы выслушать тебя{emoji_suffix}"
             ]
         response = random.choice(fallback_responses)
-        await reply_with_text_and_log(message, user_id, response)
+        await reply_with_text_and_log(message, context, response)
 
-async def get_gpt_response_with_context(context_messages, intent=None, response_tone=None, context_addition="", user_preferences=None):
+async def get_gpt_response_with_context(context_messages, intent=None, response_tone=None, context_addition="", user_preferences=None, lane=None, user_id=None):
     """Получение ответа от GPT с учетом контекста разговора и эмоционального анализа"""
-    client = get_openai_client()
-    
     # Выбираем подходящий промпт в зависимости от интента
     if intent in ['support', 'sos', 'emotional']:
         prompt_file = 'prompts/empathic_prompt.txt'
@@ -835,16 +814,11 @@ async def get_gpt_response_with_context(context_messages, intent=None, response_
     # Формируем сообщения для GPT
     messages = [{"role": "system", "content": system_prompt}] + context_messages
     
-    response = client.chat.completions.create(
-        model=OpenAIConfig.MODEL,
-        messages=messages,
-        max_tokens=OpenAIConfig.MAX_TOKENS,
-        temperature=OpenAIConfig.TEMPERATURE
-    )
+    response = await create_chat_completion(messages, lane=lane or select_lane(), user_id=user_id)
     
-    return response.choices[0].message.content.strip()
+    return response.strip()
 
-async def handle_simple_intent(message: Message, user_id: int, intent: str):
+async def handle_simple_intent(message: Message, context: UserContext, intent: str):
     """Обработка простых интентов"""
     # Показываем что бот печатает
     await send_typing_action(message.chat.id)
@@ -853,7 +827,7 @@ async def handle_simple_intent(message: Message, user_id: int, intent: str):
     all_intent_texts = {**SIMPLE_INTENT_TEXTS, **ADDITIONAL_INTENT_TEXTS}
     response = all_intent_texts.get(intent, "Я здесь, чтобы помочь! 🤗")
     
-    await reply_with_text_and_log(message, user_id, response)
+    await reply_with_text_and_log(message, context, response)
 
 @dp.message()
 async def handle_message(message: Message):
@@ -867,31 +841,38 @@ async def handle_message(message: Message):
         await message.reply("Пожалуйста, отправьте текстовое сообщение 📝")
         return
     
-    # Инициализируем пользователя если он новый
-    is_new = ensure_user_initialized(user_id, username, first_name)
+    # Загружаем контекст пользователя и списываем сообщение из дневного лимита
+    # одним запросом (данные, лимиты, предпочтения, история)
+    context = await consume_user_context(user_id)
     
-    if is_new:
-        welcome_message = render_welcome_detailed(first_name)
-        await message.reply(welcome_message)
+    # Инициализируем пользователя если он новый
+    if context is None:
+        is_new = await ensure_user_initialized(user_id, username, first_name)
+        if is_new:
+            welcome_message = render_welcome_detailed(first_name)
+            await message.reply(welcome_message)
         return
     
-    # Проверяем лимит сообщений и увеличиваем счетчик
-    can_proceed = await check_and_increment_daily_limit(user_id, message)
+    # Проверяем лимит сообщений
+    can_proceed = await check_daily_limit(context, message)
     if not can_proceed:
         return
     
     # Добавляем сообщение пользователя в историю
-    add_to_conversation_history(user_id, 'user', user_message)
+    context.add_pending_message('user', user_message)
     
     # Упрощенная обработка - используем только GPT для определения ответа
     try:
-        await handle_unified_message(message, user_id, user_message)
+        await handle_unified_message(message, context, user_message)
             
     except Exception as e:
         print(f"Ошибка при обработке сообщения: {e}")
         error_response = "Извини, произошла ошибка. Попробуй еще раз! 😅"
         await message.reply(error_response)
-        add_to_conversation_history(user_id, 'assistant', error_response)
+        context.add_pending_message('assistant', error_response)
+    finally:
+        # Одна запись в конце: реплики диалога
+        await save_user_turn(context)
 
 async def main():
     await bot.delete_webhook(drop_pending_updates=True)
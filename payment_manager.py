@@ -10,12 +10,12 @@ from datetime import date, timedelta
 from aiogram import Bot, types
 from aiogram.types import LabeledPrice, PreCheckoutQuery, InlineKeyboardMarkup, InlineKeyboardButton
 from dotenv import load_dotenv
-from config import PremiumConfig
+from config import PremiumConfig, LimitsConfig
 
-from storage.db import (
+from storage.payments import count_premium_users, get_revenue_stats, get_plan_stats
+from storage.async_db import (
     get_user_premium_status, activate_premium_subscription,
-    get_all_premium_users, get_user_by_telegram_id,
-    set_auto_renewal
+    set_auto_renewal, apply_payment
 )
 
 # Загрузка переменных окружения
@@ -24,6 +24,11 @@ load_dotenv()
 API_TOKEN = os.getenv("TELEGRAM_API_TOKEN")
 bot = Bot(token=API_TOKEN)
 
+# Результаты process_successful_payment
+PAYMENT_APPLIED = "applied"
+PAYMENT_ALREADY_APPLIED = "already_applied"
+PAYMENT_FAILED = "failed"
+
 # Конфигурация цен (в звездах Telegram)
 PREMIUM_PRICES = {
     "monthly": {"stars": PremiumConfig.MONTHLY_PRICE, "days": PremiumConfig.MONTHLY_DAYS, "title": "Премиум на месяц"},
@@ -51,42 +56,64 @@ def create_star_invoice(title: str, description: str, payload: str, star_count:
         "star_count": star_count
     }
 
-def process_successful_payment(user_id: int, payment_charge_id: str, total_amount: int) -> bool:
+def plan_days_for_amount(total_amount: int) -> int:
     """
-    Обрабатывает успешный платеж и активирует премиум подписку
+    Определяет длительность подписки (дни) по сумме платежа в звездах
+    
+    Args:
+        total_amount: Сумма платежа в звездах
+    
+    Returns:
+        Количество дней подписки
+    """
+    if total_amount == PremiumConfig.DAILY_PRICE:
+        return PremiumConfig.DAILY_DAYS
+    elif total_amount == PremiumConfig.WEEKLY_PRICE:
+        return PremiumConfig.WEEKLY_DAYS
+    elif total_amount == PremiumConfig.MONTHLY_PRICE:
+        return PremiumConfig.MONTHLY_DAYS
+    return LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS  # По умолчанию месяц
+
+async def process_successful_payment(user_id: int, payment_charge_id: str, total_amount: int,
+                                     provider_charge_id: str = None, currency: str = "XTR") -> str:
+    """
+    Обрабатывает успешный платеж: записывает его в журнал платежей и
+    активирует премиум подписку. Повторная доставка того же платежа
+    (тот же payment_charge_id) подписку повторно не продлевает.
     
     Args:
         user_id: ID пользователя в Telegram
         payment_charge_id: ID платежа в Telegram
         total_amount: Сумма платежа в звездах
+        provider_charge_id: ID платежа у провайдера
+        currency: Валюта платежа
     
     Returns:
-        True если платеж обработан успешно, False в противном случае
+        PAYMENT_APPLIED если подписка активирована, PAYMENT_ALREADY_APPLIED
+        если платеж уже был обработан, PAYMENT_FAILED при ошибке
     """
     try:
-        # Определяем тип подписки по сумме
-        days = 30  # По умолчанию месяц
-        if total_amount == 10:
-            days = 1
-        elif total_amount == 30:
-            days = 7
-        elif total_amount == 100:
-            days = 30
+        days = plan_days_for_amount(total_amount)
         
-        # Активируем премиум подписку
-        activate_premium_subscription(user_id, days)
+        applied = await apply_payment(
+            user_id, payment_charge_id, total_amount, days,
+            currency=currency, provider_charge_id=provider_charge_id
+        )
+        if not applied:
+            print(f"Платеж {payment_charge_id} уже обработан, повтор пропущен")
+            return PAYMENT_ALREADY_APPLIED
         
         # Убираем бонусные звезды - ничего не должно поступать на баланс
         # bonus_stars = total_amount // 10  # 10% бонус
         # if bonus_stars > 0:
         #     update_stars_balance(user_id, bonus_stars)
         
-        return True
+        return PAYMENT_APPLIED
     except Exception as e:
         print(f"Ошибка при обработке платежа: {e}")
-        return False
+        return PAYMENT_FAILED
 
-def get_user_payment_info(user_id: int) -> dict:
+async def get_user_payment_info(user_id: int) -> dict:
     """
     Получает информацию о платежах пользователя
     
@@ -96,7 +123,7 @@ def get_user_payment_info(user_id: int) -> dict:
     Returns:
         Словарь с информацией о платежах
     """
-    return get_user_premium_status(user_id)
+    return await get_user_premium_status(user_id)
 
 async def send_premium_offer(bot: Bot, user_id: int):
     """
@@ -107,7 +134,7 @@ async def send_premium_offer(bot: Bot, user_id: int):
         user_id: ID пользователя в Telegram
     """
     # Получаем информацию о пользователе для проверки статуса автопродления
-    user_info = get_user_premium_status(user_id)
+    user_info = await get_user_premium_status(user_id)
     auto_renewal_status = user_info.get('auto_renewal', False) if user_info else False
     
     keyboard = InlineKeyboardMarkup(inline_keyboard=[
@@ -183,20 +210,23 @@ async def send_premium_reminder(bot: Bot, user_id: int, days_left: int):
             text=reminder_text
         )
 
-def get_premium_stats() -> dict:
+def get_premium_stats(since: str = None) -> dict:
     """
-    Получает статистику по премиум пользователям
+    Получает статистику по премиум пользователям и выручке
+    
+    Args:
+        since: Начальная дата для статистики платежей ('YYYY-MM-DD'), None - за все время
     
     Returns:
         Словарь со статистикой
     """
-    premium_users = get_all_premium_users()
-    
-    total_premium = len(premium_users)
+    counts = count_premium_users()
     
     return {
-        "total_premium_users": total_premium,
-        "premium_users": premium_users
+        "total_premium_users": counts["premium_users"],
+        "auto_renewal_users": counts["auto_renewal_users"],
+        "revenue": get_revenue_stats(since),
+        "plans": get_plan_stats(since)
     }
 
 class PaymentManager:
@@ -245,7 +275,7 @@ class PaymentManager:
         plan_info = PREMIUM_PRICES[plan]
         
         # Активируем премиум подписку
-        activate_premium_subscription(user_id, plan_info["days"])
+        await activate_premium_subscription(user_id, plan_info["days"])
         
         # Убираем бонусные звезды - ничего не должно поступать на баланс
         # bonus_stars = plan_info["stars"] // 10  # 10% бонус
@@ -264,7 +294,7 @@ class PaymentManager:
         Returns:
             Текстовая информация о платежах
         """
-        info = get_user_premium_status(user_id)
+        info = await get_user_premium_status(user_id)
         
         if not info:
             return "❌ Информация о платежах недоступна"
@@ -298,7 +328,7 @@ class PaymentManager:
             True если операция успешна, False в противном случае
         """
         try:
-            set_auto_renewal(user_id, enabled)
+            await set_auto_renewal(user_id, enabled)
             return True
         except Exception as e:
             print(f"Ошибка при изменении настроек автопродления: {e}")
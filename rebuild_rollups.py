@@ -0,0 +1,33 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для перестройки сводных таблиц статистики сообщений.
+
+Сводки обновляются триггером при каждой новой записи; перестройка нужна
+после восстановления базы из копии или правок таблицы messages вручную.
+Учитываются сообщения из таблицы messages и из архива.
+Запуск: python rebuild_rollups.py
+"""
+
+import sys
+import os
+import time
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage.db import initialize_database
+from storage.rollups import rebuild_rollups
+
+def main():
+    initialize_database()
+
+    print("🔄 Перестройка сводных таблиц статистики...")
+    started = time.perf_counter()
+    counts = rebuild_rollups()
+    print(f"✅ Готово за {time.perf_counter() - started:.1f} с")
+    for table, count in counts.items():
+        print(f"   📊 {table}: {count} строк")
+
+if __name__ == "__main__":
+    main()
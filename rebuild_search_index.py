@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для заполнения и перестройки полнотекстового индекса сообщений.
+
+Миграция индексирует сообщения при создании индекса; скрипт нужен для
+баз, восстановленных из старых копий, и после правок в обход триггеров.
+Запуск: python rebuild_search_index.py [--check]
+"""
+
+import sys
+import os
+import time
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage.db import initialize_database
+from storage.search import rebuild_search_index, check_search_index
+
+def main():
+    initialize_database()
+
+    if "--check" in sys.argv:
+        if check_search_index():
+            print("✅ Индекс поиска соответствует сообщениям")
+        else:
+            print("❌ Индекс поиска поврежден, запустите скрипт без --check")
+        return
+
+    print("🔄 Перестройка индекса поиска...")
+    started = time.perf_counter()
+    indexed = rebuild_search_index()
+    print(f"✅ Проиндексировано сообщений: {indexed} за {time.perf_counter() - started:.1f} с")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Скрипт для полнотекстового поиска по сообщениям.
+
+Запуск: python search_messages.py "текст запроса" [telegram_id] [с_даты YYYY-MM-DD]
+"""
+
+import sys
+import os
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from storage.db import initialize_database
+from storage.search import search_messages
+
+def main():
+    if len(sys.argv) < 2:
+        print('Использование: python search_messages.py "текст запроса" [telegram_id] [с_даты YYYY-MM-DD]')
+        return
+
+    query = sys.argv[1]
+    user = None
+    since = None
+    if len(sys.argv) > 2:
+        try:
+            user = int(sys.argv[2])
+        except ValueError:
+            print("❌ Неверный формат Telegram ID")
+            return
+    if len(sys.argv) > 3:
+        since = sys.argv[3]
+
+    initialize_database()
+
+    results = search_messages(query, user=user, since=since, limit=50)
+    print(f"🔍 Поиск: {query}")
+    print(f"📝 Найдено: {len(results)}")
+    print("=" * 60)
+
+    for result in results:
+        role_emoji = "👤" if result['role'] == 'user' else "🤖"
+        user_info = f"@{result['username']}" if result['username'] else f"User {result['telegram_id']}"
+        print(f"{role_emoji} [{result['created_at']}] {user_info} (TG ID: {result['telegram_id']})")
+        print(f"   💬 {result['snippet']}")
+        print("-" * 40)
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ import logging
 from datetime import datetime
 from integrations.telegram import bot
 from services.scheduler import DailyReminderScheduler
-from storage.db import get_all_users
+from storage.iterators import count_users
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
@@ -21,11 +21,11 @@ async def send_manual_reminders():
     print(f"Время отправки: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     print()
     
-    # Получаем всех пользователей
-    users = get_all_users()
-    print(f"Найдено пользователей: {len(users)}")
+    # Считаем пользователей (сами пользователи читаются пачками при отправке)
+    users_count = count_users()
+    print(f"Найдено пользователей: {users_count}")
     
-    if not users:
+    if not users_count:
         print("❌ Нет пользователей для отправки уведомлений")
         return
     
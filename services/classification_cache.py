@@ -0,0 +1,102 @@
+# Кэш результатов классификации сообщений в памяти
+#
+# Короткие сообщения ("привет", "спасибо", "устал") повторяются тысячи раз
+# в день. Результат detect_emotion_keywords (локальная модель или запрос к
+# GPT) и determine_intent (поиск ключевых слов) запоминается по
+# нормализованному тексту: нижний регистр, ё -> е, без лишних пробелов.
+# Локальная классификация выполняется над тем же нормализованным текстом;
+# GPT получает исходное сообщение (регистр и пунктуация передают эмоцию), а
+# его ответ кэшируется по ключу для всех написаний.
+# Записи живут EmotionConfig.CACHE_TTL_SECONDS (после переобучения модели
+# или смены промпта старые ответы уходят сами); тексты длиннее
+# CACHE_MAX_TEXT_LENGTH не кэшируются - они почти не повторяются.
+
+import time
+from collections import OrderedDict
+from config import EmotionConfig
+
+def normalize_message(text: str) -> str:
+    """Ключ кэша: нижний регистр, ё -> е, пробелы схлопнуты"""
+    return " ".join(text.lower().replace("ё", "е").split())
+
+class ClassificationCache:
+    """LRU кэш результатов классификации по нормализованному тексту с истечением записей"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: int = None, max_text_length: int = None):
+        self.max_entries = max_entries or EmotionConfig.CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or EmotionConfig.CACHE_TTL_SECONDS
+        self.max_text_length = max_text_length or EmotionConfig.CACHE_MAX_TEXT_LENGTH
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        # Длинные тексты, прошедшие мимо кэша
+        self.skipped = 0
+
+    def cacheable(self, key: str) -> bool:
+        """Кэшируются только короткие тексты"""
+        return len(key) <= self.max_text_length
+
+    def get(self, key: str):
+        """Результат для нормализованного текста или None"""
+        if not self.cacheable(key):
+            self.skipped += 1
+            return None
+
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        value, expires_at = entry
+        if time.monotonic() >= expires_at:
+            del self._entries[key]
+            self.expired += 1
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value):
+        """Запоминает результат (длинные тексты пропускаются)"""
+        if not self.cacheable(key):
+            return
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        """Очищает весь кэш"""
+        self._entries.clear()
+
+    def reset_stats(self):
+        """Сбрасывает счетчики"""
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.skipped = 0
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'expired': self.expired,
+            'evictions': self.evictions,
+            'skipped': self.skipped,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+# Эмоция сообщения (services/gpt_service.detect_emotion_keywords)
+emotion_cache = ClassificationCache()
+
+# Интент сообщения (services/intents.determine_intent)
+intent_cache = ClassificationCache()
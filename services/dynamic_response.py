@@ -121,6 +121,16 @@ def get_response_config(emotion_type: str, context_type: str = "follow_up") -> D
         "context_modifier": context_modifier
     }
 
+def get_length_instructions() -> str:
+    """
+    Длина и стиль ответа для каждой эмоции - для режима, в котором модель
+    сама определяет эмоцию и сразу отвечает (эмоция заранее неизвестна)
+    """
+    return "\n".join(
+        f"- {emotion}: {config['description']}; {config['min_sentences']}-{config['max_sentences']} предложений"
+        for emotion, config in DynamicResponseConfig.EMOTION_RESPONSE_CONFIG.items()
+    )
+
 def analyze_conversation_context(conversation_history: list, current_message: str) -> str:
     """
     Анализирует контекст разговора для определения типа контекста
@@ -0,0 +1,196 @@
+# Локальный классификатор эмоций сообщения
+#
+# Отвечает за доли миллисекунды вместо отдельного запроса к модели.
+# Признаки: основы слов (первые STEM_LENGTH символов), пары соседних основ
+# и срабатывания ключевых слов каждой эмоции. Модель - мультиномиальный
+# наивный Байес, обученный заранее на сообщениях из таблицы messages,
+# размеченных GPT (train_emotion_classifier.py). Если файла модели нет,
+# работают правила по ключевым словам. Слова угрозы жизни (sos) всегда
+# дают sos с полной уверенностью. При уверенности ниже
+# EmotionConfig.CONFIDENCE_THRESHOLD эмоцию определяет GPT
+# (services/gpt_service.detect_emotion_keywords).
+
+import json
+import math
+import os
+import re
+from collections import Counter
+from config import EmotionConfig
+from services.classification_cache import emotion_cache
+
+EMOTIONS = ("sos", "anger", "sadness", "tired", "provocation", "generic", "neutral")
+
+# Ключевые слова эмоций, в порядке проверки правилами
+KEYWORDS = {
+    "sos": ["не хочу жить", "покончить", "самоуб", "суицид", "убью себя"],
+    "anger": ["бесит", "злюсь", "ярость", "убить", "достало"],
+    "sadness": ["грустно", "тяжело", "печаль", "разбито", "пусто"],
+    "tired": ["устал", "выгорел", "нет сил", "измотан"]
+}
+
+_WORD = re.compile(r"[a-zа-я0-9]+")
+
+def normalize_text(text: str) -> str:
+    """Нижний регистр, ё -> е"""
+    return text.lower().replace("ё", "е")
+
+def keyword_emotion(text: str):
+    """Первая эмоция, ключевое слово которой есть в тексте (текст уже нормализован)"""
+    for emotion, keywords in KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            return emotion
+    return None
+
+def extract_features(text: str, stem_length: int = None) -> list:
+    """Признаки сообщения: основы слов, пары основ, ключевые слова"""
+    stem_length = stem_length or EmotionConfig.STEM_LENGTH
+    text = normalize_text(text)
+    stems = [word[:stem_length] for word in _WORD.findall(text)]
+    features = stems + [f"{first}_{second}" for first, second in zip(stems, stems[1:])]
+    for emotion, keywords in KEYWORDS.items():
+        if any(keyword in text for keyword in keywords):
+            features.append(f"kw:{emotion}")
+    return features
+
+class EmotionClassifier:
+    """Мультиномиальный наивный Байес по признакам extract_features"""
+
+    def __init__(self, labels: list, class_log_prior: list, feature_log_prob: dict, stem_length: int):
+        self.labels = labels
+        self.class_log_prior = class_log_prior
+        # Признак -> логарифмы вероятностей по классам (в порядке labels)
+        self.feature_log_prob = feature_log_prob
+        self.stem_length = stem_length
+
+    @classmethod
+    def train(cls, examples, smoothing: float = None, stem_length: int = None) -> "EmotionClassifier":
+        """
+        Обучает модель на парах (текст, эмоция).
+        Признаки, встреченные один раз, отбрасываются.
+        """
+        smoothing = EmotionConfig.SMOOTHING if smoothing is None else smoothing
+        stem_length = stem_length or EmotionConfig.STEM_LENGTH
+
+        class_counts = Counter()
+        feature_counts = {}
+        documents = Counter()
+        for text, label in examples:
+            class_counts[label] += 1
+            counts = feature_counts.setdefault(label, Counter())
+            features = extract_features(text, stem_length)
+            counts.update(features)
+            documents.update(set(features))
+        if not class_counts:
+            raise ValueError("Нет примеров для обучения")
+
+        labels = [label for label in EMOTIONS if class_counts[label]]
+        vocabulary = [feature for feature, count in documents.items() if count > 1]
+        total = sum(class_counts.values())
+        class_log_prior = [math.log(class_counts[label] / total) for label in labels]
+
+        feature_log_prob = {feature: [] for feature in vocabulary}
+        for label in labels:
+            counts = feature_counts[label]
+            denominator = math.log(sum(counts[feature] for feature in vocabulary) + smoothing * len(vocabulary))
+            for feature in vocabulary:
+                feature_log_prob[feature].append(math.log(counts[feature] + smoothing) - denominator)
+        return cls(labels, class_log_prior, feature_log_prob, stem_length)
+
+    def predict(self, text: str) -> tuple:
+        """Эмоция и уверенность (апостериорная вероятность класса)"""
+        scores = list(self.class_log_prior)
+        for feature in extract_features(text, self.stem_length):
+            log_prob = self.feature_log_prob.get(feature)
+            if log_prob is not None:
+                for index, value in enumerate(log_prob):
+                    scores[index] += value
+        best = max(range(len(scores)), key=scores.__getitem__)
+        total = sum(math.exp(score - scores[best]) for score in scores)
+        return self.labels[best], 1.0 / total
+
+    def save(self, path: str):
+        """Сохраняет модель в JSON"""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'labels': self.labels,
+                'class_log_prior': self.class_log_prior,
+                'feature_log_prob': self.feature_log_prob,
+                'stem_length': self.stem_length
+            }, f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path: str) -> "EmotionClassifier":
+        """Загружает модель из JSON"""
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        return cls(data['labels'], data['class_log_prior'], data['feature_log_prob'], data['stem_length'])
+
+# Модель загружается при первом обращении; False - файла модели нет
+_classifier = None
+
+def get_emotion_classifier():
+    """Обученная модель или None, если файла модели нет"""
+    global _classifier
+    if _classifier is None:
+        try:
+            _classifier = EmotionClassifier.load(EmotionConfig.MODEL_PATH)
+        except FileNotFoundError:
+            _classifier = False
+        except (ValueError, KeyError) as e:
+            print(f"Ошибка загрузки модели эмоций {EmotionConfig.MODEL_PATH}: {e}")
+            _classifier = False
+    return _classifier or None
+
+def set_emotion_classifier(classifier):
+    """Подменяет модель (None - снова загрузить из файла, False - только правила)"""
+    global _classifier
+    _classifier = classifier
+    # Закэшированные эмоции получены прежней моделью
+    emotion_cache.clear()
+
+def classify_emotion(text: str) -> tuple:
+    """
+    Определяет эмоцию локально.
+
+    Returns:
+        (эмоция, уверенность от 0 до 1)
+    """
+    normalized = normalize_text(text)
+    # Угрозу жизни не доверяем статистике
+    if any(keyword in normalized for keyword in KEYWORDS["sos"]):
+        return "sos", 1.0
+
+    classifier = get_emotion_classifier()
+    if classifier is not None:
+        return classifier.predict(text)
+
+    emotion = keyword_emotion(normalized)
+    if emotion is not None:
+        return emotion, EmotionConfig.KEYWORD_CONFIDENCE
+    return "neutral", 0.0
+
+def read_labels(path: str = None) -> list:
+    """
+    Разметка сообщений моделью GPT.
+
+    Returns:
+        Список словарей {'text', 'label', 'gpt_ms'}
+    """
+    path = path or EmotionConfig.LABELS_PATH
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def append_labels(entries: list, path: str = None):
+    """Дописывает размеченные сообщения в файл разметки"""
+    path = path or EmotionConfig.LABELS_PATH
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'a', encoding='utf-8') as f:
+        for entry in entries:
+            f.write(json.dumps(entry, ensure_ascii=False) + "\n")
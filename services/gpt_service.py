@@ -1,39 +1,327 @@
 import os
+import json
 import random
-from openai import OpenAI
+import time
+import httpx
+from collections import Counter, OrderedDict, deque
+from openai import AsyncOpenAI
 from dotenv import load_dotenv
 from pathlib import Path
 import asyncio
-from config import OpenAIConfig
-from .dynamic_response import get_response_config, analyze_conversation_context, get_style_instructions, format_response_config_info
+from config import OpenAIConfig, EmotionConfig
+from .emotion_classifier import classify_emotion, EMOTIONS
+from .classification_cache import emotion_cache, normalize_message
+from .intents import INTENTS
+from .dynamic_response import (
+    get_response_config, analyze_conversation_context, get_style_instructions, format_response_config_info,
+    get_length_instructions
+)
 
 load_dotenv()
 
 # Глобальный клиент OpenAI
 _openai_client = None
 
-def get_openai_client():
-    """Получает или создает клиент OpenAI"""
+# Полосы приоритета запросов к модели: кризисные сообщения обслуживаются
+# первыми, затем премиум пользователи, затем бесплатные
+LANE_CRISIS = "crisis"
+LANE_PREMIUM = "premium"
+LANE_FREE = "free"
+LANES = (LANE_CRISIS, LANE_PREMIUM, LANE_FREE)
+
+def select_lane(premium: bool = False, crisis: bool = False) -> str:
+    """Полоса приоритета для запроса пользователя"""
+    if crisis:
+        return LANE_CRISIS
+    return LANE_PREMIUM if premium else LANE_FREE
+
+class LaneStats:
+    """
+    Накопленные счетчики и время ожидания в очереди одной полосы.
+    Текущие показатели (длина очереди, выполняемые запросы) здесь не
+    хранятся - они берутся из состояния планировщика.
+    """
+
+    def __init__(self, samples: int):
+        self.waits = deque(maxlen=samples)
+        self.reset()
+
+    def reset(self):
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.cancelled = 0
+        self.waited = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self.waits.clear()
+
+    def observe_wait(self, seconds: float):
+        self.waited += 1
+        self.total_wait += seconds
+        self.max_wait = max(self.max_wait, seconds)
+        self.waits.append(seconds)
+
+    def percentile(self, fraction: float) -> float:
+        """Перцентиль ожидания (секунды) по последним измерениям"""
+        if not self.waits:
+            return 0.0
+        values = sorted(self.waits)
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+    def to_dict(self, queued: int) -> dict:
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed,
+            'cancelled': self.cancelled,
+            'queued': queued,
+            'avg_wait_ms': self.total_wait / self.waited * 1000 if self.waited else 0.0,
+            'p50_wait_ms': self.percentile(0.5) * 1000,
+            'p95_wait_ms': self.percentile(0.95) * 1000,
+            'max_wait_ms': self.max_wait * 1000
+        }
+
+class LLMScheduler:
+    """
+    Очередь запросов к модели с приоритетами и адаптивным лимитом.
+
+    Свободный слот получает первый ожидающий запрос самой приоритетной
+    полосы. Внутри полосы пользователи обслуживаются по кругу, и у одного
+    пользователя не больше MAX_REQUESTS_PER_USER запросов одновременно,
+    поэтому активный собеседник не занимает все слоты. Лимит
+    одновременных запросов - AIMD: +1 за "окно" быстрых ответов при полной
+    загрузке, умножение на LATENCY_BACKOFF при ответе дольше LATENCY_TARGET
+    и на RATE_LIMIT_BACKOFF при ответе 429.
+    """
+
+    def __init__(self, initial: int = None, minimum: int = None, maximum: int = None, per_user: int = None):
+        self.minimum = minimum or OpenAIConfig.CONCURRENCY_MIN
+        self.maximum = maximum or OpenAIConfig.CONCURRENCY_MAX
+        self.per_user = per_user or OpenAIConfig.MAX_REQUESTS_PER_USER
+        self.limit = float(initial or OpenAIConfig.CONCURRENCY_INITIAL)
+        self.active = 0
+        self.active_by_user = {}
+        # Полоса -> {пользователь: ожидающие запросы}; порядок ключей - очередь пользователей
+        self.queues = {lane: OrderedDict() for lane in LANES}
+        self._last_backoff = 0.0
+        self.stats = {lane: LaneStats(OpenAIConfig.QUEUE_WAIT_SAMPLES) for lane in LANES}
+        self.reset_stats()
+
+    def reset_stats(self):
+        """
+        Сбрасывает накопленные счетчики. Текущие показатели (выполняемые
+        запросы, очереди) и лимит не меняются: запросы, начатые до сброса,
+        учитываются в тех же объектах LaneStats.
+        """
+        for stats in self.stats.values():
+            stats.reset()
+        self.rate_limited = 0
+        self.slow_responses = 0
+        self.backoffs = 0
+
+    async def run(self, call, lane: str = LANE_FREE, user_id=None):
+        """Выполняет call() (корутину запроса к модели), когда для нее освободится слот"""
+        stats = self.stats[lane]
+        await self._acquire(lane, user_id)
+        started = time.monotonic()
+        try:
+            result = await call()
+        except Exception:
+            stats.failed += 1
+            raise
+        finally:
+            self._observe_latency(time.monotonic() - started)
+            self._release(user_id)
+        stats.completed += 1
+        return result
+
+    def on_rate_limited(self):
+        """Ответ 429 от API"""
+        self.rate_limited += 1
+        self._backoff(OpenAIConfig.RATE_LIMIT_BACKOFF)
+
+    def queued(self, lane: str) -> int:
+        return sum(len(waiters) for waiters in self.queues[lane].values())
+
+    def snapshot(self) -> dict:
+        """Текущий лимит, загрузка и статистика по полосам"""
+        return {
+            'limit': self.limit,
+            'active': self.active,
+            'rate_limited': self.rate_limited,
+            'slow_responses': self.slow_responses,
+            'backoffs': self.backoffs,
+            'lanes': {lane: self.stats[lane].to_dict(self.queued(lane)) for lane in LANES}
+        }
+
+    async def _acquire(self, lane: str, user_id):
+        stats = self.stats[lane]
+        stats.submitted += 1
+        enqueued = time.monotonic()
+        future = asyncio.get_running_loop().create_future()
+        self.queues[lane].setdefault(user_id, deque()).append(future)
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Слот уже выдан, но запрос отменен - возвращаем слот
+                self._release(user_id)
+            else:
+                self._remove_waiter(lane, user_id, future)
+            stats.cancelled += 1
+            raise
+        stats.observe_wait(time.monotonic() - enqueued)
+
+    def _remove_waiter(self, lane: str, user_id, future):
+        waiters = self.queues[lane].get(user_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self.queues[lane][user_id]
+
+    def _next_waiter(self):
+        """Следующий запрос: по приоритету полос, внутри полосы - по кругу пользователей"""
+        for lane in LANES:
+            queue = self.queues[lane]
+            for user_id in queue:
+                if user_id is not None and self.active_by_user.get(user_id, 0) >= self.per_user:
+                    continue
+                waiters = queue.pop(user_id)
+                future = waiters.popleft()
+                if waiters:
+                    # Остальные запросы пользователя - в конец очереди полосы
+                    queue[user_id] = waiters
+                return user_id, future
+        return None
+
+    def _dispatch(self):
+        while self.active < max(1, int(self.limit)):
+            waiter = self._next_waiter()
+            if waiter is None:
+                return
+            user_id, future = waiter
+            if future.done():
+                # Ожидание отменено, но задача еще не убрала себя из очереди
+                continue
+            self.active += 1
+            if user_id is not None:
+                self.active_by_user[user_id] = self.active_by_user.get(user_id, 0) + 1
+            future.set_result(None)
+
+    def _release(self, user_id):
+        self.active -= 1
+        if user_id is not None:
+            remaining = self.active_by_user.get(user_id, 0) - 1
+            if remaining > 0:
+                self.active_by_user[user_id] = remaining
+            else:
+                self.active_by_user.pop(user_id, None)
+        self._dispatch()
+
+    def _observe_latency(self, seconds: float):
+        if seconds > OpenAIConfig.LATENCY_TARGET:
+            self.slow_responses += 1
+            self._backoff(OpenAIConfig.LATENCY_BACKOFF)
+        elif self.active >= int(self.limit):
+            # Лимит растет, только когда он действительно ограничивает запросы
+            self.limit = min(self.maximum, self.limit + 1 / self.limit)
+
+    def _backoff(self, factor: float):
+        # Одна перегрузка дает много медленных ответов и 429 подряд - уменьшаем лимит один раз
+        now = time.monotonic()
+        if now - self._last_backoff < OpenAIConfig.BACKOFF_COOLDOWN:
+            return
+        self._last_backoff = now
+        self.limit = max(self.minimum, self.limit * factor)
+        self.backoffs += 1
+
+# Общий планировщик запросов к модели
+llm_scheduler = LLMScheduler()
+
+# Запросы и израсходованные токены (все запросы через create_chat_completion)
+token_usage = Counter()
+
+# Режимы chat_with_gpt (OpenAIConfig.RESPONSE_MODE)
+RESPONSE_MODE_TWO_CALL = "two_call"
+RESPONSE_MODE_STRUCTURED = "structured"
+
+async def _observe_response(response: httpx.Response):
+    """Сообщает планировщику об ответах 429, в том числе на повторные попытки клиента"""
+    if response.status_code == 429:
+        llm_scheduler.on_rate_limited()
+
+def create_openai_client(api_key: str = None, transport: httpx.AsyncBaseTransport = None) -> AsyncOpenAI:
+    """
+    Создает асинхронный клиент OpenAI с общим пулом keep-alive соединений.
+
+    Запросы к API не блокируют цикл событий: пока один ответ генерируется,
+    бот обрабатывает сообщения других пользователей. HTTP клиент передается
+    явно, чтобы задать лимиты пула (и подменить транспорт в нагрузочном тесте).
+    """
+    api_key = api_key or os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
+
+    http_client = httpx.AsyncClient(
+        limits=httpx.Limits(
+            max_connections=OpenAIConfig.MAX_CONNECTIONS,
+            max_keepalive_connections=OpenAIConfig.MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=OpenAIConfig.KEEPALIVE_EXPIRY
+        ),
+        timeout=httpx.Timeout(OpenAIConfig.TIMEOUT, connect=OpenAIConfig.CONNECT_TIMEOUT),
+        event_hooks={'response': [_observe_response]},
+        transport=transport
+    )
+    return AsyncOpenAI(
+        api_key=api_key,
+        timeout=OpenAIConfig.TIMEOUT,
+        http_client=http_client
+    )
+
+def get_openai_client() -> AsyncOpenAI:
+    """Получает или создает общий клиент OpenAI"""
     global _openai_client
     if _openai_client is None:
-        api_key = os.getenv("OPENAI_API_KEY")
-        if not api_key:
-            raise ValueError("OPENAI_API_KEY не найден в переменных окружения")
-        
-        _openai_client = OpenAI(
-            api_key=api_key,
-            timeout=OpenAIConfig.TIMEOUT
-        )
+        _openai_client = create_openai_client()
     return _openai_client
 
+def set_openai_client(client: AsyncOpenAI):
+    """Подменяет общий клиент OpenAI (нагрузочные тесты)"""
+    global _openai_client
+    _openai_client = client
 
+async def create_chat_completion(messages: list, max_tokens: int = None, temperature: float = None,
+                                 lane: str = LANE_FREE, user_id: int = None, response_format: dict = None) -> str:
+    """Запрос к модели через общий клиент и планировщик; возвращает текст ответа"""
+    client = get_openai_client()
+    options = {'response_format': response_format} if response_format else {}
+    response = await llm_scheduler.run(
+        lambda: client.chat.completions.create(
+            model=OpenAIConfig.MODEL,
+            messages=messages,
+            max_tokens=max_tokens or OpenAIConfig.MAX_TOKENS,
+            temperature=OpenAIConfig.TEMPERATURE if temperature is None else temperature,
+            **options
+        ),
+        lane=lane,
+        user_id=user_id
+    )
+    token_usage['requests'] += 1
+    if response.usage:
+        token_usage['prompt_tokens'] += response.usage.prompt_tokens
+        token_usage['completion_tokens'] += response.usage.completion_tokens
+    return response.choices[0].message.content
 
-def detect_emotion_keywords(text: str) -> str:
-    """Определяет эмоциональное состояние сообщения с помощью GPT"""
-    try:
-        client = get_openai_client()
-        
-        prompt = f"""Проанализируй эмоциональное состояние следующего сообщения и верни ТОЛЬКО одно слово из списка:
+
+async def detect_emotion_gpt(text: str, lane: str = LANE_FREE, user_id: int = None) -> str:
+    """Определяет эмоциональное состояние сообщения с помощью GPT (ошибки API не перехватываются)"""
+    prompt = f"""Проанализируй эмоциональное состояние следующего сообщения и верни ТОЛЬКО одно слово из списка:
 - sos (если есть угроза жизни, суицидальные мысли, насилие)
 - anger (злость, ярость, раздражение)
 - sadness (грусть, печаль, депрессия)
@@ -46,46 +334,67 @@ def detect_emotion_keywords(text: str) -> str:
 
 Ответ:"""
 
-        response = client.chat.completions.create(
-            model=OpenAIConfig.MODEL,
-            messages=[{"role": "user", "content": prompt}],
-            max_tokens=OpenAIConfig.MAX_TOKENS,
-            temperature=OpenAIConfig.TEMPERATURE
-        )
-        
-        emotion = response.choices[0].message.content.strip().lower()
-        
-        # Проверяем, что ответ валидный
-        valid_emotions = ["sos", "anger", "sadness", "tired", "provocation", "generic", "neutral"]
-        if emotion in valid_emotions:
-            return emotion
-        else:
-            return "neutral"  # По умолчанию нейтральное
-            
-    except Exception as e:
-        print(f"Ошибка при определении эмоции через GPT: {e}")
-        
-        # Fallback к простой проверке ключевых слов
-        text_lower = text.lower()
-        
-        # Базовые ключевые слова для критических случаев
-        sos_keywords = ["не хочу жить", "покончить", "самоуб", "суицид", "убью себя"]
-        anger_keywords = ["бесит", "злюсь", "ярость", "убить", "достало"]
-        sadness_keywords = ["грустно", "тяжело", "печаль", "разбито", "пусто"]
-        tired_keywords = ["устал", "выгорел", "нет сил", "измотан"]
-        
-        if any(keyword in text_lower for keyword in sos_keywords):
-            return "sos"
-        elif any(keyword in text_lower for keyword in anger_keywords):
-            return "anger"
-        elif any(keyword in text_lower for keyword in sadness_keywords):
-            return "sadness"
-        elif any(keyword in text_lower for keyword in tired_keywords):
-            return "tired"
-        else:
-            return "neutral"
+    response = await create_chat_completion(
+        [{"role": "user", "content": prompt}],
+        max_tokens=EmotionConfig.GPT_MAX_TOKENS,
+        temperature=0,
+        lane=lane,
+        user_id=user_id
+    )
+    
+    emotion = response.strip().lower()
+    
+    # Проверяем, что ответ валидный
+    if emotion in EMOTIONS:
+        return emotion
+    else:
+        return "neutral"  # По умолчанию нейтральное
 
+def detect_emotion_local(text: str) -> tuple:
+    """
+    Определяет эмоцию без запроса к GPT: по кэшу нормализованных текстов,
+    затем локальным классификатором. Уверенный ответ классификатора кэшируется.
+    
+    Returns:
+        (эмоция, уверен ли ответ); при неуверенном ответе эмоцию должен определить GPT
+    """
+    key = normalize_message(text)
+    emotion = emotion_cache.get(key)
+    if emotion is not None:
+        return emotion, True
 
+    emotion, confidence = classify_emotion(key)
+    if confidence < EmotionConfig.CONFIDENCE_THRESHOLD:
+        return emotion, False
+    emotion_cache.put(key, emotion)
+    return emotion, True
+
+async def detect_emotion_keywords(text: str, lane: str = LANE_FREE, user_id: int = None) -> str:
+    """
+    Определяет эмоциональное состояние сообщения: сначала по кэшу
+    нормализованных текстов, затем локальным классификатором, а если он
+    не уверен - с помощью GPT
+    """
+    emotion, confident = detect_emotion_local(text)
+    if confident:
+        return emotion
+    return await confirm_emotion_gpt(text, emotion, lane=lane, user_id=user_id)
+
+async def confirm_emotion_gpt(text: str, fallback: str, lane: str = LANE_FREE, user_id: int = None) -> str:
+    """
+    Определяет эмоцию с помощью GPT, когда локальный классификатор не уверен,
+    и кэширует ее. При ошибке API возвращает fallback (ответ классификатора).
+    """
+    key = normalize_message(text)
+    try:
+        # Модели отправляется исходный текст: регистр и пунктуация помогают распознать эмоцию
+        emotion = await detect_emotion_gpt(text, lane=lane, user_id=user_id)
+    except Exception as e:
+        print(f"Ошибка при определении эмоции через GPT: {e}")
+        # Ответ локального классификатора в кэш не попадает
+        return fallback
+    emotion_cache.put(key, emotion)
+    return emotion
 
 def load_system_prompt() -> str:
     """Загружает системный промпт из файла"""
@@ -96,17 +405,105 @@ def load_system_prompt() -> str:
     except FileNotFoundError:
         return "Ты дружелюбный помощник, который поддерживает пользователей в сложных ситуациях."
 
-async def chat_with_gpt(user_message, user_id=None, conversation_history=None):
-    """Отправляет сообщение в GPT и получает ответ с динамической длиной"""
+def build_messages(system_prompt: str, user_message: str, conversation_history=None) -> list:
+    """Системный промпт, история разговора и текущее сообщение"""
+    messages = [{"role": "system", "content": system_prompt}]
+    
+    # Добавляем историю разговора, если есть
+    if conversation_history:
+        messages.extend(conversation_history)
+    
+    # Добавляем текущее сообщение пользователя
+    messages.append({"role": "user", "content": user_message})
+    return messages
+
+def parse_structured_reply(content: str) -> dict:
+    """
+    Разбирает ответ режима structured: {"emotion", "intent", "reply"}.
+    Неизвестные эмоция и интент заменяются на neutral и chat.
+    """
+    data = json.loads(content)
+    reply = data.get("reply") if isinstance(data, dict) else None
+    if not isinstance(reply, str) or not reply.strip():
+        raise ValueError("В ответе модели нет текста reply")
+    emotion = str(data.get("emotion", "")).strip().lower()
+    intent = str(data.get("intent", "")).strip().lower()
+    return {
+        "emotion": emotion if emotion in EMOTIONS else "neutral",
+        "intent": intent if intent in INTENTS else "chat",
+        "reply": reply
+    }
+
+async def chat_with_gpt_structured(user_message, user_id=None, conversation_history=None, lane=LANE_FREE, context_type=None) -> dict:
+    """
+    Один запрос вместо двух: модель определяет эмоцию и интент и сразу
+    отвечает, возвращая JSON. Эмоция заранее неизвестна, поэтому длина
+    ответа для каждой эмоции задается в промпте, а max_tokens - верхней
+    границей (OpenAIConfig.STRUCTURED_MAX_TOKENS). Готовый ответ не обрезается.
+    
+    Returns:
+        Словарь: emotion, intent, reply
+    """
+    context_type = context_type or analyze_conversation_context(conversation_history or [], user_message)
+    
+    system_prompt = f"""{load_system_prompt()}
+
+ФОРМАТ ОТВЕТА: верни только JSON-объект с полями:
+- "emotion": эмоциональное состояние сообщения пользователя, одно слово из: {", ".join(EMOTIONS)}
+  (sos - угроза жизни, суицидальные мысли, насилие; provocation - оскорбления, провокации;
+  generic - общие темы с эмоциональным подтекстом; neutral - обычные вопросы без эмоций)
+- "intent": намерение пользователя, одно слово из: {", ".join(INTENTS)}
+- "reply": твой ответ пользователю
+
+ДЛИНА И СТИЛЬ ОТВЕТА В ЗАВИСИМОСТИ ОТ ЭМОЦИИ (не превышай число предложений для эмоции, указанной в "emotion"):
+{get_length_instructions()}
+"""
+    
+    content = await create_chat_completion(
+        build_messages(system_prompt, user_message, conversation_history),
+        max_tokens=OpenAIConfig.STRUCTURED_MAX_TOKENS,
+        lane=lane,
+        user_id=user_id,
+        response_format={"type": "json_object"}
+    )
+    result = parse_structured_reply(content)
+    # Повтор того же сообщения обойдется без модели
+    emotion_cache.put(normalize_message(user_message), result["emotion"])
+    
+    # Логируем конфигурацию для отладки
+    print(f"🎯 Структурированный ответ: {result['emotion']} / {result['intent']} + {context_type}")
+    
+    return result
+
+async def chat_with_gpt(user_message, user_id=None, conversation_history=None, lane=LANE_FREE, mode=None):
+    """
+    Отправляет сообщение в GPT и получает ответ с динамической длиной.
+    
+    mode (по умолчанию OpenAIConfig.RESPONSE_MODE): two_call - эмоция
+    определяется отдельно (локально или запросом к GPT), затем ответ;
+    structured - если ни кэш, ни локальный классификатор не уверены, эмоция
+    и ответ приходят одним запросом (chat_with_gpt_structured).
+    Сообщения, похожие на кризисные (sos), идут в полосу LANE_CRISIS.
+    """
+    mode = mode or OpenAIConfig.RESPONSE_MODE
     try:
-        client = get_openai_client()
-        
-        # Определяем эмоциональное состояние сообщения
-        emotion_type = detect_emotion_keywords(user_message)
-        
         # Анализируем контекст разговора
         context_type = analyze_conversation_context(conversation_history or [], user_message)
         
+        # Определяем эмоциональное состояние сообщения
+        emotion_type, confident = detect_emotion_local(user_message)
+        if not confident and mode == RESPONSE_MODE_STRUCTURED:
+            # Полоса выбирается до запроса: если классификатор склоняется к sos,
+            # ответ генерируется в кризисной полосе, даже когда он не уверен
+            if emotion_type == "sos":
+                lane = LANE_CRISIS
+            result = await chat_with_gpt_structured(user_message, user_id, conversation_history, lane, context_type)
+            return result["reply"]
+        if not confident:
+            emotion_type = await confirm_emotion_gpt(user_message, emotion_type, lane=lane, user_id=user_id)
+        if emotion_type == "sos":
+            lane = LANE_CRISIS
+        
         # Получаем конфигурацию ответа
         response_config = get_response_config(emotion_type, context_type)
         
@@ -127,40 +524,27 @@ async def chat_with_gpt(user_message, user_id=None, conversation_history=None):
 """
         
         # Формируем сообщения для API
-        messages = [{"role": "system", "content": enhanced_system_prompt}]
-        
-        # Добавляем историю разговора, если есть
-        if conversation_history:
-            messages.extend(conversation_history)
-        
-        # Добавляем текущее сообщение пользователя
-        messages.append({"role": "user", "content": user_message})
+        messages = build_messages(enhanced_system_prompt, user_message, conversation_history)
         
         # Отправляем запрос к GPT с динамическими параметрами
-        response = client.chat.completions.create(
-            model=OpenAIConfig.MODEL,
-            messages=messages,
-            max_tokens=response_config["max_tokens"],
-            temperature=OpenAIConfig.TEMPERATURE
-        )
+        response = await create_chat_completion(messages, max_tokens=response_config["max_tokens"], lane=lane, user_id=user_id)
         
         # Логируем конфигурацию для отладки
         print(f"🎯 Динамический ответ: {emotion_type} + {context_type} = {response_config['max_tokens']} токенов")
         
-        return response.choices[0].message.content
+        return response
         
     except Exception as e:
         print(f"Ошибка при обращении к GPT: {e}")
         return "Извини, у меня сейчас технические проблемы. Попробуй чуть позже 🤖"
 
-def close_openai_client():
-    """Закрывает клиент OpenAI"""
+async def close_openai_client():
+    """Закрывает клиент OpenAI и его пул соединений"""
     global _openai_client
     if _openai_client:
         try:
-            # OpenAI клиент не требует явного закрытия
-            pass
+            await _openai_client.close()
         except Exception as e:
             print(f"Ошибка при закрытии OpenAI клиента: {e}")
         finally:
-            _openai_client = None
\ No newline at end of file
+            _openai_client = None
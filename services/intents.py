@@ -1,10 +1,24 @@
 # Логика определения намерений
 
+from services.classification_cache import intent_cache, normalize_message
+
+INTENTS = ("support", "advice", "question", "chat", "greeting", "goodbye", "gratitude", "compliment", "sos")
+
 def determine_intent(message: str) -> str:
     """
     Определяет намерение пользователя на основе ключевых слов и эмоционального контекста.
     Возможные намерения: support, advice, question, chat, greeting, goodbye, gratitude, compliment, sos.
+    Результат для повторяющихся сообщений берется из кэша по нормализованному тексту.
     """
+    key = normalize_message(message)
+    intent = intent_cache.get(key)
+    if intent is None:
+        intent = classify_intent(key)
+        intent_cache.put(key, intent)
+    return intent
+
+def classify_intent(message: str) -> str:
+    """Определение намерения по ключевым словам (без кэша)"""
     message_lower = message.lower()
 
     # Критические ситуации - высший приоритет
@@ -5,7 +5,10 @@ import logging
 from datetime import datetime, time
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.cron import CronTrigger
-from storage.db import get_all_users, get_users_for_auto_renewal, process_auto_renewal, get_users_for_renewal_reminder
+from apscheduler.triggers.interval import IntervalTrigger
+from storage.async_db import iter_users, renew_due_subscriptions, get_users_for_renewal_reminder, expire_premium_subscriptions, flush_message_journal, purge_cleared_history
+from storage.archive import archive_old_messages
+from storage.backup import backup_database
 from aiogram import Bot
 from aiogram.exceptions import TelegramBadRequest, TelegramForbiddenError
 from config import SchedulerConfig
@@ -59,6 +62,42 @@ class DailyReminderScheduler:
             replace_existing=True
         )
         
+        # Добавляем задачу на перенос старых сообщений в архив
+        self.scheduler.add_job(
+            self.archive_old_messages,
+            CronTrigger(hour=SchedulerConfig.RETENTION_HOUR, minute=SchedulerConfig.RETENTION_MINUTE),
+            id='message_retention',
+            name='Перенос старых сообщений в архив',
+            replace_existing=True
+        )
+        
+        # Добавляем задачу на снятие премиум статуса с истекших подписок
+        self.scheduler.add_job(
+            self.expire_premium_subscriptions,
+            CronTrigger(hour=SchedulerConfig.PREMIUM_EXPIRY_HOUR, minute=SchedulerConfig.PREMIUM_EXPIRY_MINUTE),
+            id='premium_expiry',
+            name='Снятие премиум статуса с истекших подписок',
+            replace_existing=True
+        )
+        
+        # Добавляем задачу на резервное копирование базы
+        self.scheduler.add_job(
+            self.backup_database,
+            CronTrigger(hour=SchedulerConfig.BACKUP_HOUR, minute=SchedulerConfig.BACKUP_MINUTE),
+            id='database_backup',
+            name='Резервное копирование базы данных',
+            replace_existing=True
+        )
+        
+        # Добавляем задачу на удаление истории, очищенной через /clear
+        self.scheduler.add_job(
+            self.purge_cleared_history,
+            IntervalTrigger(minutes=SchedulerConfig.HISTORY_PURGE_INTERVAL_MINUTES),
+            id='history_purge',
+            name='Удаление очищенной истории разговоров',
+            replace_existing=True
+        )
+        
         self.scheduler.start()
         logger.info(f"Планировщик запущен. Ежедневные напоминания в {reminder_time.strftime('%H:%M')}, напоминания об автосписании в {SchedulerConfig.RENEWAL_REMINDER_HOUR:02d}:{SchedulerConfig.RENEWAL_REMINDER_MINUTE:02d}, автопродление в {SchedulerConfig.AUTO_RENEWAL_HOUR:02d}:{SchedulerConfig.AUTO_RENEWAL_MINUTE:02d}")
     
@@ -71,18 +110,14 @@ class DailyReminderScheduler:
     async def send_daily_reminders(self):
         """Отправка ежедневных напоминаний всем пользователям"""
         try:
-            users = get_all_users()
-            if not users:
-                logger.info("Нет пользователей для отправки напоминаний")
-                return
-            
             import random
             message = random.choice(self.reminder_messages)
             
             sent_count = 0
             failed_count = 0
             
-            for user in users:
+            # Пользователи читаются пачками, отправка начинается сразу
+            async for user in iter_users():
                 try:
                     await self.bot.send_message(
                         chat_id=user['telegram_id'],
@@ -106,6 +141,10 @@ class DailyReminderScheduler:
                     logger.error(f"Неожиданная ошибка при отправке пользователю {user['telegram_id']}: {e}")
                     failed_count += 1
             
+            if sent_count + failed_count == 0:
+                logger.info("Нет пользователей для отправки напоминаний")
+                return
+            
             logger.info(f"Ежедневные напоминания отправлены: {sent_count} успешно, {failed_count} неудачно")
             
         except Exception as e:
@@ -126,54 +165,86 @@ class DailyReminderScheduler:
     async def process_auto_renewals(self):
         """Обработка автоматических продлений подписок"""
         try:
-            users_for_renewal = get_users_for_auto_renewal()
-            if not users_for_renewal:
+            # Все подписки, истекающие сегодня, продлеваются одной транзакцией
+            renewed = await renew_due_subscriptions()
+            if not renewed:
                 logger.info("Нет пользователей для автоматического продления подписок")
                 return
             
-            renewed_count = 0
+            notified_count = 0
             failed_count = 0
-            insufficient_funds_count = 0
             
-            for user in users_for_renewal:
+            for user in renewed:
                 user_id = user['telegram_id']
                 
                 try:
-                    # process_auto_renewal теперь сам определяет стоимость по типу подписки
-                    success = process_auto_renewal(user_id)
-                    if success:
-                        renewed_count += 1
-                        # Уведомляем пользователя об успешном продлении
-                        await self.bot.send_message(
-                            chat_id=user_id,
-                            text="✅ Ваша премиум подписка автоматически продлена!\n"
-                                 "Спасибо за использование нашего сервиса! 💫"
-                        )
-                    else:
-                        failed_count += 1
-                        # Уведомляем пользователя о проблеме с продлением
-                        await self.bot.send_message(
-                            chat_id=user_id,
-                            text="⚠️ Не удалось автоматически продлить премиум подписку!\n\n"
-                                 "Используйте /premium для управления подпиской."
-                        )
+                    # Уведомляем пользователя об успешном продлении
+                    await self.bot.send_message(
+                        chat_id=user_id,
+                        text="✅ Ваша премиум подписка автоматически продлена!\n"
+                             "Спасибо за использование нашего сервиса! 💫"
+                    )
+                    notified_count += 1
+                    # Небольшая задержка между отправками
+                    await asyncio.sleep(0.05)
                         
                 except TelegramForbiddenError:
                     logger.warning(f"Пользователь {user_id} заблокировал бота")
                     failed_count += 1
                 except Exception as e:
-                    logger.error(f"Ошибка при обработке автопродления для пользователя {user_id}: {e}")
+                    logger.error(f"Ошибка при уведомлении об автопродлении пользователя {user_id}: {e}")
                     failed_count += 1
             
-            logger.info(f"Автопродление завершено. Продлено: {renewed_count}, Ошибок: {failed_count}, Недостаточно средств: {insufficient_funds_count}")
+            logger.info(f"Автопродление завершено. Продлено: {len(renewed)}, уведомлено: {notified_count}, ошибок уведомления: {failed_count}")
             
         except Exception as e:
             logger.error(f"Ошибка при обработке автопродлений: {e}")
 
+    async def archive_old_messages(self):
+        """Перенос сообщений старше срока хранения в сжатый архив"""
+        try:
+            # Перенос идет через синхронное соединение в отдельном потоке
+            result = await asyncio.to_thread(archive_old_messages)
+            logger.info(f"Архивация сообщений завершена. Перенесено: {result['archived_messages']}, блоков: {result['archived_blocks']}, граница: {result['cutoff']}")
+        except Exception as e:
+            logger.error(f"Ошибка при архивации сообщений: {e}")
+
+    async def purge_cleared_history(self):
+        """Удаление сообщений, скрытых командой /clear, короткими транзакциями"""
+        try:
+            # Блокировка записи отпускается между пачками удаления
+            result = await purge_cleared_history()
+            if result['users']:
+                logger.info(f"Очищенная история удалена. Пользователей: {result['users']}, сообщений: {result['messages']}, из архива: {result['archived_messages']}")
+        except Exception as e:
+            logger.error(f"Ошибка при удалении очищенной истории: {e}")
+
+    async def backup_database(self):
+        """Резервная копия базы через online backup API с проверкой и ротацией"""
+        try:
+            # Сообщения из очереди записи попадают в копию
+            await flush_message_journal()
+            # Копирование идет порциями в отдельном потоке и не блокирует обработку сообщений
+            result = await asyncio.to_thread(backup_database)
+            logger.info(
+                f"Резервная копия создана: {result['path']} ({result['size_bytes'] / 1024 / 1024:.1f} МБ) "
+                f"за {result['seconds']:.1f} с, перезапусков: {result['restarts']}, удалено старых копий: {len(result['removed'])}"
+            )
+        except Exception as e:
+            logger.error(f"Ошибка при резервном копировании базы: {e}")
+
+    async def expire_premium_subscriptions(self):
+        """Снятие премиум статуса со всех истекших подписок одним запросом"""
+        try:
+            expired = await expire_premium_subscriptions()
+            logger.info(f"Истекшие подписки обработаны. Снят премиум статус: {len(expired)}")
+        except Exception as e:
+            logger.error(f"Ошибка при обработке истекших подписок: {e}")
+
     async def send_renewal_reminders(self):
         """Отправка напоминаний о предстоящем автоматическом списании"""
         try:
-            users = get_users_for_renewal_reminder()
+            users = await get_users_for_renewal_reminder()
             
             if not users:
                 logger.info("Нет пользователей для отправки напоминаний об автосписании")
@@ -12,8 +12,9 @@ from datetime import datetime
 # Добавляем корневую директорию в путь
 sys.path.append(os.path.dirname(os.path.abspath(__file__)))
 
-import sqlite3
-from config import DatabaseConfig
+from storage.connection import open_readonly_connection
+from storage.archive import get_messages_with_archive, get_archive_stats
+from storage.rollups import get_role_totals, get_daily_stats
 
 def show_all_chat_history():
     """Показать историю всех чатов"""
@@ -21,7 +22,7 @@ def show_all_chat_history():
     print("📚 История всех чатов с ботом EmoAi")
     print("=" * 60)
     
-    conn = sqlite3.connect(DatabaseConfig.DB_PATH, timeout=10.0)
+    conn = open_readonly_connection()
     cursor = conn.cursor()
     
     try:
@@ -88,22 +89,19 @@ def show_all_chat_history():
         total_messages = cursor.fetchone()[0]
         print(f"   Всего сообщений: {total_messages}")
         
-        # Сообщения пользователей vs бота
-        cursor.execute("SELECT role, COUNT(*) FROM messages GROUP BY role")
-        role_stats = cursor.fetchall()
-        for role, count in role_stats:
+        # Сообщения, перенесенные в архив
+        archive_stats = get_archive_stats(conn)
+        if archive_stats['messages']:
+            print(f"   В архиве: {archive_stats['messages']} ({archive_stats['compressed_bytes'] / 1024:.1f} КБ)")
+        
+        # Сообщения пользователей vs бота (за все время, по сводной таблице)
+        role_stats = get_role_totals(connection=conn)
+        for role, count in role_stats.items():
             role_name = "Пользователи" if role == 'user' else "Бот"
             print(f"   {role_name}: {count}")
         
         # Активность по дням
-        cursor.execute("""
-            SELECT DATE(created_at) as date, COUNT(*) as count 
-            FROM messages 
-            GROUP BY DATE(created_at) 
-            ORDER BY date DESC 
-            LIMIT 7
-        """)
-        daily_stats = cursor.fetchall()
+        daily_stats = [(day['day'], day['total']) for day in get_daily_stats(limit=7, connection=conn)]
         
         if daily_stats:
             print(f"\n📅 Активность за последние дни:")
@@ -122,13 +120,13 @@ def show_detailed_chat(telegram_id):
     print(f"💬 Детальная история чата с пользователем {telegram_id}")
     print("=" * 60)
     
-    conn = sqlite3.connect(DatabaseConfig.DB_PATH, timeout=10.0)
+    conn = open_readonly_connection()
     cursor = conn.cursor()
     
     try:
         # Получаем информацию о пользователе
         cursor.execute("""
-            SELECT username, first_name, last_name 
+            SELECT id, username 
             FROM users 
             WHERE telegram_id = ?
         """, (telegram_id,))
@@ -138,18 +136,14 @@ def show_detailed_chat(telegram_id):
             print(f"❌ Пользователь с ID {telegram_id} не найден")
             return
         
-        username, first_name, last_name = user_info
-        print(f"👤 Пользователь: {first_name} {last_name} (@{username})")
-        
-        # Получаем все сообщения
-        cursor.execute("""
-            SELECT role, message, created_at 
-            FROM messages 
-            WHERE user_id = (SELECT id FROM users WHERE telegram_id = ?)
-            ORDER BY created_at ASC
-        """, (telegram_id,))
+        user_id, username = user_info
+        print(f"👤 Пользователь: @{username}")
         
-        messages = cursor.fetchall()
+        # Получаем все сообщения, включая перенесенные в архив
+        messages = [
+            (msg['role'], msg['message'], msg['created_at'])
+            for msg in get_messages_with_archive(user_id=user_id, connection=conn)
+        ]
         
         print(f"📝 Всего сообщений: {len(messages)}")
         print("-" * 60)
@@ -0,0 +1,230 @@
+# Хранение старых сообщений: перенос в сжатый архив и чтение архива
+#
+# Сообщения старше DatabaseConfig.MESSAGE_RETENTION_DAYS переносятся из
+# таблицы messages в message_archive: один сжатый zlib блок на пользователя
+# за календарный месяц. Таблица messages остается небольшой, а старые
+# переписки читаются через iter_archived_messages / get_messages_with_archive.
+
+import json
+import zlib
+from datetime import datetime, timedelta, timezone
+from config import DatabaseConfig
+from storage.connection import get_connection
+from storage.iterators import iter_messages
+
+ARCHIVE_COMPRESSION = "zlib"
+
+# Отметки очистки истории (/clear): сообщения с ID не больше отметки скрыты,
+# даже если фоновое удаление (storage.history_purge) до них еще не дошло
+CLEARED_HISTORY_QUERY = "SELECT id, history_cleared_id FROM users WHERE history_cleared_id > 0"
+
+def encode_archive_rows(rows) -> bytes:
+    """Сжимает строки архива [id, role, message, created_at]"""
+    data = json.dumps(rows, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    return zlib.compress(data, DatabaseConfig.ARCHIVE_COMPRESSION_LEVEL)
+
+def decode_archive_rows(blob: bytes) -> list:
+    """Распаковывает строки архива [id, role, message, created_at]"""
+    if not blob:
+        return []
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+def retention_cutoff(older_than_days: int = None) -> str:
+    """Граница хранения в формате created_at (UTC)"""
+    if older_than_days is None:
+        older_than_days = DatabaseConfig.MESSAGE_RETENTION_DAYS
+    cutoff = datetime.now(timezone.utc) - timedelta(days=older_than_days)
+    return cutoff.strftime("%Y-%m-%d %H:%M:%S")
+
+def _month_bounds(month: str):
+    """Начало месяца и начало следующего месяца в формате created_at"""
+    year, month_number = (int(part) for part in month.split("-"))
+    if month_number == 12:
+        next_month = f"{year + 1:04d}-01"
+    else:
+        next_month = f"{year:04d}-{month_number + 1:02d}"
+    return f"{month}-01 00:00:00", f"{next_month}-01 00:00:00"
+
+def archive_user_month(connection, user_id: int, month: str, cutoff: str) -> int:
+    """
+    Переносит сообщения пользователя за месяц (старше cutoff) в архив
+    одной транзакцией. Возвращает количество перенесенных сообщений.
+    """
+    month_start, next_month_start = _month_bounds(month)
+    range_end = min(next_month_start, cutoff)
+
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        cursor.execute(
+            """
+            SELECT id, role, message, created_at FROM messages
+            WHERE user_id = ? AND created_at >= ? AND created_at < ?
+            ORDER BY created_at, id
+            """,
+            (user_id, month_start, range_end)
+        )
+        rows = [list(row) for row in cursor.fetchall()]
+        if not rows:
+            connection.rollback()
+            return 0
+
+        # Дописываем к уже существующему блоку за этот месяц
+        cursor.execute(
+            "SELECT data FROM message_archive WHERE user_id = ? AND month = ?",
+            (user_id, month)
+        )
+        existing = cursor.fetchone()
+        archived = decode_archive_rows(existing[0]) if existing else []
+        archived.extend(rows)
+
+        cursor.execute(
+            """
+            INSERT OR REPLACE INTO message_archive
+                (user_id, month, message_count, first_created_at, last_created_at, compression, data)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+            """,
+            (user_id, month, len(archived), archived[0][3], archived[-1][3],
+             ARCHIVE_COMPRESSION, encode_archive_rows(archived))
+        )
+        cursor.execute(
+            "DELETE FROM messages WHERE user_id = ? AND created_at >= ? AND created_at < ?",
+            (user_id, month_start, range_end)
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    return len(rows)
+
+def archive_old_messages(older_than_days: int = None) -> dict:
+    """
+    Переносит все сообщения старше older_than_days дней в сжатый архив.
+    Каждый блок (пользователь, месяц) переносится отдельной короткой
+    транзакцией, чтобы не держать блокировку записи надолго.
+
+    Returns:
+        Словарь со статистикой: archived_messages, archived_blocks, cutoff
+    """
+    connection = get_connection()
+    cutoff = retention_cutoff(older_than_days)
+
+    groups = connection.execute(
+        """
+        SELECT DISTINCT user_id, strftime('%Y-%m', created_at) AS month
+        FROM messages
+        WHERE created_at < ?
+        ORDER BY user_id, month
+        """,
+        (cutoff,)
+    ).fetchall()
+
+    archived_messages = 0
+    archived_blocks = 0
+    for user_id, month in groups:
+        if not month:
+            continue
+        moved = archive_user_month(connection, user_id, month, cutoff)
+        if moved:
+            archived_messages += moved
+            archived_blocks += 1
+
+    return {
+        'archived_messages': archived_messages,
+        'archived_blocks': archived_blocks,
+        'cutoff': cutoff
+    }
+
+def iter_archived_messages(user_id: int = None, since: str = None, until: str = None, connection=None):
+    """
+    Читает сообщения из архива в порядке времени (для каждого пользователя).
+
+    Args:
+        user_id: Внутренний ID пользователя (None - все пользователи)
+        since: Нижняя граница created_at включительно ('YYYY-MM-DD' или 'YYYY-MM-DD HH:MM:SS')
+        until: Верхняя граница created_at не включительно
+        connection: Соединение для чтения (по умолчанию соединение текущего потока)
+
+    Yields:
+        Словари {'id', 'user_id', 'role', 'message', 'created_at'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    conditions = []
+    params = []
+    if user_id is not None:
+        conditions.append("user_id = ?")
+        params.append(user_id)
+    # Отбираем блоки по месяцам, точная граница проверяется по строкам
+    if since:
+        conditions.append("month >= ?")
+        params.append(since[:7])
+    if until:
+        conditions.append("month <= ?")
+        params.append(until[:7])
+
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    blocks = connection.execute(
+        f"SELECT user_id, data FROM message_archive {where} ORDER BY user_id, month",
+        params
+    )
+
+    for block_user_id, data in blocks:
+        for message_id, role, message, created_at in decode_archive_rows(data):
+            if since and created_at < since:
+                continue
+            if until and created_at >= until:
+                continue
+            yield {
+                'id': message_id,
+                'user_id': block_user_id,
+                'role': role,
+                'message': message,
+                'created_at': created_at
+            }
+
+def history_cleared_ids(user_id: int = None, connection=None) -> dict:
+    """Отметки очистки истории: внутренний ID пользователя -> history_cleared_id"""
+    if connection is None:
+        connection = get_connection()
+
+    if user_id is None:
+        return dict(connection.execute(CLEARED_HISTORY_QUERY).fetchall())
+    return dict(connection.execute(f"{CLEARED_HISTORY_QUERY} AND id = ?", (user_id,)).fetchall())
+
+def get_messages_with_archive(user_id: int = None, since: str = None, connection=None) -> list:
+    """
+    Возвращает сообщения из архива и из таблицы messages вместе,
+    отсортированные по времени. Используется скриптами экспорта.
+    Сообщения, скрытые очисткой истории (/clear), не возвращаются.
+
+    Returns:
+        Список словарей {'id', 'user_id', 'role', 'message', 'created_at'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    cleared = history_cleared_ids(user_id, connection)
+    messages = list(iter_archived_messages(user_id=user_id, since=since, connection=connection))
+    messages.extend(iter_messages(since=since, user=user_id, connection=connection))
+    if cleared:
+        messages = [msg for msg in messages if msg['id'] > cleared.get(msg['user_id'], 0)]
+
+    messages.sort(key=lambda msg: (msg['created_at'], msg['id']))
+    return messages
+
+def get_archive_stats(connection=None) -> dict:
+    """Статистика архива: количество блоков, сообщений и объем сжатых данных"""
+    if connection is None:
+        connection = get_connection()
+
+    blocks, messages, compressed_bytes = connection.execute(
+        "SELECT COUNT(*), COALESCE(SUM(message_count), 0), COALESCE(SUM(LENGTH(data)), 0) FROM message_archive"
+    ).fetchone()
+    return {
+        'blocks': blocks,
+        'messages': messages,
+        'compressed_bytes': compressed_bytes
+    }
@@ -0,0 +1,852 @@
+# Асинхронная работа с SQLite через aiosqlite
+#
+# Повторяет публичный API storage/db.py, но не блокирует цикл событий:
+# запросы выполняются в потоках aiosqlite. Используется обработчиками
+# бота и планировщиком; синхронный storage/db.py остается для
+# административных скриптов.
+
+import asyncio
+import sqlite3
+import aiosqlite
+from config import DatabaseConfig, LimitsConfig
+from storage.connection import CONNECTION_PRAGMAS
+from storage.query_stats import connection_factory
+from storage.db import (
+    USER_SELECT_QUERY, user_from_row, history_from_rows,
+    daily_count_for_today, extended_subscription_end,
+    renewal_days, build_preferences_update,
+    premium_status_from_row, EXPIRE_PREMIUM_SUBSCRIPTIONS_QUERY,
+    RENEW_DUE_SUBSCRIPTIONS_QUERY, renewal_params, renewed_from_rows,
+    CONSUME_MESSAGE_CREDIT_QUERY, consume_credit_params, message_credit_from_row,
+    USER_STATS_QUERY, user_stats_from_row,
+    CONVERSATION_HISTORY_QUERY, CLEAR_HISTORY_QUERY, QUEUE_HISTORY_PURGE_QUERY, CLEAR_USER_STATS_QUERY
+)
+from storage.user_context import UserContext, USER_CONTEXT_QUERY, USER_CONTEXT_CONSUME_QUERY
+from storage.message_journal import MessageJournal, history_from_pending
+from storage.history_cache import HistoryCache
+from storage.premium_cache import PremiumCache
+from storage.preferences import (
+    PreferencesCache, PREFERENCES_QUERY, preferences_with_settings_from_row,
+    SETTING_UPSERT_QUERY, SETTING_DELETE_QUERY, encode_setting, check_setting_key
+)
+from storage.payments import INSERT_PAYMENT_QUERY, SET_PAYMENT_SUBSCRIPTION_END_QUERY
+from storage.history_purge import (
+    PENDING_HISTORY_PURGES_QUERY, PURGE_MESSAGES_BATCH_QUERY, USER_ARCHIVE_BLOCKS_QUERY,
+    COMPLETE_HISTORY_PURGE_QUERY, archive_purge_statements
+)
+from storage.iterators import build_users_query, user_summary_from_row, build_messages_query, message_from_row
+
+class AsyncConnectionManager:
+    """
+    Держит два постоянных aiosqlite соединения: для чтения и для записи.
+
+    Читатель в режиме WAL не ждет писателя, поэтому медленный коммит
+    или контрольная точка не задерживают чтение истории. Записи
+    выполняются под asyncio.Lock, чтобы транзакции разных корутин
+    не смешивались на общем соединении.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._reader = None
+        self._writer = None
+        self._open_lock = asyncio.Lock()
+        self.write_lock = asyncio.Lock()
+
+    async def _open(self) -> aiosqlite.Connection:
+        connection = aiosqlite.connect(
+            self.db_path,
+            timeout=DatabaseConfig.BUSY_TIMEOUT_MS / 1000,
+            cached_statements=DatabaseConfig.STATEMENT_CACHE_SIZE,
+            factory=connection_factory()
+        )
+        # Поток соединения не должен мешать завершению процесса
+        connection.daemon = True
+        await connection
+        for pragma in CONNECTION_PRAGMAS:
+            await connection.execute(pragma)
+        return connection
+
+    async def reader(self) -> aiosqlite.Connection:
+        """Соединение для чтения"""
+        if self._reader is None:
+            async with self._open_lock:
+                if self._reader is None:
+                    self._reader = await self._open()
+        return self._reader
+
+    async def writer(self) -> aiosqlite.Connection:
+        """Соединение для записи (использовать под write_lock)"""
+        if self._writer is None:
+            async with self._open_lock:
+                if self._writer is None:
+                    self._writer = await self._open()
+        return self._writer
+
+    async def fetchone(self, query: str, params=()):
+        """Выполняет читающий запрос и возвращает первую строку"""
+        connection = await self.reader()
+        async with connection.execute(query, params) as cursor:
+            return await cursor.fetchone()
+
+    async def fetchall(self, query: str, params=()):
+        """Выполняет читающий запрос и возвращает все строки"""
+        connection = await self.reader()
+        return await connection.execute_fetchall(query, params)
+
+    async def execute_write(self, query: str, params=()) -> int:
+        """Выполняет пишущий запрос в отдельной транзакции, возвращает rowcount"""
+        async with self.write_lock:
+            connection = await self.writer()
+            try:
+                async with connection.execute(query, params) as cursor:
+                    rowcount = cursor.rowcount
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
+        return rowcount
+
+    async def close(self):
+        """Закрывает соединения (при остановке приложения)"""
+        for connection in (self._reader, self._writer):
+            if connection is not None:
+                try:
+                    await connection.close()
+                except Exception as e:
+                    print(f"Ошибка при закрытии соединения с БД: {e}")
+        self._reader = None
+        self._writer = None
+
+# Общий менеджер соединений для основной базы данных
+async_connection_manager = AsyncConnectionManager(DatabaseConfig.DB_PATH)
+
+# Очередь отложенной записи сообщений чата
+message_journal = MessageJournal(async_connection_manager)
+
+# Кэш последних сообщений истории разговора
+history_cache = HistoryCache()
+
+# Кэш премиум статуса по telegram_id
+premium_cache = PremiumCache()
+
+# Кэш пользовательских предпочтений по telegram_id
+preferences_cache = PreferencesCache()
+
+def _append_message(user_id: int, message: str, role: str):
+    """Ставит реплику в очередь записи и добавляет ее в кэш истории"""
+    row = message_journal.append(user_id, message, role)
+    history_cache.append(user_id, history_from_pending([row])[0])
+
+def _cache_history(user_id: int, telegram_id: int, history: list, limit: int):
+    """Заполняет кэш историей, прочитанной из базы вместе с очередью записи"""
+    history_cache.fill(user_id, telegram_id, history, complete=len(history) < limit)
+
+async def flush_message_journal() -> int:
+    """Записывает в базу все сообщения из очереди отложенной записи"""
+    return await message_journal.flush()
+
+async def close_async_connections():
+    """Записывает очередь сообщений и закрывает асинхронные соединения с основной базой данных"""
+    await message_journal.close()
+    await async_connection_manager.close()
+
+async def add_user(username: str, telegram_id: int) -> int:
+    """
+    Добавляет нового пользователя в базу данных.
+    Возвращает ID пользователя или существующий ID если пользователь уже есть.
+    """
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            # Проверяем, существует ли пользователь
+            async with connection.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,)) as cursor:
+                existing_user = await cursor.fetchone()
+
+            if existing_user:
+                return existing_user[0]
+
+            # Добавляем нового пользователя
+            async with connection.execute(
+                "INSERT INTO users (username, telegram_id, created_at) VALUES (?, ?, datetime('now'))",
+                (username, telegram_id)
+            ) as cursor:
+                user_id = cursor.lastrowid
+            await connection.commit()
+
+            return user_id
+        except sqlite3.OperationalError as e:
+            print(f"Database error in add_user: {e}")
+            await connection.rollback()
+            # Возвращаем 0 в случае ошибки, чтобы не ломать логику
+            return 0
+
+async def get_user_by_telegram_id(telegram_id: int) -> dict:
+    """
+    Получает данные пользователя по Telegram ID.
+    """
+    user = await async_connection_manager.fetchone(USER_SELECT_QUERY, (telegram_id,))
+    return user_from_row(user, telegram_id)
+
+async def is_new_user(telegram_id: int) -> bool:
+    """
+    Проверяет, является ли пользователь новым (первый раз зашел).
+    """
+    user = await async_connection_manager.fetchone("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
+    return user is None
+
+async def add_message(user_id: int, message: str, role: str = 'user'):
+    """
+    Добавляет сообщение в историю чата.
+    Запись отложенная: сообщение попадает в базу с ближайшим групповым коммитом.
+    """
+    _append_message(user_id, message, role)
+
+async def get_conversation_history(user_id: int, limit: int = 50) -> list:
+    """
+    Получает историю разговора пользователя, включая еще не записанные сообщения.
+    Последние сообщения обычно берутся из кэша без обращения к базе.
+    """
+    cached = history_cache.get(user_id, limit)
+    if cached is not None:
+        return cached
+
+    manager = async_connection_manager
+    params = {'user_id': user_id, 'limit': limit}
+
+    if not message_journal.has_pending(user_id):
+        appended = message_journal.appended
+        messages = await manager.fetchall(CONVERSATION_HISTORY_QUERY, params)
+        # Возвращаем в обратном порядке (от старых к новым)
+        history = history_from_rows(messages)
+        # Пока шло чтение, в очередь могли добавиться новые реплики - тогда не кэшируем
+        if message_journal.appended == appended:
+            _cache_history(user_id, None, history, limit)
+        return history
+
+    # Под write_lock строки очереди либо еще не записаны, либо уже видны писателю
+    async with manager.write_lock:
+        connection = await manager.writer()
+        messages = await connection.execute_fetchall(CONVERSATION_HISTORY_QUERY, params)
+        pending = message_journal.pending_for_user(user_id)
+
+    history = history_from_rows(messages) + history_from_pending(pending)
+    history = history[-limit:] if limit else []
+    _cache_history(user_id, None, history, limit)
+    return history
+
+async def clear_conversation_history(user_id: int):
+    """
+    Очищает историю разговора пользователя (вместе с очередью отложенной записи).
+    Выполняется за время одного короткого UPDATE: ставится отметка очистки,
+    а сами сообщения удаляет фоновая задача (storage.history_purge).
+    """
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        # Под write_lock незаписанные реплики еще в очереди: они получили бы ID больше отметки
+        message_journal.discard_user(user_id)
+        connection = await manager.writer()
+        try:
+            async with connection.execute(CLEAR_HISTORY_QUERY, (user_id,)) as cursor:
+                row = await cursor.fetchone()
+            if row:
+                await connection.execute(QUEUE_HISTORY_PURGE_QUERY, (user_id, row[0]))
+                await connection.execute(CLEAR_USER_STATS_QUERY, (user_id,))
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+        # История теперь пуста: следующие чтения обслуживаются из кэша
+        history_cache.fill(user_id, None, [], complete=True)
+
+async def purge_cleared_history(batch: int = None, max_users: int = None) -> dict:
+    """
+    Удаляет очищенные через /clear сообщения пачками по batch строк
+    (см. storage.history_purge). write_lock берется на одну пачку и
+    отпускается между пачками, чтобы запись сообщений не ждала весь проход.
+
+    Returns:
+        Словарь: users, messages, archived_messages
+    """
+    manager = async_connection_manager
+    batch = batch or DatabaseConfig.HISTORY_PURGE_BATCH_SIZE
+    max_users = max_users or DatabaseConfig.HISTORY_PURGE_MAX_USERS
+
+    result = {'users': 0, 'messages': 0, 'archived_messages': 0}
+    for user_id, up_to_id in await manager.fetchall(PENDING_HISTORY_PURGES_QUERY, (max_users,)):
+        while True:
+            async with manager.write_lock:
+                connection = await manager.writer()
+                try:
+                    async with connection.execute(PURGE_MESSAGES_BATCH_QUERY, (user_id, up_to_id, batch)) as cursor:
+                        deleted = cursor.rowcount
+                    await connection.commit()
+                except Exception:
+                    await connection.rollback()
+                    raise
+            result['messages'] += deleted
+            if deleted < batch:
+                break
+
+        async with manager.write_lock:
+            connection = await manager.writer()
+            try:
+                blocks = await connection.execute_fetchall(USER_ARCHIVE_BLOCKS_QUERY, (user_id,))
+                removed, statements = archive_purge_statements(blocks, user_id, up_to_id)
+                for query, params in statements:
+                    await connection.execute(query, params)
+                await connection.execute(COMPLETE_HISTORY_PURGE_QUERY, (user_id, up_to_id))
+                await connection.commit()
+            except Exception:
+                await connection.rollback()
+                raise
+        result['archived_messages'] += removed
+        result['users'] += 1
+
+    return result
+
+async def get_user_stats(user_id: int) -> dict:
+    """
+    Получает статистику пользователя.
+    """
+    manager = async_connection_manager
+
+    # Итоги обновляются триггером при записи, поэтому сначала записываем очередь
+    if message_journal.has_pending(user_id):
+        await message_journal.flush()
+
+    result = await manager.fetchone(USER_STATS_QUERY, (user_id,))
+    return user_stats_from_row(result)
+
+async def get_all_users():
+    """
+    Получает всех пользователей из базы данных.
+    """
+    users = await async_connection_manager.fetchall("SELECT id, username, telegram_id, created_at FROM users")
+
+    return [{
+        'id': user[0],
+        'username': user[1],
+        'telegram_id': user[2],
+        'created_at': user[3]
+    } for user in users]
+
+async def iter_users(batch: int = 1000, where: str = None, params=()):
+    """
+    Перебирает пользователей по возрастанию id пачками по batch строк
+    (см. storage.iterators.iter_users).
+    """
+    query = build_users_query(where)
+    last_id = 0
+    while True:
+        rows = await async_connection_manager.fetchall(query, (last_id, *params, batch))
+        for row in rows:
+            yield user_summary_from_row(row)
+        if len(rows) < batch:
+            return
+        last_id = rows[-1][0]
+
+async def iter_messages(since: str = None, user: int = None, batch: int = 1000):
+    """
+    Перебирает записанные сообщения в порядке времени пачками по batch строк
+    (см. storage.iterators.iter_messages).
+    """
+    query = build_messages_query(user)
+    extra = (user,) if user is not None else ()
+    last_key = (since or "", 0)
+    while True:
+        rows = await async_connection_manager.fetchall(query, (*last_key, *extra, batch))
+        for row in rows:
+            yield message_from_row(row)
+        if len(rows) < batch:
+            return
+        last_key = (rows[-1][4], rows[-1][0])
+
+async def check_daily_message_limit(telegram_id: int, limit: int = None) -> bool:
+    """
+    Проверяет, не превышен ли дневной лимит сообщений для пользователя.
+    Премиум пользователи имеют безлимитный доступ.
+    """
+    premium_info = await get_user_premium_status(telegram_id)
+    if premium_info and premium_info['premium_status']:
+        return True
+
+    if limit is None:
+        limit = LimitsConfig.DAILY_MESSAGE_LIMIT
+
+    result = await async_connection_manager.fetchone(
+        "SELECT daily_message_count, last_message_date FROM users WHERE telegram_id = ?",
+        (telegram_id,)
+    )
+
+    if not result:
+        return True  # Пользователь не найден, разрешаем
+
+    return daily_count_for_today(result) < limit
+
+async def increment_daily_message_count(telegram_id: int):
+    """
+    Увеличивает счетчик ежедневных сообщений пользователя (смена дня учитывается в том же UPDATE).
+    """
+    from datetime import date
+
+    today = date.today().isoformat()
+    await async_connection_manager.execute_write(
+        """
+        UPDATE users
+        SET daily_message_count = CASE WHEN last_message_date = ? THEN COALESCE(daily_message_count, 0) + 1 ELSE 1 END,
+            last_message_date = ?
+        WHERE telegram_id = ?
+        """,
+        (today, today, telegram_id)
+    )
+
+async def consume_message_credit(telegram_id: int, limit: int = None) -> dict:
+    """
+    Атомарно списывает одно сообщение из дневного лимита (одним UPDATE ... RETURNING).
+    Возвращает новый счетчик, разрешено ли сообщение и премиум статус.
+    """
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            async with connection.execute(CONSUME_MESSAGE_CREDIT_QUERY, consume_credit_params(telegram_id, limit)) as cursor:
+                result = await cursor.fetchone()
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+
+    return message_credit_from_row(result, limit)
+
+async def get_daily_message_count(telegram_id: int) -> int:
+    """
+    Получает текущий счетчик ежедневных сообщений пользователя.
+    """
+    result = await async_connection_manager.fetchone(
+        "SELECT daily_message_count, last_message_date FROM users WHERE telegram_id = ?",
+        (telegram_id,)
+    )
+    # После отказа счетчик хранит limit + 1, показываем не больше лимита
+    return min(daily_count_for_today(result), LimitsConfig.DAILY_MESSAGE_LIMIT)
+
+async def get_user_premium_status(telegram_id: int) -> dict:
+    """
+    Получает информацию о премиум статусе пользователя (из кэша, если есть).
+    """
+    cached = premium_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+
+    invalidations = premium_cache.invalidations
+    result = await async_connection_manager.fetchone(
+        "SELECT premium_status, subscription_end_date, auto_renewal FROM users WHERE telegram_id = ?",
+        (telegram_id,)
+    )
+
+    info = premium_status_from_row(result)
+    if result and premium_cache.invalidations == invalidations:
+        premium_cache.put(telegram_id, info)
+    return info
+
+async def expire_premium_subscriptions() -> list:
+    """
+    Снимает премиум статус со всех истекших подписок одним UPDATE
+    и сбрасывает их записи в кэше премиум статуса.
+
+    Returns:
+        Список telegram_id пользователей, у которых снят премиум статус
+    """
+    from datetime import date
+
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            async with connection.execute(EXPIRE_PREMIUM_SUBSCRIPTIONS_QUERY, (date.today().isoformat(),)) as cursor:
+                expired = [row[0] for row in await cursor.fetchall()]
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+
+    premium_cache.invalidate_many(expired)
+    return expired
+
+async def _activate_premium_locked(connection: aiosqlite.Connection, telegram_id: int, days: int) -> str:
+    """
+    Продлевает или оформляет подписку в текущей транзакции (под write_lock).
+    Возвращает новую дату окончания подписки.
+    """
+    # Получаем текущую дату окончания подписки
+    async with connection.execute(
+        "SELECT subscription_end_date FROM users WHERE telegram_id = ?",
+        (telegram_id,)
+    ) as cursor:
+        result = await cursor.fetchone()
+
+    # Активная подписка продлевается, иначе оформляется новая
+    new_end = extended_subscription_end(result[0] if result else None, days)
+
+    await connection.execute(
+        "UPDATE users SET premium_status = TRUE, subscription_end_date = ?, subscription_type = ?, auto_renewal = TRUE WHERE telegram_id = ?",
+        (new_end, days, telegram_id)
+    )
+    return new_end
+
+async def activate_premium_subscription(telegram_id: int, days: int = None):
+    """
+    Активирует премиум подписку для пользователя.
+    """
+    if days is None:
+        days = LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS
+
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            await _activate_premium_locked(connection, telegram_id, days)
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+        premium_cache.invalidate(telegram_id)
+
+async def apply_payment(telegram_id: int, charge_id: str, amount: int, days: int,
+                        currency: str = "XTR", provider_charge_id: str = None) -> bool:
+    """
+    Записывает платеж в журнал и продлевает подписку одной транзакцией.
+    Платеж с уже записанным charge_id (повторная доставка обновления)
+    ничего не меняет.
+
+    Returns:
+        True, если платеж новый и подписка продлена, False для повтора
+    """
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            async with connection.execute(
+                INSERT_PAYMENT_QUERY,
+                (telegram_id, charge_id, provider_charge_id, amount, currency, days)
+            ) as cursor:
+                inserted = await cursor.fetchone()
+
+            if not inserted:
+                await connection.rollback()
+                return False
+
+            new_end = await _activate_premium_locked(connection, telegram_id, days)
+            await connection.execute(SET_PAYMENT_SUBSCRIPTION_END_QUERY, (new_end, inserted[0]))
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+        premium_cache.invalidate(telegram_id)
+    return True
+
+async def get_all_premium_users() -> list:
+    """
+    Получает список всех активных премиум пользователей.
+    """
+    from datetime import date
+
+    users = await async_connection_manager.fetchall(
+        """
+        SELECT telegram_id, username, subscription_end_date
+        FROM users
+        WHERE premium_status = TRUE
+        AND (subscription_end_date IS NULL OR subscription_end_date >= ?)
+        """,
+        (date.today().isoformat(),)
+    )
+
+    return [{
+        'telegram_id': user[0],
+        'username': user[1],
+        'subscription_end': user[2]
+    } for user in users]
+
+async def get_users_for_renewal_reminder():
+    """
+    Получает пользователей с автопродлением, у которых подписка истекает через 3 дня.
+    """
+    from datetime import date, timedelta
+
+    reminder_date = date.today() + timedelta(days=3)
+
+    users = await async_connection_manager.fetchall(
+        """
+        SELECT telegram_id, username, subscription_end_date
+        FROM users
+        WHERE auto_renewal = TRUE
+        AND premium_status = TRUE
+        AND subscription_end_date IS NOT NULL
+        AND subscription_end_date = ?
+        """,
+        (reminder_date.isoformat(),)
+    )
+
+    return [
+        {
+            'telegram_id': user[0],
+            'username': user[1],
+            'subscription_end_date': user[2]
+        }
+        for user in users
+    ]
+
+async def set_auto_renewal(telegram_id: int, auto_renewal: bool):
+    """
+    Устанавливает статус автоматического продления подписки для пользователя.
+    """
+    await async_connection_manager.execute_write(
+        "UPDATE users SET auto_renewal = ? WHERE telegram_id = ?",
+        (auto_renewal, telegram_id)
+    )
+    premium_cache.invalidate(telegram_id)
+
+async def get_users_for_auto_renewal():
+    """
+    Получает пользователей с автопродлением, у которых подписка истекает сегодня.
+    """
+    from datetime import date
+
+    users = await async_connection_manager.fetchall(
+        """
+        SELECT telegram_id, username, subscription_end_date
+        FROM users
+        WHERE auto_renewal = TRUE
+        AND premium_status = TRUE
+        AND subscription_end_date IS NOT NULL
+        AND subscription_end_date = ?
+        """,
+        (date.today().isoformat(),)
+    )
+
+    return [{
+        'telegram_id': user[0],
+        'username': user[1],
+        'subscription_end': user[2]
+    } for user in users]
+
+async def renew_due_subscriptions() -> list:
+    """
+    Продлевает все подписки с автопродлением, истекающие сегодня, одной
+    транзакцией (см. storage.db.renew_due_subscriptions).
+
+    Returns:
+        Список продленных подписок: telegram_id, username, subscription_end (новая дата)
+    """
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            async with connection.execute(RENEW_DUE_SUBSCRIPTIONS_QUERY, renewal_params()) as cursor:
+                rows = await cursor.fetchall()
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+
+    renewed = renewed_from_rows(rows)
+    premium_cache.invalidate_many(user['telegram_id'] for user in renewed)
+    return renewed
+
+async def process_auto_renewal(telegram_id: int) -> bool:
+    """
+    Обрабатывает автоматическое продление подписки для пользователя
+    по сохраненному типу подписки.
+    """
+    from datetime import date, timedelta
+
+    manager = async_connection_manager
+
+    async with manager.write_lock:
+        connection = await manager.writer()
+        try:
+            async with connection.execute(
+                "SELECT subscription_type FROM users WHERE telegram_id = ?",
+                (telegram_id,)
+            ) as cursor:
+                result = await cursor.fetchone()
+
+            if not result:
+                return False
+
+            # Продлеваем подписку на период, соответствующий типу подписки
+            new_end_date = date.today() + timedelta(days=renewal_days(result[0]))
+
+            await connection.execute(
+                """
+                UPDATE users
+                SET subscription_end_date = ?,
+                    premium_status = TRUE
+                WHERE telegram_id = ?
+                """,
+                (new_end_date.isoformat(), telegram_id)
+            )
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+        premium_cache.invalidate(telegram_id)
+    return True
+
+async def update_user_preferences(telegram_id: int, use_emojis: bool = None, communication_style: str = None, preferred_response_length: str = None):
+    """
+    Обновляет пользовательские предпочтения (в базе и в кэше).
+    """
+    update = build_preferences_update(telegram_id, use_emojis, communication_style, preferred_response_length)
+    if update:
+        await async_connection_manager.execute_write(*update)
+        changes = {
+            'use_emojis': use_emojis,
+            'communication_style': communication_style,
+            'preferred_response_length': preferred_response_length
+        }
+        preferences_cache.update(telegram_id, {key: value for key, value in changes.items() if value is not None})
+
+async def get_user_preferences(telegram_id: int) -> dict:
+    """
+    Получает пользовательские предпочтения: поля users и значения из settings.
+    """
+    cached = preferences_cache.get(telegram_id)
+    if cached is not None:
+        return cached
+
+    updates = preferences_cache.updates
+    result = await async_connection_manager.fetchone(PREFERENCES_QUERY, (telegram_id,))
+    preferences = preferences_with_settings_from_row(result)
+    if result and preferences_cache.updates == updates:
+        preferences_cache.put(telegram_id, preferences)
+    return preferences
+
+async def get_user_setting(telegram_id: int, key: str, default=None):
+    """
+    Значение предпочтения key из хранилища ключ/значение (таблица settings).
+    """
+    preferences = await get_user_preferences(telegram_id)
+    return preferences.get(key, default)
+
+async def set_user_setting(telegram_id: int, key: str, value) -> bool:
+    """
+    Записывает предпочтение key в таблицу settings (в базе и в кэше).
+    Returns False, если пользователя нет в базе.
+    """
+    check_setting_key(key)
+    updated = await async_connection_manager.execute_write(SETTING_UPSERT_QUERY, (key, encode_setting(value), telegram_id))
+    if updated:
+        preferences_cache.update(telegram_id, {key: value})
+    return updated > 0
+
+async def delete_user_setting(telegram_id: int, key: str):
+    """
+    Удаляет предпочтение key из таблицы settings.
+    """
+    await async_connection_manager.execute_write(SETTING_DELETE_QUERY, (telegram_id, key))
+    preferences_cache.discard(telegram_id, key)
+
+async def load_user_context(telegram_id: int, history_limit: int = None) -> UserContext:
+    """
+    Загружает контекст пользователя одним запросом: данные пользователя,
+    премиум статус, счетчики, предпочтения и последние сообщения истории.
+    Возвращает None, если пользователя еще нет в базе.
+    """
+    if history_limit is None:
+        history_limit = LimitsConfig.CONTEXT_MESSAGE_LIMIT
+
+    manager = async_connection_manager
+
+    # История из кэша: из базы читается только строка пользователя
+    user_id = history_cache.user_id_for(telegram_id)
+    cached = history_cache.get(user_id, history_limit) if user_id else None
+    if cached is not None:
+        row = await manager.fetchone(USER_CONTEXT_QUERY, (0, telegram_id))
+        if not row:
+            return None
+        context = UserContext.from_row(row, telegram_id)
+        context.history = cached
+        return context
+
+    appended = message_journal.appended
+    row = await manager.fetchone(USER_CONTEXT_QUERY, (history_limit, telegram_id))
+    if not row:
+        return None
+    if not message_journal.has_pending(row[0]):
+        context = UserContext.from_row(row, telegram_id)
+        if message_journal.appended == appended:
+            _cache_history(context.id, telegram_id, context.history, history_limit)
+        return context
+
+    # Есть незаписанные сообщения: перечитываем под write_lock и добавляем очередь
+    async with manager.write_lock:
+        connection = await manager.writer()
+        async with connection.execute(USER_CONTEXT_QUERY, (history_limit, telegram_id)) as cursor:
+            row = await cursor.fetchone()
+        pending = message_journal.pending_for_user(row[0])
+
+    context = UserContext.from_row(row, telegram_id)
+    context.history = (context.history + history_from_pending(pending))[-history_limit:]
+    _cache_history(context.id, telegram_id, context.history, history_limit)
+    return context
+
+async def consume_user_context(telegram_id: int, history_limit: int = None, limit: int = None) -> UserContext:
+    """
+    Загружает контекст пользователя и атомарно списывает сообщение из дневного
+    лимита одним UPDATE ... RETURNING. Результат проверки лимита - в
+    context.message_allowed. Возвращает None, если пользователя еще нет в базе.
+    """
+    if history_limit is None:
+        history_limit = LimitsConfig.CONTEXT_MESSAGE_LIMIT
+
+    params = consume_credit_params(telegram_id, limit)
+
+    manager = async_connection_manager
+    async with manager.write_lock:
+        # Если история есть в кэше, запрос не читает сообщения (LIMIT 0)
+        user_id = history_cache.user_id_for(telegram_id)
+        cached = history_cache.get(user_id, history_limit) if user_id else None
+        params['history_limit'] = 0 if cached is not None else history_limit
+
+        connection = await manager.writer()
+        try:
+            async with connection.execute(USER_CONTEXT_CONSUME_QUERY, params) as cursor:
+                row = await cursor.fetchone()
+            await connection.commit()
+        except Exception:
+            await connection.rollback()
+            raise
+
+        if not row:
+            return None
+        context = UserContext.from_row(row, telegram_id, params['limit'])
+        premium_cache.put(telegram_id, context.premium_info())
+        if cached is not None:
+            context.history = cached
+            return context
+        # Добавляем сообщения пользователя, еще не записанные из очереди
+        pending = message_journal.pending_for_user(context.id)
+
+    if pending:
+        context.history = (context.history + history_from_pending(pending))[-history_limit:]
+    _cache_history(context.id, telegram_id, context.history, history_limit)
+    return context
+
+async def save_user_turn(context: UserContext):
+    """
+    Передает накопленные реплики диалога в очередь отложенной записи;
+    они записываются групповым коммитом вместе с репликами других пользователей.
+    """
+    for role, content in context.pending_messages:
+        _append_message(context.id, content, role)
+
+    context.pending_messages.clear()
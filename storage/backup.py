@@ -0,0 +1,147 @@
+# Резервные копии базы данных через SQLite online backup API
+#
+# Копия снимается небольшими порциями страниц с паузой между ними внутри
+# одной читающей транзакции, поэтому бот продолжает писать в базу во время
+# копирования (в режиме WAL чтение не блокирует запись), а копия
+# соответствует моменту начала. Если копирование все же начинается заново
+# (база не в режиме WAL), после BACKUP_MAX_RESTARTS перезапусков копия
+# снимается за один шаг. Готовая копия проверяется
+# PRAGMA integrity_check и только после этого получает итоговое имя;
+# старые копии сверх BACKUP_KEEP удаляются.
+
+import os
+import sqlite3
+import time
+from datetime import datetime
+from config import DatabaseConfig
+
+BACKUP_PREFIX = "database-"
+BACKUP_SUFFIX = ".sqlite"
+
+class BackupRestarted(Exception):
+    """Копирование слишком часто начиналось заново из-за записи в базу"""
+
+def backup_path(backup_dir: str = None, moment: datetime = None) -> str:
+    """Путь новой резервной копии с датой и временем в имени"""
+    backup_dir = backup_dir or DatabaseConfig.BACKUP_DIR
+    moment = moment or datetime.now()
+    return os.path.join(backup_dir, f"{BACKUP_PREFIX}{moment.strftime('%Y%m%d-%H%M%S')}{BACKUP_SUFFIX}")
+
+def list_backups(backup_dir: str = None) -> list:
+    """Резервные копии в каталоге, от новых к старым"""
+    backup_dir = backup_dir or DatabaseConfig.BACKUP_DIR
+    if not os.path.isdir(backup_dir):
+        return []
+    names = [
+        name for name in os.listdir(backup_dir)
+        if name.startswith(BACKUP_PREFIX) and name.endswith(BACKUP_SUFFIX)
+    ]
+    return [os.path.join(backup_dir, name) for name in sorted(names, reverse=True)]
+
+def verify_backup(path: str) -> bool:
+    """Проверяет копию через PRAGMA integrity_check"""
+    connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    try:
+        result = connection.execute("PRAGMA integrity_check").fetchall()
+    finally:
+        connection.close()
+    return result == [("ok",)]
+
+def _copy_pages(source: sqlite3.Connection, target: sqlite3.Connection, pages: int, sleep_seconds: float, max_restarts: int):
+    """Копирует базу порциями по pages страниц с паузой sleep_seconds между ними"""
+    state = {'remaining': None, 'restarts': 0}
+
+    def progress(status, remaining, total):
+        # Число оставшихся страниц выросло - копирование началось заново
+        if state['remaining'] is not None and remaining > state['remaining']:
+            state['restarts'] += 1
+            if state['restarts'] > max_restarts:
+                raise BackupRestarted()
+        state['remaining'] = remaining
+        # Пауза между шагами отдает базу писателям бота
+        if remaining and sleep_seconds:
+            time.sleep(sleep_seconds)
+
+    # Читающая транзакция держит снимок базы на все время копирования: запись
+    # другими соединениями (в режиме WAL) не блокируется и не перезапускает копирование
+    source.execute("BEGIN")
+    source.execute("SELECT COUNT(*) FROM sqlite_master").fetchone()
+    try:
+        source.backup(target, pages=pages, progress=progress)
+    finally:
+        source.rollback()
+    return state['restarts']
+
+def backup_database(backup_dir: str = None, db_path: str = None, pages: int = None, sleep_ms: float = None) -> dict:
+    """
+    Снимает резервную копию работающей базы, проверяет ее и удаляет старые копии.
+
+    Args:
+        backup_dir: Каталог копий (по умолчанию DatabaseConfig.BACKUP_DIR)
+        db_path: Исходная база (по умолчанию DatabaseConfig.DB_PATH)
+        pages: Страниц за один шаг копирования
+        sleep_ms: Пауза между шагами (мс)
+
+    Returns:
+        Словарь: path, size_bytes, seconds, restarts, single_step, removed (удаленные старые копии)
+    """
+    backup_dir = backup_dir or DatabaseConfig.BACKUP_DIR
+    db_path = db_path or DatabaseConfig.DB_PATH
+    pages = pages or DatabaseConfig.BACKUP_PAGES_PER_STEP
+    sleep_ms = DatabaseConfig.BACKUP_STEP_SLEEP_MS if sleep_ms is None else sleep_ms
+
+    os.makedirs(backup_dir, exist_ok=True)
+    path = backup_path(backup_dir)
+    partial_path = path + ".partial"
+
+    started = time.perf_counter()
+    single_step = False
+    source = sqlite3.connect(db_path, timeout=DatabaseConfig.BUSY_TIMEOUT_MS / 1000)
+    target = sqlite3.connect(partial_path)
+    try:
+        try:
+            restarts = _copy_pages(source, target, pages, sleep_ms / 1000, DatabaseConfig.BACKUP_MAX_RESTARTS)
+        except BackupRestarted:
+            # База меняется быстрее, чем идет копирование: снимаем копию за один шаг
+            restarts = DatabaseConfig.BACKUP_MAX_RESTARTS + 1
+            single_step = True
+            source.backup(target)
+        # Копия не должна зависеть от WAL исходной базы
+        target.execute("PRAGMA journal_mode=DELETE")
+    except Exception:
+        target.close()
+        source.close()
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+        raise
+    target.close()
+    source.close()
+
+    if not verify_backup(partial_path):
+        os.remove(partial_path)
+        raise sqlite3.DatabaseError(f"Резервная копия {path} не прошла проверку integrity_check")
+
+    os.replace(partial_path, path)
+
+    return {
+        'path': path,
+        'size_bytes': os.path.getsize(path),
+        'seconds': time.perf_counter() - started,
+        'restarts': restarts,
+        'single_step': single_step,
+        'removed': rotate_backups(backup_dir)
+    }
+
+def rotate_backups(backup_dir: str = None, keep: int = None) -> list:
+    """
+    Удаляет старые копии, оставляя keep самых новых.
+
+    Returns:
+        Пути удаленных копий
+    """
+    keep = DatabaseConfig.BACKUP_KEEP if keep is None else keep
+    removed = []
+    for path in list_backups(backup_dir)[keep:]:
+        os.remove(path)
+        removed.append(path)
+    return removed
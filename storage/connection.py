@@ -0,0 +1,108 @@
+# Управление соединениями с SQLite
+
+import sqlite3
+import threading
+from config import DatabaseConfig
+from storage.query_stats import connection_factory
+
+# PRAGMA, которые выполняются один раз при открытии соединения
+CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA busy_timeout={DatabaseConfig.BUSY_TIMEOUT_MS}",
+    f"PRAGMA cache_size=-{DatabaseConfig.CACHE_SIZE_KB}",
+)
+
+def configure_connection(connection: sqlite3.Connection) -> sqlite3.Connection:
+    """
+    Применяет к новому соединению общие PRAGMA.
+    """
+    for pragma in CONNECTION_PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+# PRAGMA соединений только для чтения: запрет записи на уровне соединения,
+# чтение файла через mmap, большой кэш и временные данные сортировок в памяти
+READONLY_PRAGMAS = (
+    "PRAGMA query_only=ON",
+    f"PRAGMA busy_timeout={DatabaseConfig.BUSY_TIMEOUT_MS}",
+    f"PRAGMA mmap_size={DatabaseConfig.READONLY_MMAP_SIZE_MB * 1024 * 1024}",
+    f"PRAGMA cache_size=-{DatabaseConfig.READONLY_CACHE_SIZE_KB}",
+    "PRAGMA temp_store=MEMORY",
+)
+
+def open_readonly_connection(db_path: str = None) -> sqlite3.Connection:
+    """
+    Открывает соединение только для чтения для отчетов и служебных скриптов.
+
+    База открывается через URI с mode=ro, поэтому соединение не может взять
+    блокировку записи и не создает файл базы, если его нет. Каждый SELECT
+    выполняется в своей короткой читающей транзакции (автокоммит sqlite3),
+    так что отчет не удерживает старый снимок WAL и не мешает контрольным
+    точкам бота; длинные выборки следует читать порциями (storage.iterators).
+    """
+    db_path = db_path or DatabaseConfig.DB_PATH
+    connection = sqlite3.connect(
+        f"file:{db_path}?mode=ro",
+        uri=True,
+        timeout=DatabaseConfig.BUSY_TIMEOUT_MS / 1000,
+        cached_statements=DatabaseConfig.STATEMENT_CACHE_SIZE,
+        factory=connection_factory()
+    )
+    for pragma in READONLY_PRAGMAS:
+        connection.execute(pragma)
+    return connection
+
+class ConnectionManager:
+    """
+    Держит постоянные соединения с базой данных: по одному на поток.
+
+    Соединение открывается при первом обращении из потока, PRAGMA
+    выполняются один раз, подготовленные запросы кэшируются самим
+    sqlite3 (параметр cached_statements).
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._connections = []
+
+    def get_connection(self) -> sqlite3.Connection:
+        """Возвращает соединение текущего потока, открывая его при необходимости"""
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(
+                self.db_path,
+                timeout=DatabaseConfig.BUSY_TIMEOUT_MS / 1000,
+                cached_statements=DatabaseConfig.STATEMENT_CACHE_SIZE,
+                check_same_thread=False,
+                factory=connection_factory()
+            )
+            configure_connection(connection)
+            self._local.connection = connection
+            with self._lock:
+                self._connections.append(connection)
+        return connection
+
+    def close_all(self):
+        """Закрывает все открытые соединения (при остановке приложения)"""
+        with self._lock:
+            connections, self._connections = self._connections, []
+        for connection in connections:
+            try:
+                connection.close()
+            except sqlite3.Error as e:
+                print(f"Ошибка при закрытии соединения с БД: {e}")
+        self._local = threading.local()
+
+# Общий менеджер соединений для основной базы данных
+connection_manager = ConnectionManager(DatabaseConfig.DB_PATH)
+
+def get_connection() -> sqlite3.Connection:
+    """Возвращает постоянное соединение с основной базой данных"""
+    return connection_manager.get_connection()
+
+def close_connections():
+    """Закрывает все соединения с основной базой данных"""
+    connection_manager.close_all()
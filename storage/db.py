@@ -2,139 +2,302 @@
 
 import sqlite3
 from config import DatabaseConfig, LimitsConfig
+from storage.connection import get_connection
+from storage.migrations import run_migrations
+from storage.query_stats import query_stats
 
 DB_PATH = DatabaseConfig.DB_PATH
 
-def initialize_database():
+# Общие запросы и преобразования строк, используются также в storage/async_db.py
+USER_SELECT_QUERY = (
+    "SELECT id, username, created_at, premium_status, subscription_end_date, auto_renewal, subscription_type, use_emojis, communication_style, preferred_response_length "
+    "FROM users WHERE telegram_id = ?"
+)
+
+# Последние сообщения пользователя после отметки очистки истории (/clear)
+CONVERSATION_HISTORY_QUERY = """
+    SELECT message, role, created_at FROM messages
+    WHERE user_id = :user_id
+    AND id > (SELECT history_cleared_id FROM users WHERE id = :user_id)
+    ORDER BY created_at DESC, id DESC
+    LIMIT :limit
+"""
+
+# Очистка истории: отметка ставится на последний записанный ID сообщения,
+# более ранние сообщения пользователя ставятся в очередь фонового удаления
+# (см. storage/history_purge.py)
+CLEAR_HISTORY_QUERY = """
+    UPDATE users SET history_cleared_id = (SELECT COALESCE(MAX(id), 0) FROM messages)
+    WHERE id = ?
+    RETURNING history_cleared_id
+"""
+QUEUE_HISTORY_PURGE_QUERY = """
+    INSERT INTO history_purges (user_id, up_to_id) VALUES (?, ?)
+    ON CONFLICT(user_id) DO UPDATE SET up_to_id = excluded.up_to_id
+"""
+# Все записанные сообщения пользователя теперь скрыты: /stats считает только новые
+CLEAR_USER_STATS_QUERY = "UPDATE user_message_stats SET cleared_message_count = message_count WHERE user_id = ?"
+
+# Итоги пользователя из сводной таблицы (см. storage/rollups.py) без сообщений,
+# скрытых очисткой истории: как и раньше, после /clear статистика начинается с нуля
+USER_STATS_QUERY = """
+    SELECT message_count - cleared_message_count,
+           CASE WHEN message_count > cleared_message_count THEN last_message_at END
+    FROM user_message_stats WHERE user_id = ?
+"""
+
+def user_stats_from_row(result) -> dict:
     """
-    Инициализация базы данных и создание таблиц.
+    Преобразует строку USER_STATS_QUERY в статистику пользователя.
     """
-    connection = sqlite3.connect(DB_PATH, timeout=10.0)
-    connection.execute("PRAGMA journal_mode=WAL")
-    cursor = connection.cursor()
+    if not result:
+        return {'message_count': 0, 'last_activity': None}
+    return {
+        'message_count': result[0],
+        'last_activity': result[1]
+    }
 
-    # Таблица пользователей
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS users (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            username TEXT NOT NULL,
-            telegram_id INTEGER UNIQUE NOT NULL,
-            daily_message_count INTEGER DEFAULT 0,
-            last_message_date DATE DEFAULT NULL,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        )
-        """
-    )
-    
-    # Добавляем новые поля в существующую таблицу, если их нет
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN daily_message_count INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+DEFAULT_PREFERENCES = {
+    'use_emojis': True,
+    'communication_style': 'friendly',
+    'preferred_response_length': 'medium'
+}
+
+def user_from_row(user, telegram_id: int) -> dict:
+    """
+    Преобразует строку USER_SELECT_QUERY в словарь пользователя.
+    """
+    if not user:
+        return None
+    return {
+        'id': user[0],
+        'username': user[1],
+        'telegram_id': telegram_id,
+        'created_at': user[2],
+        'premium_status': bool(user[3]) if user[3] is not None else False,
+        'subscription_end_date': user[4],
+        'auto_renewal': bool(user[5]) if user[5] is not None else False,
+        'subscription_type': user[6] or LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS,
+        'use_emojis': bool(user[7]) if user[7] is not None else True,
+        'communication_style': user[8] or 'friendly',
+        'preferred_response_length': user[9] or 'medium'
+    }
+
+def preferences_from_row(result) -> dict:
+    """
+    Преобразует строку (use_emojis, communication_style, preferred_response_length) в словарь предпочтений.
+    """
+    if not result:
+        return dict(DEFAULT_PREFERENCES)
+    return {
+        'use_emojis': bool(result[0]) if result[0] is not None else True,
+        'communication_style': result[1] or 'friendly',
+        'preferred_response_length': result[2] or 'medium'
+    }
+
+def history_from_rows(messages) -> list:
+    """
+    Преобразует строки (message, role, created_at), отсортированные от новых к старым,
+    в историю разговора от старых к новым.
+    """
+    return [{
+        'content': msg[0],
+        'role': msg[1],
+        'timestamp': msg[2]
+    } for msg in reversed(messages)]
+
+def daily_count_for_today(result) -> int:
+    """
+    Возвращает счетчик сообщений за сегодня по строке (daily_message_count, last_message_date).
+    """
+    from datetime import date
     
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN last_message_date DATE DEFAULT NULL")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if not result:
+        return 0
+    daily_count, last_date = result
+    # Если это новый день, счетчик равен 0
+    if last_date != date.today().isoformat():
+        return 0
+    return daily_count or 0
+
+def is_subscription_expired(subscription_end) -> bool:
+    """
+    Проверяет, истекла ли подписка с датой окончания subscription_end (ISO-строка).
+    """
+    from datetime import date
     
-    # Добавляем поля для системы оплаты через Telegram Stars
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN premium_status BOOLEAN DEFAULT FALSE")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    return bool(subscription_end) and date.fromisoformat(subscription_end) < date.today()
+
+# Подписка активна, если дата окончания не наступила (параметр :today - ISO дата)
+PREMIUM_ACTIVE_SQL = "(premium_status AND (subscription_end_date IS NULL OR subscription_end_date >= :today))"
+
+# Атомарное списание сообщения из дневного лимита: смена дня, увеличение
+# счетчика и безлимит премиум пользователей в одном UPDATE.
+# Счетчик не растет выше :limit + 1, значение :limit + 1 означает отказ.
+CONSUME_MESSAGE_CREDIT_SET = f"""
+    daily_message_count = CASE
+        WHEN {PREMIUM_ACTIVE_SQL} THEN daily_message_count
+        WHEN last_message_date = :today THEN MIN(COALESCE(daily_message_count, 0) + 1, :limit + 1)
+        ELSE 1
+    END,
+    last_message_date = CASE WHEN {PREMIUM_ACTIVE_SQL} THEN last_message_date ELSE :today END
+"""
+
+# Значения после списания: новый счетчик, разрешено ли сообщение, премиум статус
+CONSUME_MESSAGE_CREDIT_RETURNING = f"""
+    daily_message_count,
+    {PREMIUM_ACTIVE_SQL} OR daily_message_count <= :limit AS allowed,
+    {PREMIUM_ACTIVE_SQL} AS premium_active
+"""
+
+CONSUME_MESSAGE_CREDIT_QUERY = f"""
+    UPDATE users SET {CONSUME_MESSAGE_CREDIT_SET}
+    WHERE telegram_id = :telegram_id
+    RETURNING {CONSUME_MESSAGE_CREDIT_RETURNING}
+"""
+
+def consume_credit_params(telegram_id: int, limit: int = None) -> dict:
+    """
+    Параметры для CONSUME_MESSAGE_CREDIT_QUERY.
+    """
+    from datetime import date
     
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN stars_balance INTEGER DEFAULT 0")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if limit is None:
+        limit = LimitsConfig.DAILY_MESSAGE_LIMIT
+    return {'telegram_id': telegram_id, 'today': date.today().isoformat(), 'limit': limit}
+
+def message_credit_from_row(result, limit: int = None) -> dict:
+    """
+    Преобразует строку (daily_message_count, allowed, premium_active) в результат списания.
+    Пользователь, которого нет в базе, не ограничивается.
+    """
+    if limit is None:
+        limit = LimitsConfig.DAILY_MESSAGE_LIMIT
+    if not result:
+        return {'daily_message_count': 0, 'allowed': True, 'premium_status': False}
+    return {
+        'daily_message_count': min(result[0] or 0, limit),
+        'allowed': bool(result[1]),
+        'premium_status': bool(result[2])
+    }
+
+def premium_status_from_row(result) -> dict:
+    """
+    Преобразует строку (premium_status, subscription_end_date, auto_renewal)
+    в словарь премиум статуса. Истекшая подписка считается неактивной без
+    записи в базу: флаг premium_status снимает expire_premium_subscriptions.
+    """
+    if not result:
+        return {"premium_status": False, "subscription_end_date": None, "auto_renewal": False}
+
+    premium_status, subscription_end, auto_renewal = result
+    return {
+        "premium_status": bool(premium_status) and not is_subscription_expired(subscription_end),
+        "subscription_end_date": subscription_end,
+        "auto_renewal": bool(auto_renewal)
+    }
+
+# Снятие премиум статуса со всех истекших подписок одним UPDATE
+EXPIRE_PREMIUM_SUBSCRIPTIONS_QUERY = """
+    UPDATE users SET premium_status = FALSE
+    WHERE premium_status = TRUE AND subscription_end_date < ?
+    RETURNING telegram_id
+"""
+
+def extended_subscription_end(current_end, days: int) -> str:
+    """
+    Вычисляет новую дату окончания подписки при продлении на days дней.
+    Активная подписка продлевается от даты окончания, истекшая - от сегодняшнего дня.
+    """
+    from datetime import date, timedelta
     
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN subscription_end_date DATE DEFAULT NULL")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if current_end:
+        current_end_date = date.fromisoformat(current_end)
+        if current_end_date > date.today():
+            return (current_end_date + timedelta(days=days)).isoformat()
+    return (date.today() + timedelta(days=days)).isoformat()
+
+def build_preferences_update(telegram_id: int, use_emojis: bool = None, communication_style: str = None, preferred_response_length: str = None):
+    """
+    Формирует UPDATE для изменения предпочтений пользователя.
+    Возвращает кортеж (query, params) или None, если менять нечего.
+    """
+    updates = []
+    params = []
     
-    # Добавляем поле для автоматических платежей
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN auto_renewal BOOLEAN DEFAULT FALSE")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if use_emojis is not None:
+        updates.append("use_emojis = ?")
+        params.append(use_emojis)
     
-    # Добавляем поле для типа подписки (дни подписки)
-    try:
-        cursor.execute(f"ALTER TABLE users ADD COLUMN subscription_type INTEGER DEFAULT {LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS}")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if communication_style is not None:
+        updates.append("communication_style = ?")
+        params.append(communication_style)
     
-    # Добавляем поля для пользовательских предпочтений
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN use_emojis BOOLEAN DEFAULT TRUE")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if preferred_response_length is not None:
+        updates.append("preferred_response_length = ?")
+        params.append(preferred_response_length)
     
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN communication_style TEXT DEFAULT 'friendly'")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    if not updates:
+        return None
     
-    try:
-        cursor.execute("ALTER TABLE users ADD COLUMN preferred_response_length TEXT DEFAULT 'medium'")
-    except sqlite3.OperationalError:
-        pass  # Поле уже существует
+    params.append(telegram_id)
+    return f"UPDATE users SET {', '.join(updates)} WHERE telegram_id = ?", params
 
-    # Таблица сообщений
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS messages (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            message TEXT NOT NULL,
-            role TEXT DEFAULT 'user',
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-        """
-    )
+def renewal_days(subscription_type: int) -> int:
+    """
+    Определяет продолжительность автопродления по сохраненному типу подписки.
+    """
+    if subscription_type == 1:
+        return 1
+    elif subscription_type == 7:
+        return 7
+    else:  # subscription_type == DEFAULT_SUBSCRIPTION_DAYS
+        return LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS
 
-    # Таблица записей дневника
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS journal_entries (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            mood INTEGER NOT NULL,
-            facts TEXT,
-            gratitude TEXT,
-            plan TEXT,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-        """
-    )
+# Продолжительность автопродления в SQL (то же, что renewal_days)
+RENEWAL_DAYS_SQL = "CASE subscription_type WHEN 1 THEN 1 WHEN 7 THEN 7 ELSE :default_days END"
 
-    # Таблица настроек
-    cursor.execute(
-        """
-        CREATE TABLE IF NOT EXISTS settings (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            user_id INTEGER NOT NULL,
-            key TEXT NOT NULL,
-            value TEXT,
-            FOREIGN KEY(user_id) REFERENCES users(id)
-        )
-        """
-    )
+# Продление всех подписок с автопродлением, истекающих сегодня, одним UPDATE.
+# Новая дата окончания - сегодня плюс период по типу подписки.
+RENEW_DUE_SUBSCRIPTIONS_QUERY = f"""
+    UPDATE users
+    SET subscription_end_date = date(:today, '+' || ({RENEWAL_DAYS_SQL}) || ' days'),
+        premium_status = TRUE
+    WHERE auto_renewal = TRUE
+    AND premium_status = TRUE
+    AND subscription_end_date = :today
+    RETURNING telegram_id, username, subscription_end_date
+"""
+
+def renewal_params() -> dict:
+    """
+    Параметры для RENEW_DUE_SUBSCRIPTIONS_QUERY.
+    """
+    from datetime import date
+    
+    return {'today': date.today().isoformat(), 'default_days': LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS}
 
-    connection.commit()
-    connection.close()
+def renewed_from_rows(rows) -> list:
+    """Преобразует строки RETURNING (telegram_id, username, subscription_end_date) в словари"""
+    return [{
+        'telegram_id': row[0],
+        'username': row[1],
+        'subscription_end': row[2]
+    } for row in rows]
+
+def initialize_database():
+    """
+    Инициализация базы данных: применяет недостающие миграции схемы.
+    Если схема актуальна, выполняется только чтение PRAGMA user_version.
+    """
+    return run_migrations(get_connection())
 
 def add_user(username: str, telegram_id: int) -> int:
     """
     Добавляет нового пользователя в базу данных.
     Возвращает ID пользователя или существующий ID если пользователь уже есть.
     """
-    connection = sqlite3.connect(DB_PATH, timeout=10.0)
-    connection.execute("PRAGMA journal_mode=WAL")
+    connection = get_connection()
     cursor = connection.cursor()
     
     try:
@@ -156,51 +319,31 @@ def add_user(username: str, telegram_id: int) -> int:
         return user_id
     except sqlite3.OperationalError as e:
         print(f"Database error in add_user: {e}")
+        connection.rollback()
         # Возвращаем 0 в случае ошибки, чтобы не ломать логику
         return 0
-    finally:
-        connection.close()
 
 def get_user_by_telegram_id(telegram_id: int) -> dict:
     """
     Получает данные пользователя по Telegram ID.
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    cursor.execute(
-        "SELECT id, username, created_at, premium_status, subscription_end_date, auto_renewal, subscription_type, use_emojis, communication_style, preferred_response_length FROM users WHERE telegram_id = ?",
-        (telegram_id,)
-    )
+    cursor.execute(USER_SELECT_QUERY, (telegram_id,))
     user = cursor.fetchone()
-    connection.close()
     
-    if user:
-        return {
-            'id': user[0],
-            'username': user[1],
-            'telegram_id': telegram_id,
-            'created_at': user[2],
-            'premium_status': bool(user[3]) if user[3] is not None else False,
-            'subscription_end_date': user[4],
-            'auto_renewal': bool(user[5]) if user[5] is not None else False,
-            'subscription_type': user[6] or LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS,
-            'use_emojis': bool(user[7]) if user[7] is not None else True,
-            'communication_style': user[8] or 'friendly',
-            'preferred_response_length': user[9] or 'medium'
-        }
-    return None
+    return user_from_row(user, telegram_id)
 
 def is_new_user(telegram_id: int) -> bool:
     """
     Проверяет, является ли пользователь новым (первый раз зашел).
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     cursor.execute("SELECT id FROM users WHERE telegram_id = ?", (telegram_id,))
     user = cursor.fetchone()
-    connection.close()
     
     return user is None
 
@@ -208,82 +351,71 @@ def add_message(user_id: int, message: str, role: str = 'user'):
     """
     Добавляет сообщение в историю чата.
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    cursor.execute(
-        "INSERT INTO messages (user_id, message, role) VALUES (?, ?, ?)",
-        (user_id, message, role)
-    )
-    connection.commit()
-    connection.close()
+    try:
+        cursor.execute(
+            "INSERT INTO messages (user_id, message, role) VALUES (?, ?, ?)",
+            (user_id, message, role)
+        )
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
 
 def get_conversation_history(user_id: int, limit: int = 50) -> list:
     """
     Получает историю разговора пользователя.
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    cursor.execute(
-        "SELECT message, role, created_at FROM messages WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
-        (user_id, limit)
-    )
+    cursor.execute(CONVERSATION_HISTORY_QUERY, {'user_id': user_id, 'limit': limit})
     messages = cursor.fetchall()
-    connection.close()
     
     # Возвращаем в обратном порядке (от старых к новым)
-    return [{
-        'content': msg[0],
-        'role': msg[1],
-        'timestamp': msg[2]
-    } for msg in reversed(messages)]
+    return history_from_rows(messages)
 
 def clear_conversation_history(user_id: int):
     """
-    Очищает историю разговора пользователя.
+    Очищает историю разговора пользователя: ставит отметку очистки,
+    сами сообщения удаляются фоновой задачей (storage.history_purge).
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    cursor.execute("DELETE FROM messages WHERE user_id = ?", (user_id,))
-    connection.commit()
-    connection.close()
+    try:
+        cursor.execute(CLEAR_HISTORY_QUERY, (user_id,))
+        row = cursor.fetchone()
+        if row:
+            cursor.execute(QUEUE_HISTORY_PURGE_QUERY, (user_id, row[0]))
+            cursor.execute(CLEAR_USER_STATS_QUERY, (user_id,))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
 
 def get_user_stats(user_id: int) -> dict:
     """
     Получает статистику пользователя.
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    cursor.execute("SELECT COUNT(*) FROM messages WHERE user_id = ?", (user_id,))
-    message_count = cursor.fetchone()[0]
-    
-    cursor.execute(
-        "SELECT created_at FROM messages WHERE user_id = ? ORDER BY created_at DESC LIMIT 1",
-        (user_id,)
-    )
-    last_message = cursor.fetchone()
-    last_activity = last_message[0] if last_message else None
-    
-    connection.close()
-    
-    return {
-        'message_count': message_count,
-        'last_activity': last_activity
-    }
+    # Итоги поддерживаются триггером в user_message_stats
+    cursor.execute(USER_STATS_QUERY, (user_id,))
+    return user_stats_from_row(cursor.fetchone())
 
 def get_all_users():
     """
     Получает всех пользователей из базы данных.
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     cursor.execute("SELECT id, username, telegram_id, created_at FROM users")
     users = cursor.fetchall()
-    connection.close()
     
     return [{
         'id': user[0],
@@ -310,13 +442,10 @@ def check_daily_message_limit(telegram_id: int, limit: int = None) -> bool:
     
     if limit is None:
         limit = LimitsConfig.DAILY_MESSAGE_LIMIT
-    from datetime import date
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    today = date.today().isoformat()
-    
     cursor.execute(
         "SELECT daily_message_count, last_message_date FROM users WHERE telegram_id = ?",
         (telegram_id,)
@@ -324,54 +453,67 @@ def check_daily_message_limit(telegram_id: int, limit: int = None) -> bool:
     result = cursor.fetchone()
     
     if not result:
-        connection.close()
         return True  # Пользователь не найден, разрешаем
     
-    daily_count, last_date = result
-    
-    # Если это новый день, сбрасываем счетчик
-    if last_date != today:
-        daily_count = 0
-    
-    connection.close()
-    return daily_count < limit
+    return daily_count_for_today(result) < limit
 
 def increment_daily_message_count(telegram_id: int):
     """
     Увеличивает счетчик ежедневных сообщений пользователя.
+    Смена дня учитывается в том же UPDATE, без чтения счетчика в Python.
     
     Args:
         telegram_id: ID пользователя в Telegram
     """
     from datetime import date
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     today = date.today().isoformat()
     
-    cursor.execute(
-        "SELECT daily_message_count, last_message_date FROM users WHERE telegram_id = ?",
-        (telegram_id,)
-    )
-    result = cursor.fetchone()
-    
-    if result:
-        daily_count, last_date = result
-        
-        # Если это новый день, сбрасываем счетчик
-        if last_date != today:
-            daily_count = 0
-        
-        # Увеличиваем счетчик и обновляем дату
-        new_count = daily_count + 1
+    try:
         cursor.execute(
-            "UPDATE users SET daily_message_count = ?, last_message_date = ? WHERE telegram_id = ?",
-            (new_count, today, telegram_id)
+            """
+            UPDATE users
+            SET daily_message_count = CASE WHEN last_message_date = ? THEN COALESCE(daily_message_count, 0) + 1 ELSE 1 END,
+                last_message_date = ?
+            WHERE telegram_id = ?
+            """,
+            (today, today, telegram_id)
         )
+        
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+def consume_message_credit(telegram_id: int, limit: int = None) -> dict:
+    """
+    Атомарно списывает одно сообщение из дневного лимита пользователя.
+    Проверка лимита, смена дня и увеличение счетчика выполняются одним
+    UPDATE ... RETURNING, поэтому параллельные сообщения одного пользователя
+    не могут превысить лимит. Премиум пользователи не ограничиваются.
+    
+    Args:
+        telegram_id: ID пользователя в Telegram
+        limit: Максимальное количество сообщений в день (по умолчанию из конфигурации)
+    
+    Returns:
+        Словарь: daily_message_count (новый счетчик), allowed (можно ли отвечать), premium_status
+    """
+    connection = get_connection()
+    cursor = connection.cursor()
     
-    connection.commit()
-    connection.close()
+    try:
+        cursor.execute(CONSUME_MESSAGE_CREDIT_QUERY, consume_credit_params(telegram_id, limit))
+        result = cursor.fetchone()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    
+    return message_credit_from_row(result, limit)
 
 def get_daily_message_count(telegram_id: int) -> int:
     """
@@ -383,31 +525,17 @@ def get_daily_message_count(telegram_id: int) -> int:
     Returns:
         Количество сообщений за сегодня
     """
-    from datetime import date
-    
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    today = date.today().isoformat()
-    
     cursor.execute(
         "SELECT daily_message_count, last_message_date FROM users WHERE telegram_id = ?",
         (telegram_id,)
     )
     result = cursor.fetchone()
     
-    if not result:
-        connection.close()
-        return 0
-    
-    daily_count, last_date = result
-    
-    # Если это новый день, счетчик равен 0
-    if last_date != today:
-        daily_count = 0
-    
-    connection.close()
-    return daily_count
+    # После отказа счетчик хранит limit + 1, показываем не больше лимита
+    return min(daily_count_for_today(result), LimitsConfig.DAILY_MESSAGE_LIMIT)
 
 def get_user_premium_status(telegram_id: int) -> dict:
     """
@@ -419,9 +547,7 @@ def get_user_premium_status(telegram_id: int) -> dict:
     Returns:
         Словарь с информацией о премиум статусе
     """
-    from datetime import date
-    
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     cursor.execute(
@@ -430,30 +556,30 @@ def get_user_premium_status(telegram_id: int) -> dict:
     )
     result = cursor.fetchone()
 
-    if not result:
-        connection.close()
-        return {"premium_status": False, "subscription_end_date": None, "auto_renewal": False}
+    return premium_status_from_row(result)
 
-    premium_status, subscription_end, auto_renewal = result
-    
-    # Проверяем, не истекла ли подписка
-    if subscription_end:
-        subscription_end_date = date.fromisoformat(subscription_end)
-        if subscription_end_date < date.today():
-            # Подписка истекла, обновляем статус
-            cursor.execute(
-                "UPDATE users SET premium_status = FALSE WHERE telegram_id = ?",
-                (telegram_id,)
-            )
-            connection.commit()
-            premium_status = False
-    
-    connection.close()
-    return {
-        "premium_status": bool(premium_status),
-        "subscription_end_date": subscription_end,
-        "auto_renewal": bool(auto_renewal)
-    }
+def expire_premium_subscriptions() -> list:
+    """
+    Снимает премиум статус со всех подписок, срок которых истек,
+    одним UPDATE (выполняется планировщиком раз в сутки).
+
+    Returns:
+        Список telegram_id пользователей, у которых снят премиум статус
+    """
+    from datetime import date
+
+    connection = get_connection()
+    cursor = connection.cursor()
+
+    try:
+        cursor.execute(EXPIRE_PREMIUM_SUBSCRIPTIONS_QUERY, (date.today().isoformat(),))
+        expired = [row[0] for row in cursor.fetchall()]
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    return expired
 
 def activate_premium_subscription(telegram_id: int, days: int = None):
     """
@@ -465,36 +591,30 @@ def activate_premium_subscription(telegram_id: int, days: int = None):
     """
     if days is None:
         days = LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS
-    from datetime import date, timedelta
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    # Получаем текущую дату окончания подписки
-    cursor.execute(
-        "SELECT subscription_end_date FROM users WHERE telegram_id = ?",
-        (telegram_id,)
-    )
-    result = cursor.fetchone()
-    
-    if result and result[0]:
-        # Если подписка уже есть, продлеваем её
-        current_end = date.fromisoformat(result[0])
-        if current_end > date.today():
-            new_end = current_end + timedelta(days=days)
-        else:
-            new_end = date.today() + timedelta(days=days)
-    else:
-        # Новая подписка
-        new_end = date.today() + timedelta(days=days)
-    
-    cursor.execute(
-        "UPDATE users SET premium_status = TRUE, subscription_end_date = ?, subscription_type = ?, auto_renewal = TRUE WHERE telegram_id = ?",
-        (new_end.isoformat(), days, telegram_id)
-    )
-    
-    connection.commit()
-    connection.close()
+    try:
+        # Получаем текущую дату окончания подписки
+        cursor.execute(
+            "SELECT subscription_end_date FROM users WHERE telegram_id = ?",
+            (telegram_id,)
+        )
+        result = cursor.fetchone()
+        
+        # Активная подписка продлевается, иначе оформляется новая
+        new_end = extended_subscription_end(result[0] if result else None, days)
+        
+        cursor.execute(
+            "UPDATE users SET premium_status = TRUE, subscription_end_date = ?, subscription_type = ?, auto_renewal = TRUE WHERE telegram_id = ?",
+            (new_end, days, telegram_id)
+        )
+        
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
 
 def get_all_premium_users() -> list:
     """
@@ -505,7 +625,7 @@ def get_all_premium_users() -> list:
     """
     from datetime import date
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     today = date.today().isoformat()
@@ -521,7 +641,6 @@ def get_all_premium_users() -> list:
     )
     
     users = cursor.fetchall()
-    connection.close()
     
     return [{
         'telegram_id': user[0],
@@ -539,7 +658,7 @@ def get_users_for_renewal_reminder():
     """
     from datetime import date, timedelta
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     # Получаем пользователей с автопродлением, у которых подписка истекает через 3 дня
@@ -558,7 +677,6 @@ def get_users_for_renewal_reminder():
     )
     
     users = cursor.fetchall()
-    connection.close()
     
     return [
         {
@@ -577,16 +695,19 @@ def set_auto_renewal(telegram_id: int, auto_renewal: bool):
         telegram_id: ID пользователя в Telegram
         auto_renewal: Включить/выключить автоматическое продление
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    cursor.execute(
-        "UPDATE users SET auto_renewal = ? WHERE telegram_id = ?",
-        (auto_renewal, telegram_id)
-    )
-    
-    connection.commit()
-    connection.close()
+    try:
+        cursor.execute(
+            "UPDATE users SET auto_renewal = ? WHERE telegram_id = ?",
+            (auto_renewal, telegram_id)
+        )
+        
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
 
 def get_users_for_auto_renewal():
     """
@@ -597,7 +718,7 @@ def get_users_for_auto_renewal():
     """
     from datetime import date
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     # Получаем пользователей с автопродлением, у которых подписка истекает сегодня
@@ -616,7 +737,6 @@ def get_users_for_auto_renewal():
     )
     
     users = cursor.fetchall()
-    connection.close()
     
     return [{
         'telegram_id': user[0],
@@ -624,6 +744,29 @@ def get_users_for_auto_renewal():
         'subscription_end': user[2]
     } for user in users]
 
+def renew_due_subscriptions(connection=None) -> list:
+    """
+    Продлевает все подписки с автопродлением, истекающие сегодня, одной
+    транзакцией. Период продления вычисляется в SQL по типу подписки.
+    
+    Args:
+        connection: Соединение для записи (по умолчанию соединение текущего потока)
+    
+    Returns:
+        Список продленных подписок: telegram_id, username, subscription_end (новая дата)
+    """
+    if connection is None:
+        connection = get_connection()
+    
+    try:
+        rows = connection.execute(RENEW_DUE_SUBSCRIPTIONS_QUERY, renewal_params()).fetchall()
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    
+    return renewed_from_rows(rows)
+
 def process_auto_renewal(telegram_id: int) -> bool:
     """
     Обрабатывает автоматическое продление подписки для пользователя.
@@ -638,82 +781,63 @@ def process_auto_renewal(telegram_id: int) -> bool:
     """
     from datetime import date, timedelta
     
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
-    # Получаем информацию о пользователе: тип подписки
-    cursor.execute(
-        "SELECT subscription_type FROM users WHERE telegram_id = ?",
-        (telegram_id,)
-    )
-    result = cursor.fetchone()
-    
-    if not result:
-        connection.close()
-        return False
-    
-    subscription_type = result[0]
-    
-    # Определяем продолжительность в зависимости от типа подписки
-    if subscription_type == 1:
-        days = 1
-    elif subscription_type == 7:
-        days = 7
-    else:  # subscription_type == DEFAULT_SUBSCRIPTION_DAYS
-        days = LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS
-    
-    # Продлеваем подписку на соответствующий период
-    new_end_date = date.today() + timedelta(days=days)
-    
-    cursor.execute(
-        """
-        UPDATE users 
-        SET subscription_end_date = ?,
-            premium_status = TRUE
-        WHERE telegram_id = ?
-        """,
-        (new_end_date.isoformat(), telegram_id)
-    )
-    
-    connection.commit()
-    connection.close()
+    try:
+        # Получаем информацию о пользователе: тип подписки
+        cursor.execute(
+            "SELECT subscription_type FROM users WHERE telegram_id = ?",
+            (telegram_id,)
+        )
+        result = cursor.fetchone()
+        
+        if not result:
+            return False
+        
+        # Определяем продолжительность в зависимости от типа подписки
+        days = renewal_days(result[0])
+        
+        # Продлеваем подписку на соответствующий период
+        new_end_date = date.today() + timedelta(days=days)
+        
+        cursor.execute(
+            """
+            UPDATE users 
+            SET subscription_end_date = ?,
+                premium_status = TRUE
+            WHERE telegram_id = ?
+            """,
+            (new_end_date.isoformat(), telegram_id)
+        )
+        
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
     return True
 
 def update_user_preferences(telegram_id: int, use_emojis: bool = None, communication_style: str = None, preferred_response_length: str = None):
     """
     Обновляет пользовательские предпочтения.
     """
-    connection = sqlite3.connect(DB_PATH)
-    cursor = connection.cursor()
-    
-    updates = []
-    params = []
+    update = build_preferences_update(telegram_id, use_emojis, communication_style, preferred_response_length)
     
-    if use_emojis is not None:
-        updates.append("use_emojis = ?")
-        params.append(use_emojis)
-    
-    if communication_style is not None:
-        updates.append("communication_style = ?")
-        params.append(communication_style)
-    
-    if preferred_response_length is not None:
-        updates.append("preferred_response_length = ?")
-        params.append(preferred_response_length)
-    
-    if updates:
-        params.append(telegram_id)
-        query = f"UPDATE users SET {', '.join(updates)} WHERE telegram_id = ?"
-        cursor.execute(query, params)
-        connection.commit()
-    
-    connection.close()
+    if update:
+        connection = get_connection()
+        cursor = connection.cursor()
+        try:
+            cursor.execute(*update)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
 
 def get_user_preferences(telegram_id: int) -> dict:
     """
     Получает пользовательские предпочтения.
     """
-    connection = sqlite3.connect(DB_PATH)
+    connection = get_connection()
     cursor = connection.cursor()
     
     cursor.execute(
@@ -721,20 +845,11 @@ def get_user_preferences(telegram_id: int) -> dict:
         (telegram_id,)
     )
     result = cursor.fetchone()
-    connection.close()
     
-    if result:
-        return {
-            'use_emojis': bool(result[0]) if result[0] is not None else True,
-            'communication_style': result[1] or 'friendly',
-            'preferred_response_length': result[2] or 'medium'
-        }
-    
-    return {
-        'use_emojis': True,
-        'communication_style': 'friendly',
-        'preferred_response_length': 'medium'
-    }
+    return preferences_from_row(result)
+
+# Имена запросов для статистики времени выполнения
+query_stats.register_names(globals())
 
 if __name__ == "__main__":
     initialize_database()
\ No newline at end of file
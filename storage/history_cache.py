@@ -0,0 +1,145 @@
+# Кэш последних сообщений истории разговора в памяти
+#
+# Для каждого пользователя хранится кольцевой буфер последних реплик.
+# Буфер заполняется при первом чтении истории, затем обновляется при
+# каждой новой реплике (write-through), поэтому контекст для GPT обычно
+# собирается без обращения к базе. Пользователи вытесняются по LRU, когда
+# суммарный объем кэша превышает лимит памяти.
+
+import sys
+from collections import OrderedDict, deque
+from config import DatabaseConfig
+
+# Примерные накладные расходы на одну реплику (словарь, ключи, метка времени)
+MESSAGE_OVERHEAD_BYTES = 400
+
+def message_size(message: dict) -> int:
+    """Оценка объема памяти одной реплики в байтах"""
+    return sys.getsizeof(message['content']) + MESSAGE_OVERHEAD_BYTES
+
+class _HistoryEntry:
+    """Буфер одного пользователя"""
+
+    __slots__ = ("telegram_id", "messages", "complete", "size")
+
+    def __init__(self, telegram_id: int, capacity: int):
+        self.telegram_id = telegram_id
+        self.messages = deque(maxlen=capacity)
+        # True, если в буфере вся история пользователя (ее меньше емкости буфера)
+        self.complete = False
+        self.size = 0
+
+class HistoryCache:
+    """
+    LRU кэш кольцевых буферов истории разговора по внутреннему ID пользователя.
+
+    Буфер всегда содержит последние len(messages) реплик пользователя, поэтому
+    запрос последних limit сообщений обслуживается из кэша, если limit не больше
+    длины буфера или в буфере вся история.
+    """
+
+    def __init__(self, messages_per_user: int = None, max_bytes: int = None):
+        self.messages_per_user = messages_per_user or DatabaseConfig.HISTORY_CACHE_MESSAGES
+        self.max_bytes = max_bytes or DatabaseConfig.HISTORY_CACHE_MAX_BYTES
+        self._entries = OrderedDict()
+        self._user_ids = {}
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def user_id_for(self, telegram_id: int) -> int:
+        """Внутренний ID пользователя, если его история есть в кэше"""
+        return self._user_ids.get(telegram_id)
+
+    def get(self, user_id: int, limit: int) -> list:
+        """
+        Последние limit сообщений пользователя (от старых к новым)
+        или None, если кэш не может ответить на запрос.
+        """
+        entry = self._entries.get(user_id)
+        if entry is None or (limit > len(entry.messages) and not entry.complete):
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(user_id)
+        self.hits += 1
+        if limit <= 0:
+            return []
+        return list(entry.messages)[-limit:]
+
+    def fill(self, user_id: int, telegram_id: int, history: list, complete: bool):
+        """
+        Заполняет буфер пользователя последними сообщениями из базы.
+
+        Args:
+            history: Сообщения от старых к новым
+            complete: True, если это вся история пользователя
+        """
+        # Сохраняем связь с Telegram ID, если она уже известна
+        previous = self._entries.get(user_id)
+        if telegram_id is None and previous is not None:
+            telegram_id = previous.telegram_id
+        self.invalidate(user_id)
+
+        entry = _HistoryEntry(telegram_id, self.messages_per_user)
+        entry.complete = complete and len(history) <= self.messages_per_user
+        for message in history[-self.messages_per_user:]:
+            entry.messages.append(message)
+            entry.size += message_size(message)
+
+        self._entries[user_id] = entry
+        if telegram_id is not None:
+            self._user_ids[telegram_id] = user_id
+        self.size += entry.size
+        self._evict()
+
+    def append(self, user_id: int, message: dict):
+        """Добавляет новую реплику в буфер пользователя (если он в кэше)"""
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return
+
+        # Полный буфер вытесняет самую старую реплику
+        if len(entry.messages) == entry.messages.maxlen:
+            dropped = message_size(entry.messages[0])
+            entry.size -= dropped
+            self.size -= dropped
+            entry.complete = False
+
+        entry.messages.append(message)
+        added = message_size(message)
+        entry.size += added
+        self.size += added
+        self._evict()
+
+    def invalidate(self, user_id: int):
+        """Удаляет буфер пользователя из кэша (например, после очистки истории)"""
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        self.size -= entry.size
+        if self._user_ids.get(entry.telegram_id) == user_id:
+            del self._user_ids[entry.telegram_id]
+
+    def clear(self):
+        """Очищает весь кэш"""
+        self._entries.clear()
+        self._user_ids.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            'users': len(self._entries),
+            'bytes': self.size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+    def _evict(self):
+        """Вытесняет давно не использованных пользователей при превышении лимита памяти"""
+        while self.size > self.max_bytes and self._entries:
+            user_id = next(iter(self._entries))
+            self.invalidate(user_id)
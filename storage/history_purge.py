@@ -0,0 +1,132 @@
+# Фоновое удаление очищенной истории разговоров
+#
+# /clear не удаляет сообщения сразу: он ставит отметку users.history_cleared_id
+# (последний ID сообщения на момент очистки), и чтение истории пропускает
+# более ранние сообщения. Пользователь попадает в очередь history_purges,
+# а эта задача удаляет его старые сообщения небольшими пачками - каждая в
+# своей короткой транзакции, чтобы не держать блокировку записи. В боте
+# удаление идет через асинхронное соединение записи
+# (storage.async_db.purge_cleared_history): write_lock берется на одну пачку и
+# отпускается между пачками, поэтому запись сообщений и платежей ждет не
+# дольше одной пачки. Индекс поиска обновляется триггером удаления; из
+# архива удаляются строки с ID не больше отметки. Сводные итоги (storage/rollups.py) не уменьшаются,
+# как и при прежнем удалении.
+
+from config import DatabaseConfig
+from storage.connection import get_connection
+from storage.archive import encode_archive_rows, decode_archive_rows, ARCHIVE_COMPRESSION
+from storage.query_stats import query_stats
+
+# Пользователи в очереди на удаление
+PENDING_HISTORY_PURGES_QUERY = "SELECT user_id, up_to_id FROM history_purges ORDER BY user_id LIMIT ?"
+
+# Одна пачка старых сообщений пользователя
+PURGE_MESSAGES_BATCH_QUERY = """
+    DELETE FROM messages WHERE id IN (
+        SELECT id FROM messages WHERE user_id = ? AND id <= ? LIMIT ?
+    )
+"""
+
+# Блоки архива пользователя и их перезапись
+USER_ARCHIVE_BLOCKS_QUERY = "SELECT month, message_count, data FROM message_archive WHERE user_id = ?"
+UPDATE_ARCHIVE_BLOCK_QUERY = """
+    UPDATE message_archive
+    SET message_count = ?, first_created_at = ?, last_created_at = ?, compression = ?, data = ?
+    WHERE user_id = ? AND month = ?
+"""
+DELETE_ARCHIVE_BLOCK_QUERY = "DELETE FROM message_archive WHERE user_id = ? AND month = ?"
+
+# Пользователь снимается с очереди, только если за время удаления не было новой очистки
+COMPLETE_HISTORY_PURGE_QUERY = "DELETE FROM history_purges WHERE user_id = ? AND up_to_id = ?"
+
+def purge_archive_block(data: bytes, up_to_id: int):
+    """
+    Убирает из блока архива сообщения с ID не больше up_to_id.
+
+    Returns:
+        None, если блок не изменился; иначе оставшиеся строки (пустой список - удалить блок)
+    """
+    rows = decode_archive_rows(data)
+    kept = [row for row in rows if row[0] > up_to_id]
+    if len(kept) == len(rows):
+        return None
+    return kept
+
+def archive_block_params(kept: list, user_id: int, month: str) -> tuple:
+    """Параметры UPDATE_ARCHIVE_BLOCK_QUERY для оставшихся строк блока"""
+    return (len(kept), kept[0][3], kept[-1][3], ARCHIVE_COMPRESSION, encode_archive_rows(kept), user_id, month)
+
+def archive_purge_statements(blocks, user_id: int, up_to_id: int) -> tuple:
+    """
+    Изменения архива пользователя по строкам USER_ARCHIVE_BLOCKS_QUERY.
+
+    Returns:
+        (количество удаляемых строк архива, список пар (запрос, параметры))
+    """
+    removed = 0
+    statements = []
+    for month, message_count, data in blocks:
+        kept = purge_archive_block(data, up_to_id)
+        if kept is None:
+            continue
+        removed += message_count - len(kept)
+        if kept:
+            statements.append((UPDATE_ARCHIVE_BLOCK_QUERY, archive_block_params(kept, user_id, month)))
+        else:
+            statements.append((DELETE_ARCHIVE_BLOCK_QUERY, (user_id, month)))
+    return removed, statements
+
+def purge_user_archive(connection, user_id: int, up_to_id: int) -> int:
+    """
+    Удаляет очищенные сообщения пользователя из архива (в текущей транзакции).
+    Возвращает количество удаленных строк архива.
+    """
+    blocks = connection.execute(USER_ARCHIVE_BLOCKS_QUERY, (user_id,)).fetchall()
+    removed, statements = archive_purge_statements(blocks, user_id, up_to_id)
+    for query, params in statements:
+        connection.execute(query, params)
+    return removed
+
+def purge_cleared_history(batch: int = None, max_users: int = None, connection=None) -> dict:
+    """
+    Удаляет очищенные через /clear сообщения пачками по batch строк.
+
+    Args:
+        batch: Сообщений в одной транзакции (по умолчанию DatabaseConfig.HISTORY_PURGE_BATCH_SIZE)
+        max_users: Сколько пользователей из очереди обработать за вызов
+        connection: Соединение (по умолчанию соединение текущего потока)
+
+    Returns:
+        Словарь: users, messages, archived_messages
+    """
+    if connection is None:
+        connection = get_connection()
+    batch = batch or DatabaseConfig.HISTORY_PURGE_BATCH_SIZE
+    max_users = max_users or DatabaseConfig.HISTORY_PURGE_MAX_USERS
+
+    result = {'users': 0, 'messages': 0, 'archived_messages': 0}
+    for user_id, up_to_id in connection.execute(PENDING_HISTORY_PURGES_QUERY, (max_users,)).fetchall():
+        while True:
+            try:
+                deleted = connection.execute(PURGE_MESSAGES_BATCH_QUERY, (user_id, up_to_id, batch)).rowcount
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            result['messages'] += deleted
+            if deleted < batch:
+                break
+
+        try:
+            result['archived_messages'] += purge_user_archive(connection, user_id, up_to_id)
+            connection.execute(COMPLETE_HISTORY_PURGE_QUERY, (user_id, up_to_id))
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        result['users'] += 1
+
+    return result
+
+# Имена запросов для статистики времени выполнения
+query_stats.register_names(globals())
@@ -0,0 +1,116 @@
+# Потоковое чтение пользователей и сообщений
+#
+# Вместо загрузки всей таблицы в список строки читаются пачками по
+# ключу (keyset pagination): каждая следующая пачка начинается после
+# последнего прочитанного ключа, поэтому запрос идет по индексу и не
+# замедляется к концу таблицы, как OFFSET. Память и время до первой
+# строки не зависят от размера базы.
+
+from storage.connection import get_connection
+
+def build_users_query(where: str = None) -> str:
+    """
+    Запрос следующей пачки пользователей после id = ?.
+    where - дополнительное SQL условие с позиционными параметрами.
+    """
+    condition = f"AND ({where})" if where else ""
+    return f"""
+        SELECT id, username, telegram_id, created_at FROM users
+        WHERE id > ? {condition}
+        ORDER BY id
+        LIMIT ?
+    """
+
+def user_summary_from_row(row) -> dict:
+    """Преобразует строку (id, username, telegram_id, created_at) в словарь"""
+    return {
+        'id': row[0],
+        'username': row[1],
+        'telegram_id': row[2],
+        'created_at': row[3]
+    }
+
+def build_messages_query(user: int = None) -> str:
+    """
+    Запрос следующей пачки сообщений после ключа (created_at, id).
+    Порядок совпадает с индексами idx_messages_created и idx_messages_user_created.
+    """
+    condition = "AND user_id = ?" if user is not None else ""
+    return f"""
+        SELECT id, user_id, role, message, created_at FROM messages
+        WHERE (created_at, id) > (?, ?) {condition}
+        ORDER BY created_at, id
+        LIMIT ?
+    """
+
+def message_from_row(row) -> dict:
+    """Преобразует строку (id, user_id, role, message, created_at) в словарь"""
+    return {
+        'id': row[0],
+        'user_id': row[1],
+        'role': row[2],
+        'message': row[3],
+        'created_at': row[4]
+    }
+
+def iter_users(batch: int = 1000, where: str = None, params=(), connection=None):
+    """
+    Перебирает пользователей по возрастанию id, читая по batch строк.
+
+    Args:
+        batch: Размер пачки
+        where: Дополнительное SQL условие, например "premium_status = TRUE"
+        params: Позиционные параметры условия where
+        connection: Соединение для чтения (по умолчанию соединение текущего потока)
+
+    Yields:
+        Словари {'id', 'username', 'telegram_id', 'created_at'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    query = build_users_query(where)
+    last_id = 0
+    while True:
+        rows = connection.execute(query, (last_id, *params, batch)).fetchall()
+        for row in rows:
+            yield user_summary_from_row(row)
+        if len(rows) < batch:
+            return
+        last_id = rows[-1][0]
+
+def iter_messages(since: str = None, user: int = None, batch: int = 1000, connection=None):
+    """
+    Перебирает сообщения таблицы messages в порядке времени, читая по batch строк.
+
+    Args:
+        since: Нижняя граница created_at включительно ('YYYY-MM-DD' или 'YYYY-MM-DD HH:MM:SS')
+        user: Внутренний ID пользователя (None - все пользователи)
+        batch: Размер пачки
+        connection: Соединение для чтения (по умолчанию соединение текущего потока)
+
+    Yields:
+        Словари {'id', 'user_id', 'role', 'message', 'created_at'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    query = build_messages_query(user)
+    extra = (user,) if user is not None else ()
+    # Граница since сразу служит начальным ключом
+    last_key = (since or "", 0)
+    while True:
+        rows = connection.execute(query, (*last_key, *extra, batch)).fetchall()
+        for row in rows:
+            yield message_from_row(row)
+        if len(rows) < batch:
+            return
+        last_key = (rows[-1][4], rows[-1][0])
+
+def count_users(where: str = None, params=(), connection=None) -> int:
+    """Количество пользователей (с необязательным условием where)"""
+    if connection is None:
+        connection = get_connection()
+
+    condition = f"WHERE {where}" if where else ""
+    return connection.execute(f"SELECT COUNT(*) FROM users {condition}", params).fetchone()[0]
@@ -0,0 +1,289 @@
+# Отложенная запись сообщений чата (write-behind) с групповым коммитом
+#
+# Реплики диалога не записываются по одной: они копятся в памяти и
+# вставляются пачкой одной транзакцией раз в несколько миллисекунд или
+# при накоплении нужного количества строк. Пачка извлекается из очереди
+# и фиксируется под write_lock соединения, поэтому под этой блокировкой
+# каждая строка либо еще в очереди, либо уже в базе.
+#
+# Пачка, которую не удалось записать из-за временной ошибки (база занята
+# или заблокирована), возвращается в начало очереди и повторяется с растущей
+# паузой, пока база не освободится; потерять сообщения можно только при
+# переполнении очереди (MESSAGE_JOURNAL_MAX_PENDING строк, отбрасываются
+# самые старые). При постоянной ошибке (например, нарушение ограничения в
+# одной строке) пачка пишется по одной строке: отклоненные строки
+# записываются в лог и отбрасываются, чтобы одна плохая строка не
+# останавливала запись всех следующих.
+
+import asyncio
+import logging
+import sqlite3
+import time
+from datetime import datetime, timezone
+from config import DatabaseConfig
+
+logger = logging.getLogger(__name__)
+
+INSERT_MESSAGE_QUERY = "INSERT INTO messages (user_id, message, role, created_at) VALUES (?, ?, ?, ?)"
+
+def current_timestamp() -> str:
+    """Время в формате CURRENT_TIMESTAMP SQLite (UTC)"""
+    return datetime.now(timezone.utc).strftime("%Y-%m-%d %H:%M:%S")
+
+# Коды ошибок SQLite, после которых запись стоит повторить
+TRANSIENT_ERROR_CODES = ("SQLITE_BUSY", "SQLITE_LOCKED")
+
+def is_transient_error(error: Exception) -> bool:
+    """Ошибка, после которой запись стоит повторить (база занята или заблокирована)"""
+    if not isinstance(error, sqlite3.OperationalError):
+        return False
+    code = getattr(error, "sqlite_errorname", None)
+    if code:
+        return code.startswith(TRANSIENT_ERROR_CODES)
+    message = str(error).lower()
+    return "locked" in message or "busy" in message
+
+def history_from_pending(rows) -> list:
+    """
+    Преобразует строки очереди (user_id, message, role, created_at)
+    в историю разговора в порядке добавления.
+    """
+    return [{
+        'content': row[1],
+        'role': row[2],
+        'timestamp': row[3]
+    } for row in rows]
+
+class MessageJournal:
+    """
+    Очередь сообщений, ожидающих записи в таблицу messages.
+
+    Фоновая задача запускается при первом добавлении строки и сбрасывает
+    очередь каждые flush_interval_ms миллисекунд или сразу, когда в ней
+    набирается batch_size строк. При остановке приложения нужно вызвать close().
+    """
+
+    def __init__(self, manager, flush_interval_ms: int = None, batch_size: int = None,
+                 max_backoff_ms: int = None, max_pending: int = None):
+        self.manager = manager
+        self.flush_interval = (flush_interval_ms or DatabaseConfig.MESSAGE_FLUSH_INTERVAL_MS) / 1000
+        self.batch_size = batch_size or DatabaseConfig.MESSAGE_FLUSH_BATCH_SIZE
+        self.max_backoff = (max_backoff_ms or DatabaseConfig.MESSAGE_FLUSH_MAX_BACKOFF_MS) / 1000
+        self.max_pending = max_pending or DatabaseConfig.MESSAGE_JOURNAL_MAX_PENDING
+        # Неудачных попыток записи подряд (база занята)
+        self.failed_attempts = 0
+        # Строки, отклоненные базой, и строки, потерянные без записи
+        # (вытеснены из переполненной очереди или не записаны при остановке)
+        self.rejected = 0
+        self.dropped = 0
+        self._pending = []
+        self._in_flight = []
+        self._has_rows = asyncio.Event()
+        self._batch_full = asyncio.Event()
+        self._task = None
+        # Счетчик добавленных строк: позволяет понять, менялась ли очередь во время чтения
+        self.appended = 0
+
+    def append(self, user_id: int, message: str, role: str = 'user', created_at: str = None) -> tuple:
+        """Ставит сообщение в очередь на запись, возвращает строку очереди"""
+        row = (user_id, message, role, created_at or current_timestamp())
+        self._pending.append(row)
+        self.appended += 1
+        self._trim_pending()
+        self._has_rows.set()
+        if len(self._pending) >= self.batch_size:
+            self._batch_full.set()
+        self._ensure_started()
+        return row
+
+    def has_pending(self, user_id: int) -> bool:
+        """Есть ли у пользователя незаписанные сообщения (в очереди или в записываемой пачке)"""
+        return any(row[0] == user_id for row in self._pending) or any(row[0] == user_id for row in self._in_flight)
+
+    def pending_for_user(self, user_id: int) -> list:
+        """
+        Незаписанные сообщения пользователя в порядке добавления.
+        Вызывать под write_lock, иначе часть строк может быть в процессе записи.
+        """
+        return [row for row in self._pending if row[0] == user_id]
+
+    def discard_user(self, user_id: int) -> int:
+        """
+        Удаляет из очереди сообщения пользователя (при очистке истории).
+        Вызывать под write_lock. Возвращает количество удаленных строк.
+        """
+        kept = [row for row in self._pending if row[0] != user_id]
+        discarded = len(self._pending) - len(kept)
+        self._pending = kept
+        return discarded
+
+    async def flush(self) -> int:
+        """Записывает все накопленные сообщения одной транзакцией, возвращает количество строк"""
+        async with self.manager.write_lock:
+            return await self._flush_locked()
+
+    async def _flush_locked(self) -> int:
+        """Запись очереди; вызывающий уже держит write_lock"""
+        if not self._pending:
+            return 0
+
+        connection = await self.manager.writer()
+        batch, self._pending = self._pending, []
+        self._in_flight = batch
+        self._batch_full.clear()
+
+        committing = False
+        try:
+            await connection.executemany(INSERT_MESSAGE_QUERY, batch)
+            committing = True
+            await connection.commit()
+        except Exception as e:
+            if is_transient_error(e):
+                # Возвращаем пачку в начало очереди, чтобы не потерять сообщения
+                await self._retry_later(connection, batch)
+                raise
+            await self._rollback(connection)
+            logger.warning(f"Пачка сообщений не записана ({e}), запись по одной строке")
+            return await self._insert_rows(connection, batch)
+        except BaseException:
+            # Отмена во время коммита: коммит уже поставлен в очередь соединения
+            if not committing:
+                await self._rollback(connection)
+                self._requeue(batch)
+            raise
+        finally:
+            self._in_flight = []
+
+        self.failed_attempts = 0
+        return len(batch)
+
+    async def _insert_rows(self, connection, batch: list) -> int:
+        """
+        Записывает пачку по одной строке; строки, отклоненные базой, пишутся
+        в лог и отбрасываются. Если база занята, пачка без отклоненных строк
+        возвращается в очередь. Возвращает количество записанных строк.
+        """
+        kept = []
+        for index, row in enumerate(batch):
+            try:
+                await connection.execute(INSERT_MESSAGE_QUERY, row)
+                kept.append(row)
+            except Exception as e:
+                if is_transient_error(e):
+                    # Отклоненные строки в очередь не возвращаются
+                    await self._retry_later(connection, kept + batch[index:])
+                    raise
+                self.rejected += 1
+                logger.error(
+                    f"Сообщение отброшено: user_id={row[0]}, role={row[2]}, created_at={row[3]}, "
+                    f"длина {len(row[1]) if isinstance(row[1], str) else '?'}: {e}"
+                )
+        try:
+            await connection.commit()
+        except Exception as e:
+            if is_transient_error(e):
+                await self._retry_later(connection, kept)
+                raise
+            await self._rollback(connection)
+            self.dropped += len(kept)
+            logger.error(f"Не удалось записать {len(kept)} сообщений, они потеряны: {e}")
+            return 0
+        self.failed_attempts = 0
+        return len(kept)
+
+    async def _retry_later(self, connection, rows: list):
+        """Откатывает транзакцию и возвращает строки в очередь: база занята"""
+        await self._rollback(connection)
+        self.failed_attempts += 1
+        self._requeue(rows)
+
+    async def _rollback(self, connection):
+        try:
+            await connection.rollback()
+        except Exception:
+            pass
+
+    def _requeue(self, batch: list):
+        """Возвращает пачку в начало очереди"""
+        self._pending = batch + self._pending
+        self._trim_pending()
+
+    def _trim_pending(self):
+        """Отбрасывает самые старые строки, если очередь переполнена"""
+        overflow = len(self._pending) - self.max_pending
+        if overflow <= 0:
+            return
+        del self._pending[:overflow]
+        self.dropped += overflow
+        logger.error(f"Очередь записи сообщений переполнена: отброшено {overflow} самых старых сообщений")
+
+    def _ensure_started(self):
+        """Запускает фоновую запись, если она еще не работает"""
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return  # Нет цикла событий: очередь будет записана при flush()
+        if self._task is not None and not self._task.done() and self._task.get_loop() is loop:
+            return
+        if self._task is not None and self._task.get_loop() is not loop:
+            # События привязаны к прежнему циклу событий
+            self._has_rows = asyncio.Event()
+            self._batch_full = asyncio.Event()
+            self._has_rows.set()
+        self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        """Фоновая задача группового коммита"""
+        while True:
+            if not self._pending:
+                self._has_rows.clear()
+                await self._has_rows.wait()
+
+            # Ждем интервал, чтобы собрать пачку, или пока очередь не заполнится
+            if len(self._pending) < self.batch_size:
+                try:
+                    await asyncio.wait_for(self._batch_full.wait(), timeout=self.flush_interval)
+                except asyncio.TimeoutError:
+                    pass
+
+            try:
+                # Отмена задачи при остановке не должна прерывать начатую запись
+                await asyncio.shield(self.flush())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"Ошибка при записи сообщений в БД (попытка {self.failed_attempts}): {e}")
+                await asyncio.sleep(self._backoff())
+
+    def _backoff(self) -> float:
+        """Пауза перед повтором (секунды): растет с каждой неудачной попыткой подряд"""
+        return min(self.flush_interval * 2 ** min(self.failed_attempts, 30), self.max_backoff)
+
+    async def close(self):
+        """Останавливает фоновую запись и записывает остаток очереди"""
+        if self._task is not None:
+            self._task.cancel()
+            # Задача могла остаться от уже завершенного цикла событий
+            if self._task.get_loop() is asyncio.get_running_loop():
+                try:
+                    await self._task
+                except asyncio.CancelledError:
+                    pass
+            self._task = None
+            self._has_rows = asyncio.Event()
+            self._batch_full = asyncio.Event()
+        # Пока база занята, повторяем запись, но не дольше MESSAGE_JOURNAL_CLOSE_TIMEOUT_SECONDS
+        deadline = time.monotonic() + DatabaseConfig.MESSAGE_JOURNAL_CLOSE_TIMEOUT_SECONDS
+        while True:
+            try:
+                await self.flush()
+                return
+            except Exception as e:
+                logger.error(f"Ошибка при записи сообщений в БД: {e}")
+                if time.monotonic() >= deadline:
+                    break
+                await asyncio.sleep(self._backoff())
+        lost = len(self._pending)
+        self._pending = []
+        self.dropped += lost
+        logger.error(f"База занята при остановке: {lost} сообщений не записаны")
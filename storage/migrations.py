@@ -0,0 +1,373 @@
+# Версионированные миграции схемы базы данных
+#
+# Версия схемы хранится в PRAGMA user_version. При запуске применяются
+# только недостающие шаги; если схема актуальна, проверка сводится к
+# чтению одного PRAGMA.
+
+import sqlite3
+from config import LimitsConfig
+
+def _create_base_tables(cursor: sqlite3.Cursor):
+    """Версия 1: исходные таблицы"""
+    # Таблица пользователей
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            telegram_id INTEGER UNIQUE NOT NULL,
+            daily_message_count INTEGER DEFAULT 0,
+            last_message_date DATE DEFAULT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+
+    # Таблица сообщений
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            message TEXT NOT NULL,
+            role TEXT DEFAULT 'user',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # Таблица записей дневника
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS journal_entries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            mood INTEGER NOT NULL,
+            facts TEXT,
+            gratitude TEXT,
+            plan TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # Таблица настроек
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS settings (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            key TEXT NOT NULL,
+            value TEXT,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+# Поля, которые добавлялись в таблицу users после ее создания
+USER_COLUMNS = (
+    ("daily_message_count", "INTEGER DEFAULT 0"),
+    ("last_message_date", "DATE DEFAULT NULL"),
+    # Система оплаты через Telegram Stars
+    ("premium_status", "BOOLEAN DEFAULT FALSE"),
+    ("stars_balance", "INTEGER DEFAULT 0"),
+    ("subscription_end_date", "DATE DEFAULT NULL"),
+    # Автоматические платежи и тип подписки (дни подписки)
+    ("auto_renewal", "BOOLEAN DEFAULT FALSE"),
+    ("subscription_type", f"INTEGER DEFAULT {LimitsConfig.DEFAULT_SUBSCRIPTION_DAYS}"),
+    # Пользовательские предпочтения
+    ("use_emojis", "BOOLEAN DEFAULT TRUE"),
+    ("communication_style", "TEXT DEFAULT 'friendly'"),
+    ("preferred_response_length", "TEXT DEFAULT 'medium'"),
+)
+
+def _add_user_columns(cursor: sqlite3.Cursor):
+    """Версия 2: дополнительные поля пользователей (лимиты, премиум, предпочтения)"""
+    add_missing_columns(cursor, "users", USER_COLUMNS)
+
+def _create_hot_path_indexes(cursor: sqlite3.Cursor):
+    """Версия 3: индексы для частых запросов"""
+    # История сообщений пользователя
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_user_created ON messages(user_id, created_at)")
+    # Продление и напоминания о подписке
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_premium_end ON users(premium_status, subscription_end_date)")
+    # Отчеты по ролям и датам
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_role_created ON messages(role, created_at)")
+
+def _create_message_archive(cursor: sqlite3.Cursor):
+    """Версия 4: сжатый архив старых сообщений (блок на пользователя за месяц)"""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS message_archive (
+            user_id INTEGER NOT NULL,
+            month TEXT NOT NULL,
+            message_count INTEGER NOT NULL,
+            first_created_at TIMESTAMP,
+            last_created_at TIMESTAMP,
+            compression TEXT NOT NULL DEFAULT 'zlib',
+            data BLOB NOT NULL,
+            PRIMARY KEY (user_id, month),
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+    # Отбор сообщений старше срока хранения
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_created ON messages(created_at)")
+
+def _create_message_search(cursor: sqlite3.Cursor):
+    """
+    Версия 5: полнотекстовый индекс FTS5 по тексту сообщений.
+    Индекс хранит только токены (content='messages'), синхронизируется
+    триггерами и сразу заполняется существующими сообщениями.
+    """
+    cursor.execute(
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            message,
+            content='messages',
+            content_rowid='id',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+        END
+        """
+    )
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF message ON messages BEGIN
+            INSERT INTO messages_fts(messages_fts, rowid, message) VALUES ('delete', old.id, old.message);
+            INSERT INTO messages_fts(rowid, message) VALUES (new.id, new.message);
+        END
+        """
+    )
+    # Удаление строки, которой нет в индексе, повреждает внешний FTS5 индекс,
+    # поэтому существующие сообщения индексируются в той же миграции
+    cursor.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+
+def _create_message_rollups(cursor: sqlite3.Cursor):
+    """
+    Версия 6: сводные таблицы статистики, обновляемые триггером при вставке
+    сообщения. Отчеты читают их вместо GROUP BY по всей таблице messages.
+    Удаление сообщений (очистка истории, архив) сводки не уменьшает:
+    они считают отправленные сообщения.
+    """
+    # Сообщения по дням, часам и ролям
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS message_stats (
+            day TEXT NOT NULL,
+            hour TEXT NOT NULL,
+            role TEXT NOT NULL,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (day, hour, role)
+        ) WITHOUT ROWID
+        """
+    )
+
+    # Итоги по пользователю
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_message_stats (
+            user_id INTEGER PRIMARY KEY,
+            message_count INTEGER NOT NULL DEFAULT 0,
+            user_messages INTEGER NOT NULL DEFAULT 0,
+            first_message_at TIMESTAMP,
+            last_message_at TIMESTAMP,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+    # Активность пользователя по дням (строка с user_messages > 0 - активный пользователь дня)
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS user_daily_activity (
+            day TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            user_messages INTEGER NOT NULL DEFAULT 0,
+            assistant_messages INTEGER NOT NULL DEFAULT 0,
+            first_user_message_at TIMESTAMP,
+            last_user_message_at TIMESTAMP,
+            PRIMARY KEY (day, user_id)
+        ) WITHOUT ROWID
+        """
+    )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_daily_activity_user ON user_daily_activity(user_id, day)")
+
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS messages_rollups_insert AFTER INSERT ON messages BEGIN
+            INSERT INTO message_stats (day, hour, role, message_count)
+            VALUES (date(new.created_at), strftime('%H', new.created_at), COALESCE(new.role, 'user'), 1)
+            ON CONFLICT(day, hour, role) DO UPDATE SET message_count = message_count + 1;
+
+            INSERT INTO user_message_stats (user_id, message_count, user_messages, first_message_at, last_message_at)
+            VALUES (new.user_id, 1, COALESCE(new.role, 'user') = 'user', new.created_at, new.created_at)
+            ON CONFLICT(user_id) DO UPDATE SET
+                message_count = message_count + 1,
+                user_messages = user_messages + excluded.user_messages,
+                first_message_at = MIN(COALESCE(first_message_at, excluded.first_message_at), excluded.first_message_at),
+                last_message_at = MAX(COALESCE(last_message_at, excluded.last_message_at), excluded.last_message_at);
+
+            INSERT INTO user_daily_activity (day, user_id, user_messages, assistant_messages, first_user_message_at, last_user_message_at)
+            VALUES (
+                date(new.created_at), new.user_id,
+                COALESCE(new.role, 'user') = 'user', COALESCE(new.role, 'user') != 'user',
+                CASE WHEN COALESCE(new.role, 'user') = 'user' THEN new.created_at END,
+                CASE WHEN COALESCE(new.role, 'user') = 'user' THEN new.created_at END
+            )
+            ON CONFLICT(day, user_id) DO UPDATE SET
+                user_messages = user_messages + excluded.user_messages,
+                assistant_messages = assistant_messages + excluded.assistant_messages,
+                first_user_message_at = COALESCE(MIN(first_user_message_at, excluded.first_user_message_at), first_user_message_at, excluded.first_user_message_at),
+                last_user_message_at = COALESCE(MAX(last_user_message_at, excluded.last_user_message_at), last_user_message_at, excluded.last_user_message_at);
+        END
+        """
+    )
+
+    # Сводки удаленного пользователя больше не нужны
+    cursor.execute(
+        """
+        CREATE TRIGGER IF NOT EXISTS users_rollups_delete AFTER DELETE ON users BEGIN
+            DELETE FROM user_message_stats WHERE user_id = old.id;
+            DELETE FROM user_daily_activity WHERE user_id = old.id;
+        END
+        """
+    )
+
+    # Заполняем сводки по уже накопленным сообщениям (включая архив)
+    from storage.rollups import rebuild_rollups_with_cursor
+    rebuild_rollups_with_cursor(cursor)
+
+def _create_payments(cursor: sqlite3.Cursor):
+    """Версия 7: журнал платежей с уникальным ID платежа Telegram"""
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS payments (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            telegram_id INTEGER NOT NULL,
+            charge_id TEXT NOT NULL,
+            provider_charge_id TEXT,
+            amount INTEGER NOT NULL,
+            currency TEXT NOT NULL DEFAULT 'XTR',
+            plan_days INTEGER NOT NULL,
+            subscription_end_date DATE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """
+    )
+    # Повторная доставка того же платежа - конфликт по индексу, а не новая запись
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_payments_charge ON payments(charge_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_created ON payments(created_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(telegram_id, created_at)")
+
+def _index_settings(cursor: sqlite3.Cursor):
+    """Версия 8: уникальный индекс (user_id, key) для хранения предпочтений в settings"""
+    # Оставляем последнее значение для повторяющихся ключей
+    cursor.execute("DELETE FROM settings WHERE id NOT IN (SELECT MAX(id) FROM settings GROUP BY user_id, key)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_settings_user_key ON settings(user_id, key)")
+
+def _create_history_purges(cursor: sqlite3.Cursor):
+    """
+    Версия 9: отметка очистки истории и очередь фонового удаления.
+    /clear только запоминает в users.history_cleared_id последний ID сообщения:
+    более ранние сообщения пользователя больше не читаются, а физически
+    удаляются фоновой задачей по очереди history_purges.
+    """
+    add_missing_columns(cursor, "users", (("history_cleared_id", "INTEGER NOT NULL DEFAULT 0"),))
+    cursor.execute(
+        """
+        CREATE TABLE IF NOT EXISTS history_purges (
+            user_id INTEGER PRIMARY KEY,
+            up_to_id INTEGER NOT NULL,
+            FOREIGN KEY(user_id) REFERENCES users(id)
+        )
+        """
+    )
+
+def _add_cleared_message_counts(cursor: sqlite3.Cursor):
+    """
+    Версия 10: сколько сообщений пользователя скрыто очисткой истории.
+    Сводки хранят итоги за все время, а /stats после /clear считает заново.
+    """
+    add_missing_columns(cursor, "user_message_stats", (("cleared_message_count", "INTEGER NOT NULL DEFAULT 0"),))
+    from storage.rollups import recount_cleared_messages_with_cursor
+    recount_cleared_messages_with_cursor(cursor)
+
+# Шаги миграций по порядку: номер версии = позиция в списке + 1.
+# Новые шаги добавляются только в конец списка.
+MIGRATIONS = [
+    _create_base_tables,
+    _add_user_columns,
+    _create_hot_path_indexes,
+    _create_message_archive,
+    _create_message_search,
+    _create_message_rollups,
+    _create_payments,
+    _index_settings,
+    _create_history_purges,
+    _add_cleared_message_counts,
+]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def add_missing_columns(cursor: sqlite3.Cursor, table: str, columns):
+    """
+    Добавляет в таблицу отсутствующие поля.
+    Нужно для баз, созданных до появления миграций (user_version = 0).
+    """
+    cursor.execute(f"PRAGMA table_info({table})")
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, definition in columns:
+        if name not in existing:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN {name} {definition}")
+
+def get_schema_version(connection: sqlite3.Connection) -> int:
+    """Возвращает текущую версию схемы"""
+    return connection.execute("PRAGMA user_version").fetchone()[0]
+
+def run_migrations(connection: sqlite3.Connection) -> int:
+    """
+    Применяет недостающие миграции. Каждый шаг выполняется в своей
+    транзакции вместе с обновлением user_version.
+
+    Returns:
+        Версия схемы после применения миграций
+    """
+    version = get_schema_version(connection)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    # BEGIN IMMEDIATE не дает двум процессам применять миграции одновременно
+    connection.commit()
+    for step_version in range(version + 1, SCHEMA_VERSION + 1):
+        cursor = connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            # Другой процесс мог успеть применить этот шаг
+            if get_schema_version(connection) >= step_version:
+                connection.rollback()
+                continue
+            MIGRATIONS[step_version - 1](cursor)
+            cursor.execute(f"PRAGMA user_version = {step_version}")
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+        print(f"Схема базы данных обновлена до версии {step_version}")
+
+    return get_schema_version(connection)
@@ -0,0 +1,145 @@
+# Журнал платежей и статистика выручки
+#
+# Каждый успешный платеж записывается в таблицу payments (миграция
+# версии 7) с уникальным charge_id от Telegram. Повторная доставка
+# того же обновления упирается в уникальный индекс и ничего не меняет.
+# Запись платежа и продление подписки выполняются одной транзакцией
+# (storage.async_db.apply_payment). Статистика считается агрегатами
+# по журналу, без перебора таблицы users.
+
+from datetime import date
+from storage.connection import get_connection
+from storage.db import PREMIUM_ACTIVE_SQL
+from storage.query_stats import query_stats
+
+# Запись платежа; для уже известного charge_id ничего не возвращает
+INSERT_PAYMENT_QUERY = """
+    INSERT INTO payments (telegram_id, charge_id, provider_charge_id, amount, currency, plan_days)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(charge_id) DO NOTHING
+    RETURNING id
+"""
+
+# Дата окончания подписки, которую дал платеж
+SET_PAYMENT_SUBSCRIPTION_END_QUERY = "UPDATE payments SET subscription_end_date = ? WHERE id = ?"
+
+def _since_condition(since: str, prefix: str = "WHERE"):
+    """Условие по created_at и его параметры"""
+    if since:
+        return f"{prefix} created_at >= ?", (since,)
+    return "", ()
+
+def get_revenue_stats(since: str = None, connection=None) -> list:
+    """
+    Выручка по валютам: количество платежей, сумма и число плательщиков.
+
+    Args:
+        since: Нижняя граница created_at ('YYYY-MM-DD'), None - за все время
+
+    Returns:
+        Список словарей {'currency', 'payments', 'amount', 'payers'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    where, params = _since_condition(since)
+    rows = connection.execute(
+        f"""
+        SELECT currency, COUNT(*), SUM(amount), COUNT(DISTINCT telegram_id)
+        FROM payments {where}
+        GROUP BY currency
+        """,
+        params
+    )
+    return [{
+        'currency': row[0],
+        'payments': row[1],
+        'amount': row[2],
+        'payers': row[3]
+    } for row in rows]
+
+def get_plan_stats(since: str = None, connection=None) -> list:
+    """
+    Продажи по тарифам (длительности подписки).
+
+    Returns:
+        Список словарей {'plan_days', 'payments', 'amount'} по возрастанию длительности
+    """
+    if connection is None:
+        connection = get_connection()
+
+    where, params = _since_condition(since)
+    rows = connection.execute(
+        f"""
+        SELECT plan_days, COUNT(*), SUM(amount)
+        FROM payments {where}
+        GROUP BY plan_days
+        ORDER BY plan_days
+        """,
+        params
+    )
+    return [{
+        'plan_days': row[0],
+        'payments': row[1],
+        'amount': row[2]
+    } for row in rows]
+
+def get_daily_revenue(since: str = None, limit: int = None, connection=None) -> list:
+    """Выручка по дням от новых к старым: список (день, платежей, сумма)"""
+    if connection is None:
+        connection = get_connection()
+
+    where, params = _since_condition(since)
+    query = f"""
+        SELECT date(created_at), COUNT(*), SUM(amount)
+        FROM payments {where}
+        GROUP BY 1
+        ORDER BY 1 DESC
+    """
+    if limit:
+        query += " LIMIT ?"
+        params = (*params, limit)
+
+    return [(day, count, amount) for day, count, amount in connection.execute(query, params)]
+
+def count_premium_users(connection=None) -> dict:
+    """Количество активных премиум пользователей и из них с автопродлением"""
+    if connection is None:
+        connection = get_connection()
+
+    total, auto_renewal = connection.execute(
+        f"""
+        SELECT COUNT(*), COALESCE(SUM(auto_renewal = TRUE), 0)
+        FROM users
+        WHERE {PREMIUM_ACTIVE_SQL}
+        """,
+        {'today': date.today().isoformat()}
+    ).fetchone()
+    return {'premium_users': total, 'auto_renewal_users': auto_renewal}
+
+def get_user_payments(telegram_id: int, limit: int = 20, connection=None) -> list:
+    """Последние платежи пользователя"""
+    if connection is None:
+        connection = get_connection()
+
+    rows = connection.execute(
+        """
+        SELECT charge_id, amount, currency, plan_days, subscription_end_date, created_at
+        FROM payments
+        WHERE telegram_id = ?
+        ORDER BY created_at DESC
+        LIMIT ?
+        """,
+        (telegram_id, limit)
+    )
+    return [{
+        'charge_id': row[0],
+        'amount': row[1],
+        'currency': row[2],
+        'plan_days': row[3],
+        'subscription_end_date': row[4],
+        'created_at': row[5]
+    } for row in rows]
+
+# Имена запросов для статистики времени выполнения
+query_stats.register_names(globals())
@@ -0,0 +1,188 @@
+# Пользовательские предпочтения: кэш и хранилище ключ/значение
+#
+# Основные предпочтения (эмодзи, стиль, длина ответов) хранятся в полях
+# таблицы users и читаются вместе с контекстом пользователя. Новые
+# предпочтения хранятся в таблице settings как пары ключ/значение
+# (значение - JSON) с уникальным индексом (user_id, key), поэтому для
+# них не нужны новые поля в users.
+#
+# В процессе бота предпочтения читаются из PreferencesCache; изменения
+# записываются в базу и сразу в кэш (write-through). Запись кэша живет не
+# дольше DatabaseConfig.PREFERENCES_CACHE_TTL_SECONDS - на случай изменений
+# из административных скриптов в других процессах.
+
+import json
+import time
+from collections import OrderedDict
+from config import DatabaseConfig
+from storage.connection import get_connection
+from storage.db import preferences_from_row, DEFAULT_PREFERENCES
+from storage.query_stats import query_stats
+
+# Предпочтения из users и все пары из settings одним запросом
+PREFERENCES_QUERY = """
+    SELECT u.use_emojis, u.communication_style, u.preferred_response_length,
+           (SELECT json_group_object(s.key, s.value) FROM settings s WHERE s.user_id = u.id)
+    FROM users u
+    WHERE u.telegram_id = ?
+"""
+
+# Запись значения: новая пара или замена существующей
+SETTING_UPSERT_QUERY = """
+    INSERT INTO settings (user_id, key, value)
+    SELECT id, ?, ? FROM users WHERE telegram_id = ?
+    ON CONFLICT(user_id, key) DO UPDATE SET value = excluded.value
+"""
+
+SETTING_SELECT_QUERY = """
+    SELECT s.value FROM settings s
+    JOIN users u ON u.id = s.user_id
+    WHERE u.telegram_id = ? AND s.key = ?
+"""
+
+SETTING_DELETE_QUERY = """
+    DELETE FROM settings
+    WHERE user_id = (SELECT id FROM users WHERE telegram_id = ?) AND key = ?
+"""
+
+def check_setting_key(key: str):
+    """Основные предпочтения меняются через update_user_preferences, а не через settings"""
+    if key in DEFAULT_PREFERENCES:
+        raise ValueError(f"Предпочтение {key} хранится в таблице users, используйте update_user_preferences")
+
+def encode_setting(value) -> str:
+    """Значение предпочтения в JSON для таблицы settings"""
+    return json.dumps(value, ensure_ascii=False)
+
+def decode_setting(value, default=None):
+    """Значение предпочтения из таблицы settings"""
+    if value is None:
+        return default
+    try:
+        return json.loads(value)
+    except ValueError:
+        # Строки, записанные не через encode_setting
+        return value
+
+def preferences_with_settings_from_row(result) -> dict:
+    """
+    Преобразует строку PREFERENCES_QUERY в словарь предпочтений:
+    поля users плюс пары из settings (поля users имеют приоритет).
+    """
+    preferences = preferences_from_row(result[:3] if result else None)
+    if result and result[3]:
+        for key, value in json.loads(result[3]).items():
+            preferences.setdefault(key, decode_setting(value))
+    return preferences
+
+class PreferencesCache:
+    """LRU кэш словарей предпочтений по telegram_id с истечением записей"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: int = None):
+        self.max_entries = max_entries or DatabaseConfig.PREFERENCES_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or DatabaseConfig.PREFERENCES_CACHE_TTL_SECONDS
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Счетчик изменений: чтение из базы, начатое до изменения, не попадает в кэш
+        self.updates = 0
+
+    def get(self, telegram_id: int) -> dict:
+        """Копия предпочтений из кэша или None, если записи нет или она истекла"""
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        preferences, expires_at = entry
+        if time.time() >= expires_at:
+            del self._entries[telegram_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return dict(preferences)
+
+    def put(self, telegram_id: int, preferences: dict):
+        """Сохраняет предпочтения пользователя на ttl_seconds"""
+        self._entries[telegram_id] = (dict(preferences), time.time() + self.ttl_seconds)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def update(self, telegram_id: int, changes: dict):
+        """Применяет записанные в базу изменения к записи в кэше (если она есть)"""
+        self.updates += 1
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            entry[0].update(changes)
+
+    def discard(self, telegram_id: int, key: str):
+        """Убирает удаленное значение из записи в кэше"""
+        self.updates += 1
+        entry = self._entries.get(telegram_id)
+        if entry is not None:
+            entry[0].pop(key, None)
+
+    def invalidate(self, telegram_id: int):
+        """Сбрасывает запись пользователя"""
+        self.updates += 1
+        self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        """Очищает весь кэш"""
+        self.updates += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
+
+def get_user_setting(telegram_id: int, key: str, default=None, connection=None):
+    """Значение предпочтения key из таблицы settings (или default)"""
+    if connection is None:
+        connection = get_connection()
+
+    result = connection.execute(SETTING_SELECT_QUERY, (telegram_id, key)).fetchone()
+    return decode_setting(result[0], default) if result else default
+
+def set_user_setting(telegram_id: int, key: str, value, connection=None) -> bool:
+    """
+    Записывает предпочтение key в таблицу settings.
+
+    Returns:
+        False, если пользователя нет в базе
+    """
+    check_setting_key(key)
+    if connection is None:
+        connection = get_connection()
+
+    try:
+        cursor = connection.execute(SETTING_UPSERT_QUERY, (key, encode_setting(value), telegram_id))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return cursor.rowcount > 0
+
+def delete_user_setting(telegram_id: int, key: str, connection=None):
+    """Удаляет предпочтение key из таблицы settings"""
+    if connection is None:
+        connection = get_connection()
+
+    try:
+        connection.execute(SETTING_DELETE_QUERY, (telegram_id, key))
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+# Имена запросов для статистики времени выполнения
+query_stats.register_names(globals())
@@ -0,0 +1,87 @@
+# Кэш премиум статуса пользователей в памяти
+#
+# Премиум статус читается несколько раз на каждое сообщение и в каждом
+# платежном callback. Запись кэша живет до конца дня subscription_end_date
+# (подписка действует включительно по эту дату), но не дольше
+# DatabaseConfig.PREMIUM_CACHE_TTL_SECONDS - на случай изменений из
+# административных скриптов в других процессах. Изменения подписки из бота
+# сбрасывают запись сразу.
+
+import time
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from config import DatabaseConfig
+
+def subscription_expires_at(subscription_end) -> float:
+    """Момент окончания подписки (unix time): начало дня, следующего за subscription_end"""
+    end_date = date.fromisoformat(subscription_end)
+    return datetime.combine(end_date + timedelta(days=1), datetime.min.time()).timestamp()
+
+class PremiumCache:
+    """LRU кэш словарей премиум статуса по telegram_id с истечением записей"""
+
+    def __init__(self, max_entries: int = None, ttl_seconds: int = None):
+        self.max_entries = max_entries or DatabaseConfig.PREMIUM_CACHE_MAX_ENTRIES
+        self.ttl_seconds = ttl_seconds or DatabaseConfig.PREMIUM_CACHE_TTL_SECONDS
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Счетчик сбросов: чтение из базы, начатое до сброса, не попадает в кэш
+        self.invalidations = 0
+
+    def get(self, telegram_id: int) -> dict:
+        """Премиум статус из кэша или None, если записи нет или она истекла"""
+        entry = self._entries.get(telegram_id)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        info, expires_at = entry
+        if time.time() >= expires_at:
+            del self._entries[telegram_id]
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(telegram_id)
+        self.hits += 1
+        return dict(info)
+
+    def put(self, telegram_id: int, info: dict):
+        """
+        Сохраняет премиум статус. Активная подписка хранится до момента
+        ее окончания, но не дольше ttl_seconds.
+        """
+        expires_at = time.time() + self.ttl_seconds
+        if info.get('premium_status') and info.get('subscription_end_date'):
+            expires_at = min(expires_at, subscription_expires_at(info['subscription_end_date']))
+
+        self._entries[telegram_id] = (dict(info), expires_at)
+        self._entries.move_to_end(telegram_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, telegram_id: int):
+        """Сбрасывает запись пользователя (после изменения подписки)"""
+        self.invalidations += 1
+        self._entries.pop(telegram_id, None)
+
+    def invalidate_many(self, telegram_ids):
+        """Сбрасывает записи нескольких пользователей"""
+        self.invalidations += 1
+        for telegram_id in telegram_ids:
+            self._entries.pop(telegram_id, None)
+
+    def clear(self):
+        """Очищает весь кэш"""
+        self.invalidations += 1
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        """Статистика кэша"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0
+        }
@@ -0,0 +1,377 @@
+# Статистика времени выполнения запросов к SQLite
+#
+# Соединения открываются с фабрикой TimedConnection: каждый execute,
+# executemany и commit замеряется и попадает в гистограмму своего
+# запроса. Время запроса, возвращающего строки, включает их чтение
+# (fetchone, fetchall, перебор курсора): оно выполняется в том же потоке,
+# в том числе внутри execute_fetchall aiosqlite. Запросы, объявленные
+# константами *_QUERY в storage, учитываются по имени константы. Остальные -
+# по тексту без лишних пробелов с именем функции storage, которая их
+# выполнила, или "ОПЕРАЦИЯ таблица"; таких текстов учитывается не больше
+# DatabaseConfig.QUERY_STATS_MAX_UNNAMED, дальше (динамически собранные
+# запросы) - одна гистограмма на имя функции и операцию.
+#
+# Запросы дольше DatabaseConfig.SLOW_QUERY_MS пишутся в лог и в журнал
+# медленных запросов; план выполнения (EXPLAIN QUERY PLAN) для них
+# строится по запросу: explain_slow_queries() или команда /dbstats explain.
+
+import bisect
+import logging
+import os
+import re
+import sqlite3
+import sys
+import threading
+import time
+from collections import deque
+from config import DatabaseConfig
+
+logger = logging.getLogger(__name__)
+
+# Верхние границы корзин гистограммы (мс); последняя корзина - все, что дольше
+BUCKETS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+_STORAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_STATEMENT_TABLE = re.compile(r"\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+([\w.]+)", re.IGNORECASE)
+
+def normalize_sql(sql: str) -> str:
+    """Текст запроса без лишних пробелов и переводов строк"""
+    return " ".join(sql.split())
+
+def statement_label(sql: str) -> str:
+    """Короткое имя запроса: операция и первая таблица"""
+    words = sql.split(None, 1)
+    if not words:
+        return "EMPTY"
+    table = _STATEMENT_TABLE.search(sql)
+    return f"{words[0].upper()} {table.group(1)}" if table else words[0].upper()
+
+class QueryHistogram:
+    """Гистограмма времени выполнения одного запроса"""
+
+    def __init__(self, name: str, sql: str):
+        self.name = name
+        self.sql = sql
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def observe(self, elapsed_ms: float):
+        """Добавляет одно измерение"""
+        self.count += 1
+        self.total_ms += elapsed_ms
+        if elapsed_ms > self.max_ms:
+            self.max_ms = elapsed_ms
+        self.buckets[bisect.bisect_left(BUCKETS_MS, elapsed_ms)] += 1
+
+    def percentile(self, fraction: float) -> float:
+        """Оценка перцентиля (мс) по верхней границе корзины"""
+        if not self.count:
+            return 0.0
+        threshold = fraction * self.count
+        seen = 0
+        for index, count in enumerate(self.buckets[:-1]):
+            seen += count
+            if seen >= threshold:
+                return min(float(BUCKETS_MS[index]), self.max_ms)
+        return self.max_ms
+
+    def to_dict(self) -> dict:
+        """Сводка по запросу"""
+        return {
+            'name': self.name,
+            'sql': self.sql,
+            'count': self.count,
+            'total_ms': self.total_ms,
+            'avg_ms': self.total_ms / self.count if self.count else 0.0,
+            'p50_ms': self.percentile(0.5),
+            'p95_ms': self.percentile(0.95),
+            'p99_ms': self.percentile(0.99),
+            'max_ms': self.max_ms,
+            'buckets': dict(zip([*map(str, BUCKETS_MS), "inf"], self.buckets))
+        }
+
+class QueryStats:
+    """Гистограммы по запросам и журнал медленных запросов (потокобезопасно)"""
+
+    def __init__(self, slow_query_ms: float = None, slow_log_size: int = None, max_unnamed: int = None):
+        self.slow_query_ms = DatabaseConfig.SLOW_QUERY_MS if slow_query_ms is None else slow_query_ms
+        self.max_unnamed = max_unnamed or DatabaseConfig.QUERY_STATS_MAX_UNNAMED
+        self._lock = threading.Lock()
+        # Гистограммы по имени константы, тексту запроса или имени функции
+        self._queries = {}
+        self._unnamed = 0
+        # Гистограммы по исходному тексту запроса: без нормализации на каждом
+        # вызове; размер ограничен, остальные тексты нормализуются каждый раз
+        self._by_sql = {}
+        self._names = {}
+        self._slow = deque(maxlen=slow_log_size or DatabaseConfig.SLOW_QUERY_LOG_SIZE)
+
+    def register_names(self, namespace: dict):
+        """Запоминает имена констант *_QUERY модуля для подписи запросов"""
+        for name, value in namespace.items():
+            if name.endswith("_QUERY") and isinstance(value, str):
+                self._names[normalize_sql(value)] = name
+
+    def record(self, sql: str, params, elapsed_ms: float):
+        """Добавляет измерение запроса; медленный запрос пишется в лог"""
+        self.observe(self.histogram(sql), sql, params, elapsed_ms)
+
+    def histogram(self, sql: str) -> QueryHistogram:
+        """Гистограмма запроса (создается при первом выполнении)"""
+        # Чтение словаря атомарно: блокировка нужна только для новых запросов
+        histogram = self._by_sql.get(sql)
+        if histogram is not None:
+            return histogram
+        with self._lock:
+            histogram = self._by_sql.get(sql)
+            if histogram is None:
+                histogram = self._histogram_for(normalize_sql(sql))
+                if len(self._by_sql) < 2 * self.max_unnamed + len(self._names):
+                    self._by_sql[sql] = histogram
+            return histogram
+
+    def _histogram_for(self, key: str) -> QueryHistogram:
+        """Гистограмма по имени константы, тексту запроса или, сверх лимита, по имени функции"""
+        name = self._names.get(key)
+        if name is None and key not in self._queries and self._unnamed >= self.max_unnamed:
+            # Динамически собранные тексты одного места в коде учитываются вместе
+            name = self._name_for(key)
+            sql = f"{statement_label(key)} (разные тексты запроса)"
+        else:
+            sql = key
+        bucket = name or key
+        histogram = self._queries.get(bucket)
+        if histogram is None:
+            if name is None:
+                self._unnamed += 1
+            histogram = QueryHistogram(name or self._name_for(key), sql)
+            self._queries[bucket] = histogram
+        return histogram
+
+    def observe(self, histogram: QueryHistogram, sql: str, params, elapsed_ms: float):
+        """Добавляет измерение в гистограмму запроса; медленный запрос пишется в лог"""
+        with self._lock:
+            histogram.observe(elapsed_ms)
+            slow = elapsed_ms >= self.slow_query_ms
+            if slow:
+                self._slow.append({
+                    'name': histogram.name,
+                    'sql': normalize_sql(sql),
+                    'params': params,
+                    'elapsed_ms': elapsed_ms,
+                    'at': time.strftime("%Y-%m-%d %H:%M:%S"),
+                    'plan': None
+                })
+
+        if slow:
+            logger.warning(f"Медленный запрос {histogram.name}: {elapsed_ms:.1f} мс: {normalize_sql(sql)[:200]}")
+
+    def _name_for(self, key: str) -> str:
+        """Имя нового запроса: константа, функция storage или операция и таблица"""
+        name = self._names.get(key)
+        if name:
+            return name
+        # Коммиты всех транзакций учитываются вместе
+        if key == "COMMIT":
+            return key
+
+        label = statement_label(key)
+        frame = sys._getframe(1)
+        while frame is not None:
+            filename = frame.f_code.co_filename
+            if os.path.dirname(os.path.abspath(filename)) == _STORAGE_DIR and not filename.endswith("query_stats.py"):
+                return f"{frame.f_code.co_name}: {label}"
+            frame = frame.f_back
+        return label
+
+    def snapshot(self, sort_by: str = "total_ms", limit: int = None) -> list:
+        """Сводки по запросам, отсортированные по убыванию sort_by"""
+        with self._lock:
+            stats = [histogram.to_dict() for histogram in self._queries.values()]
+        stats.sort(key=lambda item: item[sort_by], reverse=True)
+        return stats[:limit] if limit else stats
+
+    def slow_queries(self) -> list:
+        """Журнал медленных запросов, от старых к новым"""
+        with self._lock:
+            return [dict(entry) for entry in self._slow]
+
+    def explain_slow_queries(self, connection=None) -> list:
+        """
+        Строит EXPLAIN QUERY PLAN для медленных запросов, у которых плана еще нет.
+
+        Returns:
+            Журнал медленных запросов с заполненным полем plan
+        """
+        if connection is None:
+            from storage.connection import get_connection
+            connection = get_connection()
+
+        with self._lock:
+            pending = [entry for entry in self._slow if entry['plan'] is None]
+
+        plans = {}
+        for entry in pending:
+            if entry['sql'] not in plans:
+                plans[entry['sql']] = explain_query(entry['sql'], entry['params'], connection)
+            entry['plan'] = plans[entry['sql']]
+
+        return self.slow_queries()
+
+    def reset(self):
+        """Сбрасывает накопленную статистику"""
+        with self._lock:
+            self._queries.clear()
+            self._by_sql.clear()
+            self._unnamed = 0
+            self._slow.clear()
+
+def explain_query(sql: str, params=(), connection=None) -> list:
+    """
+    План выполнения запроса (строки detail из EXPLAIN QUERY PLAN).
+    Для служебных команд (BEGIN, COMMIT, PRAGMA) возвращает пустой список.
+    """
+    if connection is None:
+        from storage.connection import get_connection
+        connection = get_connection()
+
+    if statement_label(sql).split()[0] not in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "REPLACE"):
+        return []
+    try:
+        rows = connection.execute(f"EXPLAIN QUERY PLAN {sql}", params if params is not None else ()).fetchall()
+    except sqlite3.Error as e:
+        return [f"Не удалось построить план: {e}"]
+    return [row[3] for row in rows]
+
+# Общая статистика процесса
+query_stats = QueryStats()
+
+def _record(sql: str, params, started: float):
+    """Записывает время выполнения запроса, начатого в started (perf_counter)"""
+    query_stats.record(sql, params, (time.perf_counter() - started) * 1000)
+
+def _elapsed_ms(started: float) -> float:
+    return (time.perf_counter() - started) * 1000
+
+class TimedCursor(sqlite3.Cursor):
+    """
+    Курсор, замеряющий время выполнения запросов. Время запроса, который
+    возвращает строки, записывается после чтения всех строк, закрытия курсора
+    или следующего execute и включает время чтения.
+    """
+
+    # Незавершенный запрос: [гистограмма, текст, параметры, время в мс]
+    _query = None
+
+    def execute(self, sql, parameters=()):
+        self._finish()
+        histogram = query_stats.histogram(sql)
+        started = time.perf_counter()
+        try:
+            super().execute(sql, parameters)
+        except BaseException:
+            query_stats.observe(histogram, sql, parameters, _elapsed_ms(started))
+            raise
+        elapsed_ms = _elapsed_ms(started)
+        if self.description is None:
+            # Запрос без результата (INSERT, UPDATE, DELETE) уже выполнен
+            query_stats.observe(histogram, sql, parameters, elapsed_ms)
+        else:
+            self._query = [histogram, sql, parameters, elapsed_ms]
+        return self
+
+    def fetchone(self):
+        started = time.perf_counter()
+        row = super().fetchone()
+        if self._query is not None:
+            self._query[3] += _elapsed_ms(started)
+            if row is None:
+                self._finish()
+        return row
+
+    def fetchmany(self, size=None):
+        size = self.arraysize if size is None else size
+        rows = self._timed(super().fetchmany, size)
+        if len(rows) < size:
+            self._finish()
+        return rows
+
+    def fetchall(self):
+        rows = self._timed(super().fetchall)
+        self._finish()
+        return rows
+
+    def __next__(self):
+        try:
+            return self._timed(super().__next__)
+        except StopIteration:
+            self._finish()
+            raise
+
+    def close(self):
+        self._finish()
+        super().close()
+
+    def __del__(self):
+        try:
+            self._finish()
+        except Exception:
+            pass  # Завершение интерпретатора: модуль уже выгружен
+
+    def _timed(self, method, *args):
+        """Вызывает метод чтения строк, добавляя его время к запросу"""
+        started = time.perf_counter()
+        try:
+            return method(*args)
+        finally:
+            if self._query is not None:
+                self._query[3] += _elapsed_ms(started)
+
+    def _finish(self):
+        """Записывает время незавершенного запроса"""
+        query = self._query
+        if query is not None:
+            self._query = None
+            query_stats.observe(*query)
+
+    def executemany(self, sql, seq_of_parameters):
+        # Для плана запроса сохраняется первый набор параметров
+        seq_of_parameters = iter(seq_of_parameters)
+        first = next(seq_of_parameters, None)
+        if first is None:
+            return super().executemany(sql, ())
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, _prepend(first, seq_of_parameters))
+        finally:
+            _record(sql, first, started)
+
+def _prepend(first, rest):
+    """Возвращает first, затем элементы rest"""
+    yield first
+    yield from rest
+
+class TimedConnection(sqlite3.Connection):
+    """Соединение, у которого все запросы и коммиты попадают в query_stats"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            _record("COMMIT", None, started)
+
+def connection_factory():
+    """Класс соединения для sqlite3.connect (без замеров, если статистика отключена)"""
+    return TimedConnection if DatabaseConfig.QUERY_STATS_ENABLED else sqlite3.Connection
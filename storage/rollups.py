@@ -0,0 +1,282 @@
+# Сводные таблицы статистики сообщений
+#
+# message_stats, user_message_stats и user_daily_activity обновляются
+# триггером при каждой вставке в messages (см. миграцию версии 6).
+# Здесь - функции чтения для /stats и отчетов и полная перестройка
+# сводок по таблице messages и архиву. Сводки хранят итоги за все время;
+# user_message_stats.cleared_message_count - сколько из них скрыто
+# очисткой истории (/clear), /stats показывает разность.
+
+import sqlite3
+from storage.connection import get_connection
+from storage.archive import decode_archive_rows
+
+# Источник данных для перестройки: таблица messages и распакованный архив
+_ROLLUP_SOURCE = """
+    (SELECT user_id, COALESCE(role, 'user') AS role, created_at FROM messages
+     UNION ALL
+     SELECT user_id, role, created_at FROM temp.rollup_archive)
+"""
+
+def rebuild_rollups_with_cursor(cursor: sqlite3.Cursor):
+    """
+    Пересчитывает сводки с нуля. Выполняется в транзакции вызывающего
+    (используется миграцией и rebuild_rollups).
+    """
+    cursor.execute("CREATE TEMP TABLE IF NOT EXISTS rollup_archive (user_id INTEGER, role TEXT, created_at TEXT)")
+    cursor.execute("DELETE FROM temp.rollup_archive")
+
+    # Сообщения, уже перенесенные в архив, тоже учитываются
+    blocks = cursor.execute("SELECT user_id, data FROM message_archive").fetchall()
+    for user_id, data in blocks:
+        cursor.executemany(
+            "INSERT INTO temp.rollup_archive (user_id, role, created_at) VALUES (?, ?, ?)",
+            ((user_id, role or 'user', created_at) for _, role, _, created_at in decode_archive_rows(data))
+        )
+
+    for table in ("message_stats", "user_message_stats", "user_daily_activity"):
+        cursor.execute(f"DELETE FROM {table}")
+
+    cursor.execute(
+        f"""
+        INSERT INTO message_stats (day, hour, role, message_count)
+        SELECT date(created_at), strftime('%H', created_at), role, COUNT(*)
+        FROM {_ROLLUP_SOURCE}
+        GROUP BY 1, 2, 3
+        """
+    )
+    cursor.execute(
+        f"""
+        INSERT INTO user_message_stats (user_id, message_count, user_messages, first_message_at, last_message_at)
+        SELECT user_id, COUNT(*), SUM(role = 'user'), MIN(created_at), MAX(created_at)
+        FROM {_ROLLUP_SOURCE}
+        GROUP BY user_id
+        """
+    )
+    cursor.execute(
+        f"""
+        INSERT INTO user_daily_activity (day, user_id, user_messages, assistant_messages, first_user_message_at, last_user_message_at)
+        SELECT date(created_at), user_id, SUM(role = 'user'), SUM(role != 'user'),
+               MIN(CASE WHEN role = 'user' THEN created_at END),
+               MAX(CASE WHEN role = 'user' THEN created_at END)
+        FROM {_ROLLUP_SOURCE}
+        GROUP BY 1, 2
+        """
+    )
+
+    cursor.execute("DROP TABLE temp.rollup_archive")
+
+def recount_cleared_messages_with_cursor(cursor: sqlite3.Cursor):
+    """
+    Пересчитывает cleared_message_count пользователей, очищавших историю:
+    все учтенные сообщения, кроме оставшихся после отметки history_cleared_id
+    (в таблице messages и в архиве). Выполняется в транзакции вызывающего.
+    """
+    users = cursor.execute("SELECT id, history_cleared_id FROM users WHERE history_cleared_id > 0").fetchall()
+    for user_id, cleared_id in users:
+        visible = cursor.execute(
+            "SELECT COUNT(*) FROM messages WHERE user_id = ? AND id > ?", (user_id, cleared_id)
+        ).fetchone()[0]
+        for (data,) in cursor.execute("SELECT data FROM message_archive WHERE user_id = ?", (user_id,)).fetchall():
+            visible += sum(1 for row in decode_archive_rows(data) if row[0] > cleared_id)
+        cursor.execute(
+            "UPDATE user_message_stats SET cleared_message_count = MAX(message_count - ?, 0) WHERE user_id = ?",
+            (visible, user_id)
+        )
+
+def rebuild_rollups(connection=None) -> dict:
+    """
+    Перестраивает сводки по существующим данным одной транзакцией
+    (для баз после восстановления из копии или ручных правок).
+
+    Returns:
+        Количество строк в каждой сводной таблице
+    """
+    if connection is None:
+        connection = get_connection()
+
+    connection.commit()
+    cursor = connection.cursor()
+    cursor.execute("BEGIN IMMEDIATE")
+    try:
+        rebuild_rollups_with_cursor(cursor)
+        recount_cleared_messages_with_cursor(cursor)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+
+    return {
+        table: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+        for table in ("message_stats", "user_message_stats", "user_daily_activity")
+    }
+
+def get_user_totals(user_id: int, connection=None) -> dict:
+    """Итоги пользователя: всего сообщений, сообщений пользователя, первая и последняя активность"""
+    if connection is None:
+        connection = get_connection()
+
+    row = connection.execute(
+        "SELECT message_count, user_messages, first_message_at, last_message_at FROM user_message_stats WHERE user_id = ?",
+        (user_id,)
+    ).fetchone()
+    if not row:
+        return {'message_count': 0, 'user_messages': 0, 'first_message_at': None, 'last_message_at': None}
+    return {
+        'message_count': row[0],
+        'user_messages': row[1],
+        'first_message_at': row[2],
+        'last_message_at': row[3]
+    }
+
+def get_role_totals(day: str = None, since: str = None, connection=None) -> dict:
+    """
+    Количество сообщений по ролям: за день, начиная с даты или за все время.
+
+    Returns:
+        Словарь {роль: количество}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    if day:
+        where, params = "WHERE day = ?", (day,)
+    elif since:
+        where, params = "WHERE day >= ?", (since,)
+    else:
+        where, params = "", ()
+
+    rows = connection.execute(
+        f"SELECT role, SUM(message_count) FROM message_stats {where} GROUP BY role",
+        params
+    ).fetchall()
+    return {role: count for role, count in rows}
+
+def get_daily_stats(since: str = None, limit: int = None, connection=None) -> list:
+    """
+    Сообщения по дням и ролям, от новых дней к старым.
+
+    Returns:
+        Список словарей {'day', 'user', 'assistant', 'total'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    where, params = ("WHERE day >= ?", [since]) if since else ("", [])
+    query = f"""
+        SELECT day,
+               SUM(CASE WHEN role = 'user' THEN message_count ELSE 0 END),
+               SUM(CASE WHEN role != 'user' THEN message_count ELSE 0 END),
+               SUM(message_count)
+        FROM message_stats {where}
+        GROUP BY day
+        ORDER BY day DESC
+    """
+    if limit:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    return [{
+        'day': row[0],
+        'user': row[1],
+        'assistant': row[2],
+        'total': row[3]
+    } for row in connection.execute(query, params)]
+
+def get_hourly_stats(day: str, role: str = None, connection=None) -> list:
+    """Сообщения по часам за день: список (час, количество)"""
+    if connection is None:
+        connection = get_connection()
+
+    if role:
+        rows = connection.execute(
+            "SELECT hour, message_count FROM message_stats WHERE day = ? AND role = ? ORDER BY hour",
+            (day, role)
+        )
+    else:
+        rows = connection.execute(
+            "SELECT hour, SUM(message_count) FROM message_stats WHERE day = ? GROUP BY hour ORDER BY hour",
+            (day,)
+        )
+    return [(hour, count) for hour, count in rows]
+
+def get_active_users(day: str, connection=None) -> list:
+    """
+    Пользователи, писавшие боту в этот день, по убыванию количества сообщений.
+
+    Returns:
+        Список словарей {'user_id', 'user_messages', 'assistant_messages', 'first_message', 'last_message'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    rows = connection.execute(
+        """
+        SELECT user_id, user_messages, assistant_messages, first_user_message_at, last_user_message_at
+        FROM user_daily_activity
+        WHERE day = ? AND user_messages > 0
+        ORDER BY user_messages DESC
+        """,
+        (day,)
+    )
+    return [{
+        'user_id': row[0],
+        'user_messages': row[1],
+        'assistant_messages': row[2],
+        'first_message': row[3],
+        'last_message': row[4]
+    } for row in rows]
+
+def get_daily_active_users(since: str = None, connection=None) -> list:
+    """Количество активных пользователей по дням (DAU): список (день, пользователей)"""
+    if connection is None:
+        connection = get_connection()
+
+    where, params = ("AND day >= ?", (since,)) if since else ("", ())
+    rows = connection.execute(
+        f"""
+        SELECT day, COUNT(*) FROM user_daily_activity
+        WHERE user_messages > 0 {where}
+        GROUP BY day
+        ORDER BY day DESC
+        """,
+        params
+    )
+    return [(day, count) for day, count in rows]
+
+def get_new_users(day: str, connection=None) -> list:
+    """
+    Пользователи, зарегистрированные в этот день (users.created_at) и
+    написавшие боту: список (user_id, первое сообщение за день)
+    """
+    if connection is None:
+        connection = get_connection()
+
+    rows = connection.execute(
+        """
+        SELECT u.id, a.first_user_message_at
+        FROM users u
+        JOIN user_daily_activity a ON a.user_id = u.id AND a.day = ?
+        WHERE date(u.created_at) = ? AND a.user_messages > 0
+        ORDER BY a.first_user_message_at
+        """,
+        (day, day)
+    )
+    return [(user_id, first_message) for user_id, first_message in rows]
+
+def get_top_users(limit: int = 5, connection=None) -> list:
+    """Самые активные пользователи: список (username, telegram_id, сообщений)"""
+    if connection is None:
+        connection = get_connection()
+
+    rows = connection.execute(
+        """
+        SELECT u.username, u.telegram_id, s.message_count
+        FROM user_message_stats s
+        JOIN users u ON u.id = s.user_id
+        ORDER BY s.message_count DESC
+        LIMIT ?
+        """,
+        (limit,)
+    )
+    return [(username, telegram_id, count) for username, telegram_id, count in rows]
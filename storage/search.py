@@ -0,0 +1,103 @@
+# Полнотекстовый поиск по сообщениям (SQLite FTS5)
+#
+# Индекс messages_fts создается миграцией и поддерживается триггерами
+# на таблице messages. Сообщения, перенесенные в архив, в поиск не входят.
+
+import sqlite3
+from storage.connection import get_connection
+
+def build_match_query(query: str) -> str:
+    """
+    Превращает пользовательскую строку в запрос FTS5: каждое слово
+    ищется как отдельная фраза, все слова должны встретиться (AND).
+    Спецсимволы синтаксиса FTS5 экранируются кавычками.
+    """
+    terms = [term.replace('"', '""') for term in query.split()]
+    return " ".join(f'"{term}"' for term in terms if term)
+
+def search_messages(query: str, user: int = None, since: str = None, limit: int = 20, raw: bool = False, connection=None) -> list:
+    """
+    Ищет сообщения по тексту, лучшие совпадения первыми (bm25).
+
+    Args:
+        query: Строка поиска
+        user: Telegram ID пользователя (None - все пользователи)
+        since: Нижняя граница created_at ('YYYY-MM-DD' или 'YYYY-MM-DD HH:MM:SS')
+        limit: Максимальное количество результатов
+        raw: Передать query в FTS5 как есть (операторы OR, NOT, NEAR, префиксы *)
+        connection: Соединение для чтения (по умолчанию соединение текущего потока)
+
+    Returns:
+        Список словарей {'id', 'user_id', 'telegram_id', 'username', 'role', 'created_at', 'snippet', 'rank'}
+    """
+    if connection is None:
+        connection = get_connection()
+
+    match = query if raw else build_match_query(query)
+    if not match:
+        return []
+
+    # Сообщения, очищенные через /clear, не находятся и до их фонового удаления
+    conditions = ["messages_fts MATCH ?", "m.id > u.history_cleared_id"]
+    params = [match]
+    if user is not None:
+        conditions.append("u.telegram_id = ?")
+        params.append(user)
+    if since:
+        conditions.append("m.created_at >= ?")
+        params.append(since)
+    params.append(limit)
+
+    rows = connection.execute(
+        f"""
+        SELECT m.id, m.user_id, u.telegram_id, u.username, m.role, m.created_at,
+               snippet(messages_fts, 0, '[', ']', '…', 12) AS snippet,
+               bm25(messages_fts) AS rank
+        FROM messages_fts
+        JOIN messages m ON m.id = messages_fts.rowid
+        JOIN users u ON u.id = m.user_id
+        WHERE {' AND '.join(conditions)}
+        ORDER BY rank
+        LIMIT ?
+        """,
+        params
+    ).fetchall()
+
+    return [{
+        'id': row[0],
+        'user_id': row[1],
+        'telegram_id': row[2],
+        'username': row[3],
+        'role': row[4],
+        'created_at': row[5],
+        'snippet': row[6],
+        'rank': row[7]
+    } for row in rows]
+
+def rebuild_search_index(connection=None) -> int:
+    """
+    Полностью перестраивает индекс по таблице messages (заполнение для
+    существующих баз, восстановление после ручных правок в обход триггеров).
+
+    Returns:
+        Количество проиндексированных сообщений
+    """
+    if connection is None:
+        connection = get_connection()
+
+    connection.execute("INSERT INTO messages_fts(messages_fts) VALUES ('rebuild')")
+    connection.execute("INSERT INTO messages_fts(messages_fts) VALUES ('optimize')")
+    connection.commit()
+    return connection.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+def check_search_index(connection=None) -> bool:
+    """Проверяет, что индекс соответствует таблице messages"""
+    if connection is None:
+        connection = get_connection()
+
+    try:
+        connection.execute("INSERT INTO messages_fts(messages_fts, rank) VALUES ('integrity-check', 1)")
+        return True
+    except sqlite3.DatabaseError as e:
+        print(f"Индекс поиска не соответствует сообщениям: {e}")
+        return False
@@ -0,0 +1,133 @@
+# Контекст пользователя для обработки одного входящего сообщения
+
+import json
+from dataclasses import dataclass, field
+from config import LimitsConfig
+from storage.db import (
+    user_from_row, daily_count_for_today, is_subscription_expired,
+    CONSUME_MESSAGE_CREDIT_SET, CONSUME_MESSAGE_CREDIT_RETURNING
+)
+from storage.preferences import preferences_with_settings_from_row
+from storage.query_stats import query_stats
+
+# Поля пользователя, предпочтения из settings в виде JSON-объекта (как в
+# PREFERENCES_QUERY) и последние сообщения истории в виде JSON-массива;
+# параметр {history_limit} - количество сообщений истории
+USER_CONTEXT_COLUMNS = """
+    id, username, created_at, premium_status, subscription_end_date, auto_renewal, subscription_type,
+    use_emojis, communication_style, preferred_response_length,
+    daily_message_count, last_message_date,
+    (SELECT json_group_object(s.key, s.value) FROM settings s WHERE s.user_id = users.id) AS settings,
+    (
+        SELECT json_group_array(json_array(id, message, role, created_at))
+        FROM (
+            SELECT id, message, role, created_at FROM messages
+            WHERE user_id = users.id AND id > users.history_cleared_id
+            ORDER BY created_at DESC, id DESC
+            LIMIT {history_limit}
+        )
+    ) AS history
+"""
+
+# Один запрос: строка пользователя (премиум, счетчики, предпочтения, внутренний id)
+# и последние сообщения истории
+USER_CONTEXT_QUERY = f"""
+    SELECT {USER_CONTEXT_COLUMNS.format(history_limit="?")}
+    FROM users
+    WHERE telegram_id = ?
+"""
+
+# То же самое вместе с атомарным списанием сообщения из дневного лимита:
+# один UPDATE ... RETURNING вместо чтения контекста и отдельной проверки лимита
+USER_CONTEXT_CONSUME_QUERY = f"""
+    UPDATE users SET {CONSUME_MESSAGE_CREDIT_SET}
+    WHERE telegram_id = :telegram_id
+    RETURNING {USER_CONTEXT_COLUMNS.format(history_limit=":history_limit")},
+    {CONSUME_MESSAGE_CREDIT_RETURNING}
+"""
+
+@dataclass
+class UserContext:
+    """
+    Все, что нужно обработчику сообщения о пользователе.
+    Загружается одним запросом в начале обработки; новые реплики
+    копятся в pending_messages и записываются одной транзакцией в конце.
+    message_allowed заполняется, если сообщение уже списано из дневного
+    лимита при загрузке (USER_CONTEXT_CONSUME_QUERY).
+    """
+    telegram_id: int
+    id: int
+    username: str
+    created_at: str
+    premium_status: bool
+    subscription_end_date: str
+    auto_renewal: bool
+    subscription_type: int
+    preferences: dict
+    daily_message_count: int
+    history: list = field(default_factory=list)
+    pending_messages: list = field(default_factory=list)
+    message_allowed: bool = None
+
+    @classmethod
+    def from_row(cls, row, telegram_id: int, limit: int = None) -> "UserContext":
+        """
+        Создает контекст из строки USER_CONTEXT_QUERY или USER_CONTEXT_CONSUME_QUERY.
+        Счетчик сообщений не превышает limit (после отказа в базе хранится limit + 1).
+        """
+        if limit is None:
+            limit = LimitsConfig.DAILY_MESSAGE_LIMIT
+        user = user_from_row(row[:10], telegram_id)
+
+        # Истекшая подписка не дает премиум доступа
+        premium_status = user['premium_status'] and not is_subscription_expired(user['subscription_end_date'])
+
+        # История: от старых к новым
+        history_rows = sorted(json.loads(row[13] or "[]"), key=lambda msg: (msg[3], msg[0]))
+        history = [{
+            'content': msg[1],
+            'role': msg[2],
+            'timestamp': msg[3]
+        } for msg in history_rows]
+
+        return cls(
+            telegram_id=telegram_id,
+            id=user['id'],
+            username=user['username'],
+            created_at=user['created_at'],
+            premium_status=premium_status,
+            subscription_end_date=user['subscription_end_date'],
+            auto_renewal=user['auto_renewal'],
+            subscription_type=user['subscription_type'],
+            # Поля users плюс пары из settings, как в get_user_preferences
+            preferences=preferences_with_settings_from_row(row[7:10] + row[12:13]),
+            daily_message_count=min(daily_count_for_today(row[10:12]), limit),
+            history=history,
+            message_allowed=bool(row[15]) if len(row) > 14 else None
+        )
+
+    def can_send_message(self, limit: int = None) -> bool:
+        """Проверяет дневной лимит сообщений (премиум пользователи без лимита)"""
+        # Решение уже принято атомарно при списании
+        if self.message_allowed is not None:
+            return self.message_allowed
+        if self.premium_status:
+            return True
+        if limit is None:
+            limit = LimitsConfig.DAILY_MESSAGE_LIMIT
+        return self.daily_message_count < limit
+
+    def premium_info(self) -> dict:
+        """Премиум статус в формате get_user_premium_status"""
+        return {
+            "premium_status": bool(self.premium_status),
+            "subscription_end_date": self.subscription_end_date,
+            "auto_renewal": bool(self.auto_renewal)
+        }
+
+    def add_pending_message(self, role: str, content: str):
+        """Добавляет реплику для записи в историю в конце обработки"""
+        self.pending_messages.append((role, content))
+
+# Имена запросов для статистики времени выполнения
+query_stats.register_names(globals())
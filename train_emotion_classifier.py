@@ -0,0 +1,129 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Обучение локального классификатора эмоций.
+
+Берет случайные сообщения пользователей из таблицы messages, размечает
+их эмоцию моделью GPT (тем же запросом, что и бот) и обучает наивный
+Байес (services/emotion_classifier.py). Разметка дописывается в
+EmotionConfig.LABELS_PATH и при следующем запуске не запрашивается
+повторно; модель сохраняется в EmotionConfig.MODEL_PATH и подхватывается
+ботом после перезапуска.
+
+Запуск: python train_emotion_classifier.py [сообщений]
+По умолчанию в разметке должно быть 2000 сообщений; недостающие
+размечаются через GPT (нужен OPENAI_API_KEY). Без ключа модель
+обучается на уже имеющейся разметке.
+"""
+
+import os
+import sys
+import time
+import asyncio
+from collections import Counter
+
+# Добавляем корневую директорию в путь
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from config import EmotionConfig
+from storage.connection import open_readonly_connection
+from services.emotion_classifier import EmotionClassifier, read_labels, append_labels
+from services.gpt_service import detect_emotion_gpt, close_openai_client
+
+# Случайные сообщения пользователей (команды бота пропускаются)
+SAMPLE_MESSAGES_QUERY = """
+    SELECT message FROM messages
+    WHERE role = 'user' AND message NOT LIKE '/%'
+    ORDER BY random()
+    LIMIT ?
+"""
+
+# Разметка сохраняется пачками, чтобы прерванный запуск не терял результат
+LABEL_BATCH_SIZE = 50
+
+def sample_messages(count: int, exclude: set) -> list:
+    """Случайные сообщения пользователей, которых еще нет в разметке"""
+    connection = open_readonly_connection()
+    try:
+        rows = connection.execute(SAMPLE_MESSAGES_QUERY, (count + len(exclude),)).fetchall()
+    finally:
+        connection.close()
+    texts = []
+    for (text,) in rows:
+        text = (text or "").strip()
+        if text and text not in exclude:
+            texts.append(text)
+            exclude.add(text)
+        if len(texts) >= count:
+            break
+    return texts
+
+async def label_message(text: str) -> dict:
+    """Эмоция сообщения по GPT и время ответа"""
+    started = time.perf_counter()
+    label = await detect_emotion_gpt(text)
+    return {'text': text, 'label': label, 'gpt_ms': round((time.perf_counter() - started) * 1000, 1)}
+
+async def label_messages(texts: list) -> int:
+    """Размечает сообщения через GPT; возвращает число размеченных"""
+    labeled = 0
+    try:
+        for start in range(0, len(texts), LABEL_BATCH_SIZE):
+            results = await asyncio.gather(
+                *(label_message(text) for text in texts[start:start + LABEL_BATCH_SIZE]),
+                return_exceptions=True
+            )
+            entries = [result for result in results if isinstance(result, dict)]
+            errors = [result for result in results if isinstance(result, Exception)]
+            append_labels(entries)
+            labeled += len(entries)
+            print(f"   🏷️ Размечено: {labeled}/{len(texts)}")
+            if errors:
+                print(f"   ⚠️ Ошибок GPT: {len(errors)} ({errors[0]})")
+                if not entries:
+                    break
+    finally:
+        await close_openai_client()
+    return labeled
+
+async def main():
+    try:
+        target = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    except ValueError:
+        print("❌ Неверный формат параметров")
+        return
+
+    print("🧠 Обучение классификатора эмоций")
+    print("=" * 60)
+
+    labels = read_labels()
+    print(f"📂 Разметка: {EmotionConfig.LABELS_PATH}, сообщений: {len(labels)}")
+
+    missing = target - len(labels)
+    if missing > 0:
+        if not os.getenv("OPENAI_API_KEY"):
+            print(f"⚠️ OPENAI_API_KEY не задан: {missing} сообщений не размечены, обучение на имеющейся разметке")
+        else:
+            texts = sample_messages(missing, {entry['text'] for entry in labels})
+            print(f"🏷️ Размечаем через GPT: {len(texts)} сообщений")
+            await label_messages(texts)
+            labels = read_labels()
+
+    if not labels:
+        print("❌ Нет размеченных сообщений")
+        return
+
+    started = time.perf_counter()
+    classifier = EmotionClassifier.train((entry['text'], entry['label']) for entry in labels)
+    elapsed = time.perf_counter() - started
+    classifier.save(EmotionConfig.MODEL_PATH)
+
+    print()
+    print(f"✅ Модель обучена за {elapsed:.2f} с: {len(labels)} сообщений, {len(classifier.feature_log_prob)} признаков")
+    for label, count in Counter(entry['label'] for entry in labels).most_common():
+        print(f"   • {label}: {count}")
+    print(f"💾 Сохранено: {EmotionConfig.MODEL_PATH}")
+    print("📊 Точность и скорость: python benchmark_emotion_classifier.py")
+
+if __name__ == "__main__":
+    asyncio.run(main())